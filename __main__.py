@@ -1,21 +1,198 @@
 from flask import Flask, Response, request
+from multiprocessing.connection import Listener
+from werkzeug.serving import make_server
 import argparse
+import hmac
 import json
+import multiprocessing
+import os
+import secrets
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
 
 from .common.json import JSONEncoder
-from .common.constants import DEFAULT_HOST, DEFAULT_PORT
+from .common.constants import DEFAULT_HOST, DEFAULT_PORT, DEFAULT_SNAPSHOT_INTERVAL, DEFAULT_SNAPSHOT_THRESHOLD, DEFAULT_FUZZY_LIMIT, MAX_BATCH_SIZE, DEFAULT_TOP_K, MAX_TOP_K, DEFAULT_NEARBY_K, MAX_NEARBY_K, DEFAULT_REVIEW_SEARCH_LIMIT, MAX_REVIEW_SEARCH_LIMIT, DEFAULT_MAX_RESIDENT, DEFAULT_SESSION_TTL, DEFAULT_HASH_WORKERS, DEFAULT_HASH_QUEUE, DEFAULT_WORKERS, DEFAULT_PUBLISH_INTERVAL, DEFAULT_ASYNC_THREADS, DEFAULT_HEARTBEAT_INTERVAL, DEFAULT_METRICS_INTERVAL, DEFAULT_PROFILE_DIRECTORY, DEFAULT_SLOW_REQUEST, DEFAULT_SAMPLE_INTERVAL, DEFAULT_PROFILES_PER_MINUTE, DEFAULT_PROFILES_KEPT
+from .common.async_server import AsyncServer, heartbeat_event
 from .common.codes import HTTP_CODE
+from .common.compression import gzip_compress
+from .common.metrics import REGISTRY, Registry, Counter, Histogram, Gauge, SIZE_BUCKETS
+from .common.profiler import TracedProfile, Sampler, ProfileWriter
 from .common.review_categories import resolve_category
-from .database.restaurant import RestaurantDatabase
+from .database.restaurant import RestaurantDatabase, WEBPAGE_FIELDS
 from .database.reviews import Review
+from .database.columnar import DEFAULT_PERCENTILES
 from .database.manager import DatabaseManager
+from .database.shards import ShardedStore
+from .database.sqlite_storage import SQLiteStorage
 from .database.users import Users, User
+from .database.passwords import PasswordHasher, PoolSaturated
+from .database.snapshotter import Snapshotter
+from .database.shared_snapshot import SnapshotPublisher, SnapshotReader
+from .database.remote import WriterService, WriterClient, RemoteUsers, RemoteSnapshotter, SnapshotManager, run_worker
 
-from typing import Tuple, List
+from typing import Any, Callable, Dict, List, Tuple
 
 app = Flask(__name__)
-manager = DatabaseManager()
-users = Users()
+# These are created by initialize, since they depend on command-line arguments. In a
+# worker process (see serve_processes), they are stand-ins that read from the shared
+# snapshot and forward everything else to the writer process
+manager : DatabaseManager | SnapshotManager = None
+users : Users | RemoteUsers = None
+snapshotter : Snapshotter | RemoteSnapshotter = None
+# Renders the metrics served at /metrics. In a worker process, these are the metrics of every process
+render_metrics : Callable[[], str] = lambda: Registry.render(REGISTRY.snapshot())
+
+# Where note_route leaves the rule a request matched
+ROUTE_KEY = "backend.route"
+# The header that asks for a request to be profiled (with the profile secret), as it is in the
+# WSGI environment, and the header the name of its profile is sent back in
+PROFILE_ENVIRON = "HTTP_X_PROFILE"
+PROFILE_FILE_HEADER = "X-Profile-File"
+REQUESTS : Counter = REGISTRY.register(Counter("http_requests_total", "Requests served, by route, method and status",
+                                               ("route", "method", "status")))
+LATENCY : Histogram = REGISTRY.register(Histogram("http_request_duration_seconds", "Time taken to handle requests, by route",
+                                                  ("route",)))
+RESPONSE_BYTES : Histogram = REGISTRY.register(Histogram("http_response_bytes", "Size of response bodies, by route",
+                                                         ("route",), SIZE_BUCKETS))
+
+def record_requests(wsgi_app : Callable) -> Callable:
+    """Wraps the WSGI app to record the latency, status and size of every response, under
+    the route it matched (the rule, so that restaurants and queries don't each get their
+    own series, noted by note_route). This reads the response straight from the WSGI call,
+    which costs a fraction of what request hooks reading Flask's context-local proxies do
+
+    Args:
+        wsgi_app (Callable): The WSGI app
+
+    Returns:
+        Callable: The WSGI app, recording every request
+    """
+    def instrumented(environ : Dict, start_response : Callable) -> Any:
+        start = time.perf_counter()
+        response = []
+        def record_start(status : str, headers : List[Tuple[str, str]], exc_info=None) -> Callable:
+            response.append((status, headers))
+            return start_response(status, headers, exc_info)
+        body = wsgi_app(environ, record_start)
+        elapsed = time.perf_counter() - start
+        route = environ.get(ROUTE_KEY, "unmatched")
+        LATENCY.observe(elapsed, route)
+        if response:
+            status, headers = response[-1]
+            REQUESTS.inc(route, environ['REQUEST_METHOD'], status[:3])
+            # Streamed bodies (the heartbeat) have no length until they end
+            for name, value in headers:
+                if name == "Content-Length":
+                    RESPONSE_BYTES.observe(int(value), route)
+                    break
+        return body
+    return instrumented
+
+app.wsgi_app = record_requests(app.wsgi_app)
+
+def profile_requests(wsgi_app : Callable, writer : ProfileWriter, secret : str, slow_request : float,
+                     sample_interval : float = DEFAULT_SAMPLE_INTERVAL) -> Callable:
+    """Wraps the WSGI app to profile requests, writing each profile as collapsed stacks.
+    A request with the secret in its PROFILE_HEADER is traced deterministically, and the name
+    of its profile is sent back in PROFILE_FILE_HEADER. Every other request is sampled, and its
+    samples are written (as far as writer allows each minute) if it took slow_request seconds or more
+
+    Args:
+        wsgi_app (Callable): The WSGI app
+        writer (ProfileWriter): Where profiles are written
+        secret (str): The secret that requests must send to be traced
+        slow_request (float): The seconds a request must take for its samples to be written.
+                              0 samples nothing
+        sample_interval (float, optional): Seconds between samples. Defaults to DEFAULT_SAMPLE_INTERVAL.
+
+    Returns:
+        Callable: The WSGI app, profiling requests
+    """
+    sampler = Sampler(sample_interval)
+    secret = secret.encode('utf-8')
+    def profiled(environ : Dict, start_response : Callable) -> Any:
+        requested = hmac.compare_digest(environ.get(PROFILE_ENVIRON, "").encode('utf-8'), secret)
+        if not requested and not slow_request:
+            return wsgi_app(environ, start_response)
+        start = time.perf_counter()
+        if requested:
+            # The response starts once its profile is written, so that it can name it.
+            # Flask never uses the write callable that start_response returns
+            response = []
+            def record_start(status : str, headers : List[Tuple[str, str]], exc_info=None):
+                response[:] = [status, headers, exc_info]
+            profile = TracedProfile()
+            profile.start()
+            try:
+                body = wsgi_app(environ, record_start)
+            finally:
+                stacks = profile.stop()
+        else:
+            samples = sampler.watch(sys._getframe())
+            try:
+                body = wsgi_app(environ, start_response)
+            finally:
+                sampler.unwatch()
+        elapsed = time.perf_counter() - start
+        if requested or (elapsed >= slow_request and writer.allow()):
+            route = environ.get(ROUTE_KEY, "unmatched").strip("/") or "index"
+            name = writer.write(f"{route}-{round(elapsed * 1000)}ms", stacks if requested else samples)
+            if requested:
+                status, headers, exc_info = response
+                start_response(status, headers + [(PROFILE_FILE_HEADER, name)] if name else headers, exc_info)
+        return body
+    return profiled
+
+@app.before_request
+def note_route():
+    """Notes the rule a request matched in its WSGI environment, where record_requests
+    finds it once the request context is gone
+    """
+    current = request._get_current_object()
+    if current.url_rule:
+        current.environ[ROUTE_KEY] = current.url_rule.rule
+
+def tagged_response(tag : str, encode : Callable[[bool], bytes]) -> Response:
+    """Answers a read with an entity tag, so that a client that already has the current
+    version gets a 304 before the body is made. The body is gzipped if the client accepts it
+
+    Args:
+        tag (str): A tag that changes whenever the body would. It must be read before anything
+                   the body is made from, so that the body is never older than its tag
+        encode (Callable[[bool], bytes]): Makes the JSON body, gzipped if it is given True
+
+    Returns:
+        Response: The response
+    """
+    gzipped = request.accept_encodings['gzip'] > 0
+    etag = tag + ".gz" if gzipped else tag
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=HTTP_CODE.NOT_MODIFIED)
+    else:
+        response = Response(encode(gzipped), content_type="application/json")
+        if gzipped:
+            response.headers['Content-Encoding'] = "gzip"
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    return response
+
+def encode_json(data, gzipped : bool) -> bytes:
+    """Encodes a response body that isn't cached
+
+    Args:
+        data: The data to encode as JSON
+        gzipped (bool): Whether to gzip it
+
+    Returns:
+        bytes: The body
+    """
+    encoded = json.dumps(data, cls=JSONEncoder).encode('utf-8')
+    return gzip_compress(encoded) if gzipped else encoded
 
 
 @app.route('/heartbeat', methods=["GET"])
@@ -23,31 +200,33 @@ def heartbeat():
     """Returns a Stream to indicate that the server is alive
     
     Creates a Server-Side Stream Event that can be continuously
-    used to evaluate that the server is alive
+    used to evaluate that the server is alive. With --asyncio, this
+    is served by the AsyncServer from one shared timer instead, and
+    this route is never reached
     
     Endpoint: /heartbeat
     
     Returns:
-        A sequence of alternating 0s and 1s, separated by 1 second
-        each
+        A sequence of server-sent events with alternating 0s and 1s,
+        separated by 1 second each
     """
     def heartbeat_generator():
         """Generates a heartbeat (0/1)
 
         Yields:
-            int: A sequence of 0s and 1s,
+            bytes: A sequence of events of 0s and 1s,
             separated by 1 second
         """
         import time
         i = 0
         while True:
-            yield i
+            yield heartbeat_event(i)
             i = i ^ 1
-            time.sleep(1)
-    return Response(heartbeat_generator(), content_type="application/octet-stream")
+            time.sleep(DEFAULT_HEARTBEAT_INTERVAL)
+    return Response(heartbeat_generator(), content_type="text/event-stream", headers={'Cache-Control' : "no-cache"})
 
 @app.route('/register_user', methods=["POST"])
-def register_user() -> int:
+def register_user() -> str:
     """Registers a user into the system, and logs them in
     
     Endpoint: /register_user
@@ -58,7 +237,8 @@ def register_user() -> int:
             password : The password for the user
 
     Returns:
-        int: The login token, or common.FAILURE_TOKEN if it doesn't succeed
+        str: The login token (a hex string), or common.FAILURE_TOKEN if it doesn't succeed.
+        The token expires once it goes unused for the session ttl
     """
     
     # Argument Parse
@@ -68,11 +248,14 @@ def register_user() -> int:
     
     # Attempt to Register User
     user = User(name, password)
-    if not users.add_user(user):
-        return f"User not registered, name {name} already exists", HTTP_CODE.BAD_REQUEST
-    
-    # Attempt to login
-    token = users.login(user)
+    try:
+        if not users.add_user(user):
+            return f"User not registered, name {name} already exists", HTTP_CODE.BAD_REQUEST
+        
+        # Attempt to login
+        token = users.login(user)
+    except PoolSaturated:
+        return "Too many logins at once, try again later", HTTP_CODE.SERVICE_UNAVAILABLE
     if not token:
         return "[System Bug] Something has gone wrong on our end!", HTTP_CODE.SERVER_BAD
     
@@ -80,7 +263,7 @@ def register_user() -> int:
     return json.dumps(token, cls=JSONEncoder)
 
 @app.route('/login', methods=["POST"])
-def login() -> int:
+def login() -> str:
     """Attempts to log a user into the system
     
     Endpoint: /login
@@ -91,7 +274,8 @@ def login() -> int:
             password : The password for the user
 
     Returns:
-        int: The login token, or common.FAILURE_TOKEN if it doesn't succeed
+        str: The login token (a hex string), or common.FAILURE_TOKEN if it doesn't succeed.
+        The token expires once it goes unused for the session ttl
     """
     # Argument Parse
     user_information = request.get_json()
@@ -100,7 +284,10 @@ def login() -> int:
     
     # Attempt to login
     user = User(name, password)
-    token = users.login(user)
+    try:
+        token = users.login(user)
+    except PoolSaturated:
+        return "Too many logins at once, try again later", HTTP_CODE.SERVICE_UNAVAILABLE
     if not token:
         if users.contains_name(user.name):
             return f"Incorrect password for user {user.name}", HTTP_CODE.UNAUTHORIZED
@@ -135,22 +322,48 @@ def logout() -> str:
 def search_restaurants() -> List[str]:
     """Provides a list of matching restaurants given a search query
     
-    Endpoint: /search?query=[string]
+    Endpoint: /search?query=[string]&prefix=[bool]&ignore_case=[bool]&limit=[int]&offset=[int]
+              /search?mode=fuzzy&query=[string]&max_distance=[int]&limit=[int]
     
     Arguments:
         query (str): The word entered into the search bar. An empty string
         if not specified
+        prefix (bool): Whether restaurants must start with the query (true/false).
+        Defaults to false
+        ignore_case (bool): Whether to match regardless of case (true/false).
+        Defaults to false
+        limit (int): The most restaurants to return. No limit if not specified
+        (or 10 in fuzzy mode)
+        offset (int): The number of matching restaurants to skip. Defaults to 0
+        mode (str): Either "substring" (the default) or "fuzzy". Fuzzy mode tolerates
+        typos, and ranks the restaurants by how well they match
+        max_distance (int): In fuzzy mode, the most typos allowed per word. Scales
+        with the length of each word if not specified
     
     Return:
         The list of restaurants matching the query. If query is not specified
         or if the query is empty, it returns all restaurants (so, we use this
-        endpoint to also get the names of all restaurants)
+        endpoint to also get the names of all restaurants). The ETag changes
+        whenever a restaurant is added or removed
     """
     # Argument Parse
     query = request.args.get("query", "")
-    
-    # Return List of restaurants matching query
-    return manager.get_restaurant_list(query)
+    mode = request.args.get("mode", "substring")
+    prefix = request.args.get("prefix", "false").lower() == "true"
+    ignore_case = request.args.get("ignore_case", "false").lower() == "true"
+    limit = request.args.get("limit", None, type=int)
+    offset = request.args.get("offset", 0, type=int)
+    max_distance = request.args.get("max_distance", None, type=int)
+    
+    def encode(gzipped : bool) -> bytes:
+        # Return ranked restaurants that are close to the query
+        if mode == "fuzzy":
+            return encode_json(manager.get_ranked_restaurant_list(query, max_distance=max_distance,
+                                                                  limit=limit if limit is not None else DEFAULT_FUZZY_LIMIT), gzipped)
+        
+        # Return List of restaurants matching query
+        return encode_json(manager.get_restaurant_list(query, prefix=prefix, ignore_case=ignore_case, limit=limit, offset=offset), gzipped)
+    return tagged_response(manager.catalog_etag(), encode)
 
 @app.route('/get_data', methods=["GET"])
 def get_data() -> RestaurantDatabase:
@@ -163,20 +376,61 @@ def get_data() -> RestaurantDatabase:
 
     Returns:
         RestaurantDatabase: The restaurant database, which includes
-        all display information about it.
+        all display information about it. The ETag changes whenever
+        the restaurant does
     """
     
     # Argument Parse
     restaurant = request.args.get("restaurant")
     
-    # Get it and check it it exists
-    restaurant_data = manager.get_restaurant(restaurant)
-    
-    if not restaurant:
+    # Check if it exists (and if the client has it already) before getting it
+    tag = manager.restaurant_etag(restaurant)
+    if tag is None:
         return "This restaurant doesn't exist", HTTP_CODE.NOT_FOUND
     
-    # Return the restaurant data
-    return json.dumps(restaurant_data.to_webpage_format(), cls=JSONEncoder)
+    def encode(gzipped : bool) -> bytes:
+        restaurant_data = manager.get_restaurant(restaurant)
+        if not restaurant_data:
+            # It was removed since the tag was read, so this is stale either way
+            return b'null'
+        # Return the restaurant data
+        return restaurant_data.to_webpage_gzip() if gzipped else restaurant_data.to_webpage_json()
+    return tagged_response(tag, encode)
+
+@app.route('/get_data_batch', methods=["GET"])
+def get_data_batch() -> Dict[str, Dict | None]:
+    """Gets data on many restaurants at once, with only the sections that are asked for
+    
+    Endpoint: /get_data_batch?restaurant=<str>...&field=[str]...
+    
+    Arguments:
+        restaurant (List[str]): The names of the restaurants (at most MAX_BATCH_SIZE).
+        Simply keep adding &restaurant=<str> to make a list of restaurants
+        field (List[str]): The sections of the /get_data format to include (summary,
+        accessibility_summary, restaurant_info, review_summary and reviews). Every
+        section if not specified
+
+    Returns:
+        Dict[str, Dict | None]: The requested sections of each restaurant, by name,
+        or null for restaurants that don't exist
+    """
+    
+    # Argument Parse
+    restaurants = request.args.getlist("restaurant")
+    requested = set(request.args.getlist("field"))
+    if len(restaurants) > MAX_BATCH_SIZE:
+        return f"At most {MAX_BATCH_SIZE} restaurants can be requested at once", HTTP_CODE.BAD_REQUEST
+    if not requested.issubset(WEBPAGE_FIELDS):
+        return f"Unknown fields {sorted(requested.difference(WEBPAGE_FIELDS))}, choose from {list(WEBPAGE_FIELDS)}", HTTP_CODE.BAD_REQUEST
+    fields = tuple(field for field in WEBPAGE_FIELDS if field in requested) if requested else WEBPAGE_FIELDS
+    
+    # Put together the cached encoding of each restaurant
+    encoded = []
+    for restaurant in dict.fromkeys(restaurants):
+        restaurant_data = manager.get_restaurant(restaurant)
+        data = restaurant_data.to_webpage_json(fields=fields) if restaurant_data else b'null'
+        encoded.append(json.dumps(restaurant).encode('utf-8') + b': ' + data)
+    return b'{' + b', '.join(encoded) + b'}'
 
 @app.route('/add_review', methods=["POST"])
 def add_review() -> RestaurantDatabase:
@@ -188,7 +442,7 @@ def add_review() -> RestaurantDatabase:
     Arguments:
         restaurant (str): The name of the restaurant
         HTTP Body: A dictionary with the following structure:
-            token : The integer token,
+            token : The login token,
             review : The written review,
             ratings : {category : rating from 0 to 5, or -1 if not specified}
 
@@ -209,18 +463,79 @@ def add_review() -> RestaurantDatabase:
     if not user:
         return "The token provided is invalid for any user", HTTP_CODE.UNAUTHORIZED
     data['user'] = user.name
-    review = Review.from_dict(data)
+    try:
+        review = Review.from_dict(data)
+    except ValueError as error:
+        return str(error), HTTP_CODE.BAD_REQUEST
     
-    # Now, get the restaurant database
-    restaurant_data = manager.get_restaurant(restaurant)
+    # Add the review, which also gets the restaurant database
+    restaurant_data = manager.add_review(restaurant, review)
     if not restaurant_data:
         return "The restaurant provided is not a valid one", HTTP_CODE.NOT_FOUND
     
-    # Add the review
-    restaurant_data.add_review(review)
-    
     # Finally, provide the updated database
-    return json.dumps(restaurant_data.to_webpage_format(), cls=JSONEncoder)
+    return restaurant_data.to_webpage_json()
+
+@app.route('/add_reviews', methods=["POST"])
+def add_reviews() -> List[Dict[str, int | str]]:
+    """Adds many reviews at once, possibly to different restaurants and from different users.
+    Each token is only validated once, and the reviews of each restaurant are applied together
+
+    Endpoint: /add_reviews
+    Data: Reviews
+
+    Arguments:
+        HTTP Body: A dictionary with the following structure:
+            reviews : A list (of at most MAX_BATCH_SIZE) of dictionaries with:
+                token : The login token,
+                restaurant : The name of the restaurant,
+                review : The written review,
+                ratings : {category : rating from 0 to 5, or -1 if not specified}
+
+    Return:
+        A list with the outcome of each review, in order: {status : The HTTP code it would
+        have gotten from /add_review, and error : Why it failed (if it did)}
+    """
+    
+    # Argument Parse
+    data = request.get_json()
+    items = data.get('reviews') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return "The body must have a list of reviews", HTTP_CODE.BAD_REQUEST
+    if len(items) > MAX_BATCH_SIZE:
+        return f"At most {MAX_BATCH_SIZE} reviews can be added at once", HTTP_CODE.BAD_REQUEST
+    
+    # Validate every item, looking up each token once
+    results : List[Dict[str, int | str]] = [None] * len(items)
+    valid : List[Tuple[int, str, Review]] = []
+    tokens = dict()
+    for i, item in enumerate(items):
+        if (not isinstance(item, dict) or not isinstance(item.get('restaurant'), str) or
+            not isinstance(item.get('review', ""), str) or not isinstance(item.get('ratings', dict()), dict)):
+            results[i] = {'status' : HTTP_CODE.BAD_REQUEST, 'error' : "Each review needs a token, a restaurant, a review and ratings"}
+            continue
+        token = item.get('token')
+        if not isinstance(token, str):
+            user = None
+        elif token in tokens:
+            user = tokens[token]
+        else:
+            user = tokens[token] = users.validate_user(token)
+        if not user:
+            results[i] = {'status' : HTTP_CODE.UNAUTHORIZED, 'error' : "The token provided is invalid for any user"}
+            continue
+        try:
+            review = Review(user.name, item.get('ratings', dict()), item.get('review', ""))
+        except ValueError as error:
+            results[i] = {'status' : HTTP_CODE.BAD_REQUEST, 'error' : str(error)}
+            continue
+        valid.append((i, item['restaurant'], review))
+    
+    # Add the valid reviews together
+    added = manager.add_reviews([(restaurant, review) for _, restaurant, review in valid])
+    for (i, _, _), success in zip(valid, added):
+        results[i] = {'status' : HTTP_CODE.SUCCESS} if success else {'status' : HTTP_CODE.NOT_FOUND, 'error' : "The restaurant provided is not a valid one"}
+    return json.dumps(results)
 
 @app.route('/filter_reviews', methods=["GET"])
 def filter_reviews() -> List[Review]:
@@ -234,7 +549,8 @@ def filter_reviews() -> List[Review]:
         Simply keep adding &filter=[str] to make a list of filters
 
     Returns:
-        List[Review]: The list of reviews
+        List[Review]: The list of reviews. The ETag changes whenever
+        the restaurant does
     """
     
     # Argument Parse
@@ -244,41 +560,463 @@ def filter_reviews() -> List[Review]:
     # Parse out filters even more, ignoring bad filters
     filters = [resolve_category(filter) for filter in filters if resolve_category(filter)]
 
-    # Get the restaurant database
-    restaurant_data = manager.get_restaurant(restaurant)
-    if not restaurant_data:
+    # Check if it exists (and if the client has it already) before getting it
+    tag = manager.restaurant_etag(restaurant)
+    if tag is None:
+        return "The restaurant provided is not a valid one", HTTP_CODE.NOT_FOUND
+
+    def encode(gzipped : bool) -> bytes:
+        restaurant_data = manager.get_restaurant(restaurant)
+        return encode_json(restaurant_data.filter_reviews(*filters) if restaurant_data else None, gzipped)
+    return tagged_response(tag, encode)
+
+
+@app.route('/ratings_statistics', methods=["GET"])
+def ratings_statistics() -> Dict[str, Dict]:
+    """Provides detailed rating statistics for a restaurant, or for all restaurants
+    together (for dashboards and exports). This needs numpy to be installed
+    
+    Endpoint: /ratings_statistics?restaurant=[str]&percentile=[int]...
+    
+    Arguments:
+        restaurant (str): The name of the restaurant. All restaurants if not specified
+        percentile (List[int]): The percentiles to compute, each from 0 to 100. Simply keep
+        adding &percentile=[int] to make a list. Defaults to 25, 50, 75 and 90
+
+    Returns:
+        Dict[str, Dict]: For each category with ratings, a dictionary of its count,
+        mean, median, std, percentiles ({percentile : value}) and histogram (the number
+        of ratings of each value from 0 to 5)
+    """
+    
+    # Argument Parse
+    restaurant = request.args.get("restaurant")
+    percentiles = tuple(request.args.getlist("percentile", type=int)) or DEFAULT_PERCENTILES
+    
+    if not all(0 <= percentile <= 100 for percentile in percentiles):
+        return "percentile must be from 0 to 100", HTTP_CODE.BAD_REQUEST
+    try:
+        statistics = manager.get_ratings_statistics(restaurant, percentiles)
+    except ImportError as error:
+        return str(error), HTTP_CODE.SERVER_BAD
+    if statistics is None:
+        return "The restaurant provided is not a valid one", HTTP_CODE.NOT_FOUND
+    return json.dumps(statistics, cls=JSONEncoder)
+
+@app.route('/top', methods=["GET"])
+def top_restaurants() -> List[Dict[str, str | float | int]]:
+    """Provides the restaurants with the highest mean rating in a category
+    (e.g. the most wheelchair accessible with category=RAMP)
+    
+    Endpoint: /top?category=<str>&k=[int]&min_reviews=[int]
+    
+    Arguments:
+        category (str): The category to rank restaurants by
+        k (int): The most restaurants to return, up to MAX_TOP_K. Defaults to DEFAULT_TOP_K
+        min_reviews (int): The fewest ratings in the category a restaurant needs
+        to be ranked. Defaults to 1
+
+    Returns:
+        List[Dict[str, str | float | int]]: For each restaurant, highest mean first,
+        a dictionary of its name (restaurant), mean rating (mean) and number of ratings (count)
+    """
+    
+    # Argument Parse
+    category = resolve_category(request.args.get("category", ""))
+    k = request.args.get("k", DEFAULT_TOP_K, type=int)
+    min_reviews = request.args.get("min_reviews", 1, type=int)
+    
+    if not category:
+        return "The category provided is not a valid one", HTTP_CODE.BAD_REQUEST
+    if not 0 <= k <= MAX_TOP_K:
+        return f"k must be from 0 to {MAX_TOP_K}", HTTP_CODE.BAD_REQUEST
+    return json.dumps(manager.get_top_restaurants(category, k, max(min_reviews, 1)), cls=JSONEncoder)
+
+@app.route('/nearby', methods=["GET"])
+def nearby_restaurants() -> List[Dict]:
+    """Provides the restaurants closest to a location, closest first, optionally
+    only those with good enough ratings (e.g. the closest with a RAMP rating of at least 4).
+    Only restaurants with a latitude and longitude are found
+    
+    Endpoint: /nearby?lat=<float>&lon=<float>&radius=[float]&k=[int]&filter=[str]...&min_rating=[float]
+    
+    Arguments:
+        lat (float): The latitude of the location, in degrees
+        lon (float): The longitude of the location, in degrees
+        radius (float): The furthest a restaurant may be, in kilometers. No limit if not specified
+        k (int): The most restaurants to return, up to MAX_NEARBY_K. Defaults to DEFAULT_NEARBY_K
+        filter (List[str]): The categories a restaurant must have ratings in.
+        Simply keep adding &filter=[str] to make a list of filters
+        min_rating (float): The lowest mean rating a restaurant may have in each
+        filtered category (or, without filters, in every category it has ratings in)
+
+    Returns:
+        List[Dict]: For each restaurant, a dictionary of its name (restaurant), distance
+        in kilometers (distance), latitude, longitude, and mean rating of each
+        category (accessibility_summary)
+    """
+    
+    # Argument Parse
+    latitude = request.args.get("lat", None, type=float)
+    longitude = request.args.get("lon", None, type=float)
+    radius = request.args.get("radius", None, type=float)
+    k = request.args.get("k", DEFAULT_NEARBY_K, type=int)
+    min_rating = request.args.get("min_rating", None, type=float)
+    
+    # Parse out filters even more, ignoring bad filters
+    categories = tuple(resolve_category(filter) for filter in request.args.getlist("filter") if resolve_category(filter))
+    
+    if latitude is None or longitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return "A valid lat and lon must be provided", HTTP_CODE.BAD_REQUEST
+    if radius is not None and not radius >= 0:
+        return "radius must not be negative", HTTP_CODE.BAD_REQUEST
+    if not 0 <= k <= MAX_NEARBY_K:
+        return f"k must be from 0 to {MAX_NEARBY_K}", HTTP_CODE.BAD_REQUEST
+    return json.dumps(manager.get_nearby_restaurants(latitude, longitude, k, radius, categories, min_rating), cls=JSONEncoder)
+
+@app.route('/search_reviews', methods=["GET"])
+def search_reviews() -> Dict:
+    """Provides the reviews whose text matches a search, best match first (ranked with BM25),
+    from one restaurant or from every restaurant
+    
+    Endpoint: /search_reviews?q=<str>&restaurant=[str]&filter=[str]...&offset=[int]&limit=[int]
+    
+    Arguments:
+        q (str): The search. Reviews must contain every word, and every phrase in double quotes
+        (e.g. "narrow door" braille)
+        restaurant (str): The restaurant to search. Every restaurant if not specified
+        filter (List[str]): The categories a review must have rated.
+        Simply keep adding &filter=[str] to make a list of filters
+        offset (int): The number of the best reviews to skip. Defaults to 0
+        limit (int): The most reviews to return, up to MAX_REVIEW_SEARCH_LIMIT. Defaults to DEFAULT_REVIEW_SEARCH_LIMIT
+
+    Returns:
+        Dict: The number of reviews found (total), and for each one returned (hits), a dictionary
+        of its restaurant, user, score, ratings, a snippet of its text (snippet), and the start
+        and end of each searched word in the snippet (highlights)
+    """
+    
+    # Argument Parse
+    query = request.args.get("q", "")
+    restaurant = request.args.get("restaurant", None)
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", DEFAULT_REVIEW_SEARCH_LIMIT, type=int)
+    
+    # Parse out filters even more, ignoring bad filters
+    categories = tuple(resolve_category(filter) for filter in request.args.getlist("filter") if resolve_category(filter))
+    
+    if offset < 0:
+        return "offset must not be negative", HTTP_CODE.BAD_REQUEST
+    if not 0 <= limit <= MAX_REVIEW_SEARCH_LIMIT:
+        return f"limit must be from 0 to {MAX_REVIEW_SEARCH_LIMIT}", HTTP_CODE.BAD_REQUEST
+    results = manager.search_reviews(query, restaurant, categories, offset, limit)
+    if results is None:
         return "The restaurant provided is not a valid one", HTTP_CODE.NOT_FOUND
+    return json.dumps(results, cls=JSONEncoder)
+
+@app.route('/storage_stats', methods=["GET"])
+def storage_stats() -> Dict[str, int | float | bool]:
+    """Provides statistics about how restaurants are stored
+    
+    Endpoint: /storage_stats
+
+    Returns:
+        Dict[str, int | float | bool]: The kind of storage (json, sharded or sqlite), the
+        number of restaurants and how many are resident in memory. With sharded or sqlite
+        storage, also the capacity, hits, misses, hit_rate, evictions, and total and average
+        load time (seconds)
+    """
+    return json.dumps(manager.storage_stats(), cls=JSONEncoder)
+
+@app.route('/session_stats', methods=["GET"])
+def session_stats() -> Dict[str, int | float]:
+    """Provides statistics about login sessions
+    
+    Endpoint: /session_stats
+
+    Returns:
+        Dict[str, int | float]: The number of active sessions, logged-in users and pending
+        expiry entries, the number of sessions ever created, ended by logging out and evicted
+        because they expired, and the session ttl (seconds)
+    """
+    return json.dumps(users.session_stats(), cls=JSONEncoder)
+
+@app.route('/auth_stats', methods=["GET"])
+def auth_stats() -> Dict[str, Dict[str, int | float]]:
+    """Provides statistics about password hashing
+    
+    Endpoint: /auth_stats
+
+    Returns:
+        Dict[str, Dict[str, int | float]]: hashing: the workers, pending, peak_pending and
+        max_pending jobs of the hashing pool, the number of jobs and rejected jobs, and the
+        total and average time (seconds) jobs spent running and waiting for a worker.
+        login_cache: the size, capacity, hits, misses, hit_rate and ttl (seconds) of the
+        cache of recent successful logins
+    """
+    return json.dumps(users.auth_stats(), cls=JSONEncoder)
+
+@app.route('/snapshot_stats', methods=["GET"])
+def snapshot_stats() -> Dict[str, int | float]:
+    """Provides statistics about the background snapshots of the databases
+    
+    Endpoint: /snapshot_stats
+
+    Returns:
+        Dict[str, int | float]: The number of snapshots and failures, the duration
+        (seconds), bytes written and dirty-set size of the last snapshot, the totals
+        of those, and the number of changes that are not yet in a snapshot
+    """
+    return json.dumps(snapshotter.stats(), cls=JSONEncoder)
 
-    return json.dumps(restaurant_data.reviews.filter(*filters), cls=JSONEncoder)    
+@app.route('/metrics', methods=["GET"])
+def metrics() -> str:
+    """Provides the metrics of the server, for Prometheus to scrape
 
+    Endpoint: /metrics
 
-def parse_args() -> Tuple[str, int, bool]:
+    Returns:
+        str: In the Prometheus text format: the count, latency and response sizes of requests
+        by route, the time spent in named spans of the databases, and gauges of the restaurants,
+        reviews, sessions, pending changes and cache hit rates. With --workers, the counts and
+        histograms of every worker are added up
+    """
+    return Response(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def parse_args(argv : List[str] | None = None) -> argparse.Namespace:
     """Parses out arguments on the command line for this program
     
     Parameters (Command-Line):
         --host (str): The host to run the server on
         --port (int): The port to run the server on
         --debug (bool): Specifying this flag will print debug messages for the server
+        --snapshot-interval (float): The longest time, in seconds, between snapshots of the data
+        --snapshot-threshold (int): The number of changes that triggers a snapshot early
+        --shards (str): A directory to store each restaurant in a separate file in
+        --sqlite (str): A SQLite database to store restaurants, reviews and users in
+        --max-resident (int): With --shards or --sqlite, the most restaurants to keep in memory
+        --session-ttl (float): How long, in seconds, a login lasts without being used
+        --hash-workers (int): The number of threads that hash passwords
+        --hash-queue (int): The most password hashes that may be pending before logins are refused
+        --workers (int): The number of worker processes to serve requests with (0 to serve them in this process)
+        --asyncio (bool): Specifying this flag serves requests from an asyncio event loop instead of a thread each
+        --async-threads (int): With --asyncio, the number of threads that run requests
+        --profile (bool): Specifying this flag profiles slow requests, and requests that send the profile secret
+        --profile-secret (str): The secret that requests send in X-Profile to be profiled (random if not given)
+        --profile-dir (str): The directory profiles are written into
+        --slow-request (float): With --profile, the seconds after which a request's profile is written (0 for never)
+        --profiles-per-minute (int): With --profile, the most profiles of slow requests written each minute
+        --profiles-kept (int): With --profile, the most profiles kept in the directory
+
+    Args:
+        argv (List[str] | None, optional): The arguments to parse. Defaults to None,
+                                           for the command-line arguments.
 
     Returns:
-        Tuple[str, int, bool]: The host (str), port (int), and debug flag (bool) that
-        is used to create the server (comes from command-line arguments)
+        argparse.Namespace: The host (str), port (int), debug flag (bool), snapshot_interval (float),
+        snapshot_threshold (int), shards (str | None), sqlite (str | None), max_resident (int),
+        session_ttl (float), hash_workers (int), hash_queue (int), workers (int), asyncio (bool),
+        async_threads (int), profile (bool), profile_secret (str | None), profile_dir (str), slow_request (float),
+        profiles_per_minute (int) and profiles_kept (int) that are used to create the server (comes from
+        command-line arguments)
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port for Server")
     parser.add_argument("--host", type=str, default=DEFAULT_HOST, help="Host for Server")
     parser.add_argument("--debug", action="store_true", default=False)
-    
-    args = parser.parse_args()
-    return args.host, args.port, args.debug
+    parser.add_argument("--snapshot-interval", type=float, default=DEFAULT_SNAPSHOT_INTERVAL, help="Seconds between snapshots")
+    parser.add_argument("--snapshot-threshold", type=int, default=DEFAULT_SNAPSHOT_THRESHOLD, help="Changes that trigger a snapshot")
+    storage = parser.add_mutually_exclusive_group()
+    storage.add_argument("--shards", type=str, default=None, help="Directory to shard restaurants into")
+    storage.add_argument("--sqlite", type=str, default=None, help="SQLite database to store everything in")
+    parser.add_argument("--max-resident", type=int, default=DEFAULT_MAX_RESIDENT, help="Restaurants kept in memory with a store")
+    parser.add_argument("--session-ttl", type=float, default=DEFAULT_SESSION_TTL, help="Seconds a login lasts while unused")
+    parser.add_argument("--hash-workers", type=int, default=DEFAULT_HASH_WORKERS, help="Threads that hash passwords")
+    parser.add_argument("--hash-queue", type=int, default=DEFAULT_HASH_QUEUE, help="Pending password hashes allowed")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Worker processes (0 for none)")
+    parser.add_argument("--asyncio", action="store_true", default=False, help="Serve from an asyncio event loop")
+    parser.add_argument("--async-threads", type=int, default=DEFAULT_ASYNC_THREADS, help="Threads that run requests with --asyncio")
+    parser.add_argument("--profile", action="store_true", default=False, help="Profile slow requests, and requests with the secret")
+    parser.add_argument("--profile-secret", type=str, default=None, help="Secret requests send in X-Profile to be profiled")
+    parser.add_argument("--profile-dir", type=str, default=DEFAULT_PROFILE_DIRECTORY, help="Directory to write profiles into")
+    parser.add_argument("--slow-request", type=float, default=DEFAULT_SLOW_REQUEST, help="Seconds that make a request slow (0 for none)")
+    parser.add_argument("--profiles-per-minute", type=int, default=DEFAULT_PROFILES_PER_MINUTE, help="Slow request profiles written each minute")
+    parser.add_argument("--profiles-kept", type=int, default=DEFAULT_PROFILES_KEPT, help="Profiles kept in the directory")
+    
+    args = parser.parse_args(argv)
+    if args.workers and (args.shards or args.sqlite):
+        parser.error("--workers needs every restaurant in memory, so it can't be used with --shards or --sqlite")
+    if args.profile and not args.profile_secret:
+        # Made here, so that every worker gets the same one
+        args.profile_secret = secrets.token_urlsafe(16)
+    return args
+
+def register_gauges(writer : bool):
+    """Registers the gauges of this process, which are read from the databases whenever
+    metrics are rendered. Cache hit rates are labeled with the process, since every worker
+    has its own caches
+
+    Args:
+        writer (bool): Whether this process owns the databases, and so reports their sizes
+    """
+    process = multiprocessing.current_process().name
+    def hit_rates() -> Dict[Tuple[str, str], float]:
+        rates = {("search", process) : manager.fuzzy_cache.hit_rate()}
+        storage = manager.storage_stats()
+        if 'hit_rate' in storage:
+            rates[("storage", process)] = storage['hit_rate']
+        if writer:
+            rates[("login", process)] = users.auth_stats()['login_cache']['hit_rate']
+        return rates
+    REGISTRY.register(Gauge("cache_hit_rate", "Share of lookups that hit, by cache and process", hit_rates, ("cache", "process")))
+    if not writer:
+        return
+    REGISTRY.register(Gauge("restaurants", "Restaurants in the database", lambda: manager.storage_stats()['restaurants']))
+    REGISTRY.register(Gauge("reviews", "Reviews of every restaurant (only without a store)", manager.count_reviews))
+    REGISTRY.register(Gauge("sessions_active", "Login sessions that have not ended", lambda: users.session_stats()['active']))
+    REGISTRY.register(Gauge("pending_changes", "Changes not yet in a snapshot", lambda: snapshotter.stats()['pending']))
+
+def report_metrics(client : WriterClient):
+    """Reports the metrics of this worker to the writer every DEFAULT_METRICS_INTERVAL seconds,
+    so that /metrics served by any worker includes the others'
+
+    Args:
+        client (WriterClient): The client of the writer
+    """
+    process = multiprocessing.current_process().name
+    while True:
+        time.sleep(DEFAULT_METRICS_INTERVAL)
+        try:
+            client.call('report_metrics', process, REGISTRY.snapshot())
+        except (OSError, EOFError):
+            return
+
+def enable_profiling(args : argparse.Namespace):
+    """Profiles requests in this process, if args ask for it (see profile_requests)
+
+    Args:
+        args (argparse.Namespace): The arguments from parse_args
+    """
+    if args.profile:
+        writer = ProfileWriter(args.profile_dir, per_minute=args.profiles_per_minute, kept=args.profiles_kept)
+        app.wsgi_app = profile_requests(app.wsgi_app, writer, args.profile_secret, args.slow_request)
+
+def initialize(args : argparse.Namespace):
+    """Loads the restaurant and user databases that the endpoints serve
+
+    Args:
+        args (argparse.Namespace): The arguments from parse_args
+    """
+    global manager, users, snapshotter
+    store = None
+    if args.shards:
+        store = ShardedStore(args.shards)
+    elif args.sqlite:
+        store = SQLiteStorage(args.sqlite)
+    manager = DatabaseManager(store=store, max_resident=args.max_resident)
+    users = Users(store=store, session_ttl=args.session_ttl,
+                  hasher=PasswordHasher(workers=args.hash_workers, max_pending=args.hash_queue))
+    snapshotter = Snapshotter(manager, users, interval=args.snapshot_interval, dirty_threshold=args.snapshot_threshold)
+    register_gauges(writer=True)
+    enable_profiling(args)
+
+def serve_worker(server_socket : socket.socket, args : argparse.Namespace, address : str, authkey : bytes,
+                 directory : str, generation : multiprocessing.Value):
+    """Serves requests in a worker process, on a listening socket shared with the other workers.
+    Reads are served from the shared snapshot, and everything else is forwarded to the writer
+
+    Args:
+        server_socket (socket.socket): The listening socket
+        args (argparse.Namespace): The arguments from parse_args
+        address (str): The address of the writer
+        authkey (bytes): The key to authenticate with the writer
+        directory (str): The directory the writer publishes snapshots into
+        generation (multiprocessing.Value): The generation of the latest snapshot
+    """
+    global manager, users, snapshotter, render_metrics
+    client = WriterClient(address, authkey)
+    manager = SnapshotManager(SnapshotReader(directory, generation), client, max_resident=args.max_resident)
+    users = RemoteUsers(client)
+    snapshotter = RemoteSnapshotter(client)
+    register_gauges(writer=False)
+    enable_profiling(args)
+    render_metrics = lambda: client.call('metrics', multiprocessing.current_process().name, REGISTRY.snapshot())
+    threading.Thread(target=report_metrics, args=(client,), name="metrics", daemon=True).start()
+    if args.asyncio:
+        AsyncServer(app, args.host, args.port, threads=args.async_threads, multiprocess=True).run(server_socket)
+        return
+    try:
+        make_server(args.host, args.port, app, threaded=True, fd=server_socket.fileno()).serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def interrupt(signum : int, frame):
+    """Handles a signal by raising KeyboardInterrupt, so that it shuts down cleanly
+
+    Args:
+        signum (int): The signal
+        frame: The frame that was running
+    """
+    raise KeyboardInterrupt
+
+def serve_processes(args : argparse.Namespace):
+    """Serves requests with args.workers worker processes, while this process is the writer:
+    it owns the databases, applies every change, and publishes snapshots for the workers to read.
+    Being terminated stops the workers too
+
+    Args:
+        args (argparse.Namespace): The arguments from parse_args
+    """
+    context = multiprocessing.get_context('spawn')
+    directory = tempfile.mkdtemp(prefix="restaurant-snapshots-")
+    generation = context.Value('Q', 0)
+    publisher = SnapshotPublisher(manager, directory, generation, DEFAULT_PUBLISH_INTERVAL)
+    publisher.publish()
+    publisher.start()
+    
+    address = os.path.join(directory, "writer.sock")
+    authkey = secrets.token_bytes(32)
+    listener = Listener(address, authkey=authkey)
+    service = WriterService(manager, users, snapshotter, publisher)
+    threading.Thread(target=service.serve, args=(listener,), name="writer", daemon=True).start()
+    
+    server_socket = socket.create_server((args.host, int(args.port)))
+    workers = [context.Process(target=run_worker, args=(__spec__.name, server_socket, args, address, authkey, directory, generation),
+                               name=f"worker-{i}") for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    signal.signal(signal.SIGTERM, interrupt)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        publisher.stop()
+        listener.close()
+        server_socket.close()
+        shutil.rmtree(directory, ignore_errors=True)
 
 if __name__ == "__main__":
     """Runs the flask server
     """
-    host, port, debug = parse_args()
-    print(host, port, debug)
-    app.run(host=host, port=port, debug=debug)
+    args = parse_args()
+    print(args.host, args.port, args.debug)
+    if args.profile:
+        print(f"Profiling into {args.profile_dir}, send X-Profile: {args.profile_secret} to profile a request")
+    initialize(args)
+    snapshotter.start()
+    if args.workers:
+        serve_processes(args)
+    elif args.asyncio:
+        AsyncServer(app, args.host, args.port, threads=args.async_threads).run()
+    else:
+        app.run(host=args.host, port=args.port, debug=args.debug)
     # Save all data
     print("Saving user and restaurant data, please wait")
+    snapshotter.stop()
     users.save()
     manager.save()
\ No newline at end of file
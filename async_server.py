@@ -0,0 +1,328 @@
+import asyncio
+import io
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import unquote_to_bytes
+
+from .constants import DEFAULT_HEARTBEAT_INTERVAL, DEFAULT_ASYNC_THREADS
+
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+# The most bytes of request line and headers, and of request body, that are accepted
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 16 * 1024 * 1024
+# A heartbeat client whose socket has this many bytes it has not read yet is dropped
+MAX_HEARTBEAT_BACKLOG = 4 * 1024
+
+HEARTBEAT_PATH = "/heartbeat"
+HEARTBEAT_HEADERS = (b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\n"
+                     b"Connection: close\r\n\r\n")
+
+def heartbeat_event(beat : int) -> bytes:
+    """Encodes a heartbeat as a server-sent event
+
+    Args:
+        beat (int): The heartbeat (0/1)
+
+    Returns:
+        bytes: The event
+    """
+    return b"data: %d\n\n" % beat
+
+class Heartbeat:
+    """A Heartbeat streams the same alternating 0/1 server-sent events to every connected
+    client from a single timer, so a client costs only its connection rather than a thread
+    or a task that wakes up on its own. A client that stops reading is dropped
+    """
+
+    def __init__(self, interval : float = DEFAULT_HEARTBEAT_INTERVAL):
+        """Creates a Heartbeat. Nothing is sent until run is started
+
+        Args:
+            interval (float, optional): The seconds between heartbeats. Defaults to DEFAULT_HEARTBEAT_INTERVAL.
+        """
+        self.interval = interval
+        self.clients : Set[asyncio.StreamWriter] = set()
+        self.beat = 0
+        self.beats = 0
+        self.dropped = 0
+        self.peak_clients = 0
+
+    async def run(self):
+        """Sends a heartbeat to every client each interval, forever. Beats are scheduled
+        from when this started, so slow rounds don't make them drift
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        while True:
+            self.beats += 1
+            await asyncio.sleep(max(0.0, start + self.beats * self.interval - loop.time()))
+            self.beat ^= 1
+            event = heartbeat_event(self.beat)
+            for writer in list(self.clients):
+                if writer.transport.get_write_buffer_size() > MAX_HEARTBEAT_BACKLOG:
+                    self.clients.discard(writer)
+                    self.dropped += 1
+                    writer.transport.abort()
+                else:
+                    writer.write(event)
+
+    async def stream(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        """Streams heartbeats to a client until it disconnects or is dropped
+
+        Args:
+            reader (asyncio.StreamReader): The client's connection
+            writer (asyncio.StreamWriter): The client's connection
+        """
+        writer.write(HEARTBEAT_HEADERS + heartbeat_event(self.beat))
+        self.clients.add(writer)
+        self.peak_clients = max(self.peak_clients, len(self.clients))
+        try:
+            # Anything the client sends is ignored; it only matters when it hangs up
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(writer)
+
+    def stats(self) -> Dict[str, int | float]:
+        """Gets statistics about the heartbeat
+
+        Returns:
+            Dict[str, int | float]: The number of connected clients and the most that were ever
+            connected at once, the number of clients dropped for not reading, and the interval
+        """
+        return {'clients' : len(self.clients), 'peak_clients' : self.peak_clients,
+                'dropped' : self.dropped, 'interval' : self.interval}
+
+class AsyncServer:
+    """An AsyncServer serves a WSGI application over HTTP/1.1 from an asyncio event loop.
+    Connections, and streaming /heartbeat, are handled on the loop, so idle and heartbeat
+    connections don't hold a thread. Every other request is run on a bounded pool of
+    threads, since the application (and the storage behind it) blocks
+    """
+
+    def __init__(self, app : Callable, host : str, port : int, threads : int = DEFAULT_ASYNC_THREADS,
+                 heartbeat : Heartbeat | None = None, multiprocess : bool = False):
+        """Creates an AsyncServer. Nothing is served until serve is run
+
+        Args:
+            app (Callable): The WSGI application
+            host (str): The host to serve on
+            port (int): The port to serve on
+            threads (int, optional): The threads that run the application. Defaults to DEFAULT_ASYNC_THREADS.
+            heartbeat (Heartbeat | None, optional): The heartbeat to stream. Defaults to None, for a new one.
+            multiprocess (bool, optional): If other processes serve the same application. Defaults to False.
+        """
+        self.app = app
+        self.host = host
+        self.port = int(port)
+        self.threads = threads
+        self.heartbeat = heartbeat if heartbeat else Heartbeat()
+        self.multiprocess = multiprocess
+        self.executor : ThreadPoolExecutor | None = None
+
+    async def serve(self, sock : Any = None):
+        """Serves until cancelled
+
+        Args:
+            sock (Any, optional): A listening socket to serve on instead of host and port
+                                  (e.g. one shared with other processes). Defaults to None.
+        """
+        self.executor = ThreadPoolExecutor(self.threads, thread_name_prefix="async-server")
+        if sock is not None:
+            server = await asyncio.start_server(self.handle, sock=sock, limit=MAX_HEADER_BYTES)
+        else:
+            server = await asyncio.start_server(self.handle, self.host, self.port, limit=MAX_HEADER_BYTES)
+        heartbeat = asyncio.create_task(self.heartbeat.run())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            heartbeat.cancel()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, sock : Any = None):
+        """Serves until interrupted, blocking the calling thread
+
+        Args:
+            sock (Any, optional): A listening socket to serve on instead of host and port. Defaults to None.
+        """
+        try:
+            asyncio.run(self.serve(sock))
+        except KeyboardInterrupt:
+            pass
+
+    async def handle(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        """Serves the requests on a connection, until either side closes it
+
+        Args:
+            reader (asyncio.StreamReader): The connection
+            writer (asyncio.StreamWriter): The connection
+        """
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    return
+                except asyncio.LimitOverrunError:
+                    writer.write(self.error(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE))
+                    return
+                request = self.parse(head)
+                if request is None:
+                    writer.write(self.error(HTTPStatus.BAD_REQUEST))
+                    return
+                method, path, version, headers = request
+                if method == "GET" and path.split("?", 1)[0] == HEARTBEAT_PATH:
+                    await self.heartbeat.stream(reader, writer)
+                    return
+
+                if "transfer-encoding" in headers:
+                    writer.write(self.error(HTTPStatus.LENGTH_REQUIRED))
+                    return
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= MAX_BODY_BYTES:
+                    writer.write(self.error(HTTPStatus.BAD_REQUEST))
+                    return
+                body = await reader.readexactly(length) if length else b""
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+                environ = self.environ(method, path, version, headers, body, writer.get_extra_info("peername"))
+                response, keep_alive = await asyncio.get_running_loop().run_in_executor(self.executor, self.call, environ, keep_alive)
+                writer.write(response)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # The server is shutting down, and this is the connection's own task
+            pass
+        finally:
+            writer.close()
+
+    def parse(self, head : bytes) -> Tuple[str, str, str, Dict[str, str]] | None:
+        """Parses the request line and headers of a request
+
+        Args:
+            head (bytes): The request line and headers, up to and including the blank line
+
+        Returns:
+            Tuple[str, str, str, Dict[str, str]] | None: The method, target, HTTP version and
+            headers (by lowercase name) of the request, or None if it is malformed
+        """
+        lines = head.decode('latin-1').split("\r\n")
+        parts = lines[0].split(" ")
+        if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+            return None
+        headers = dict()
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, separator, value = line.partition(":")
+            if not separator:
+                return None
+            name = name.strip().lower()
+            value = value.strip()
+            headers[name] = headers[name] + "," + value if name in headers else value
+        return parts[0], parts[1], parts[2], headers
+
+    def environ(self, method : str, target : str, version : str, headers : Dict[str, str],
+                body : bytes, peer : Tuple | None) -> Dict[str, Any]:
+        """Builds the WSGI environment of a request
+
+        Args:
+            method (str): The method
+            target (str): The path and query string
+            version (str): The HTTP version
+            headers (Dict[str, str]): The headers, by lowercase name
+            body (bytes): The body
+            peer (Tuple | None): The address of the client
+
+        Returns:
+            Dict[str, Any]: The environment
+        """
+        path, _, query = target.partition("?")
+        environ = {
+            'REQUEST_METHOD' : method,
+            'SCRIPT_NAME' : "",
+            'PATH_INFO' : unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING' : query,
+            'SERVER_NAME' : self.host,
+            'SERVER_PORT' : str(self.port),
+            'SERVER_PROTOCOL' : version,
+            'REMOTE_ADDR' : peer[0] if peer else "",
+            'CONTENT_LENGTH' : str(len(body)),
+            'wsgi.version' : (1, 0),
+            'wsgi.url_scheme' : "http",
+            'wsgi.input' : io.BytesIO(body),
+            'wsgi.errors' : sys.stderr,
+            'wsgi.multithread' : True,
+            'wsgi.multiprocess' : self.multiprocess,
+            'wsgi.run_once' : False,
+        }
+        for name, value in headers.items():
+            if name == "content-type":
+                environ['CONTENT_TYPE'] = value
+            elif name != "content-length":
+                environ['HTTP_' + name.upper().replace("-", "_")] = value
+        return environ
+
+    def call(self, environ : Dict[str, Any], keep_alive : bool) -> Tuple[bytes, bool]:
+        """Runs the application on a request, on a thread of the pool
+
+        Args:
+            environ (Dict[str, Any]): The WSGI environment of the request
+            keep_alive (bool): If the client asked for the connection to stay open
+
+        Returns:
+            Tuple[bytes, bool]: The whole response, and if the connection stays open after it
+        """
+        response : List[Any] = []
+        def start_response(status : str, headers : List[Tuple[str, str]], exc_info : Any = None):
+            response[:] = [status, headers]
+        try:
+            result = self.app(environ, start_response)
+            try:
+                body = b"".join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except Exception:
+            traceback.print_exc()
+            return self.error(HTTPStatus.INTERNAL_SERVER_ERROR), False
+
+        status, headers = response
+        head = environ['REQUEST_METHOD'] == "HEAD"
+        if head:
+            body = b""
+        lines = [f"HTTP/1.1 {status}"]
+        lines += [f"{name}: {value}" for name, value in headers if name.lower() != "connection"]
+        # The application's Content-Length is kept, since a HEAD response has the length of the GET
+        # response without its body. The length is only worked out when the application left it out
+        if not head and not any(name.lower() == "content-length" for name, _ in headers):
+            lines.append(f"Content-Length: {len(body)}")
+        lines.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body, keep_alive
+
+    def error(self, status : HTTPStatus) -> bytes:
+        """Encodes an error response, after which the connection is closed
+
+        Args:
+            status (HTTPStatus): The error
+
+        Returns:
+            bytes: The whole response
+        """
+        body = status.phrase.encode('latin-1')
+        return (f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: text/plain\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode('latin-1') + body
@@ -0,0 +1,339 @@
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ..common.constants import DEFAULT_ZIPF_EXPONENT, DEFAULT_CATEGORY_DENSITY, DEFAULT_SEED
+from ..common.json import JSONEncoder
+from ..common.review_categories import CATEGORIES
+from .generator import DatasetGenerator
+from .manager import DatabaseManager
+from .reviews import Review
+from .users import Users
+
+from typing import Any, Callable, Dict, List, Tuple
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The restaurants and reviews of each scale
+SCALES = {'1k' : (100, 1000), '100k' : (2000, 100000), '1m' : (10000, 1000000)}
+DEFAULT_ITERATIONS = 1000
+# How much slower (or bigger) than the baseline a measurement can be before it is a regression
+DEFAULT_THRESHOLD = 0.1
+
+def peak_rss() -> int | None:
+    """Gets the most memory this process has had resident at once
+
+    Returns:
+        int | None: The peak resident set size, in bytes, or None where it can't be measured
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, and macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def time_calls(function : Callable, calls : List[Tuple]) -> Dict[str, float | int]:
+    """Times a function on each of a list of arguments, one call at a time
+
+    Args:
+        function (Callable): The function
+        calls (List[Tuple]): The arguments of each call
+
+    Returns:
+        Dict[str, float | int]: The number of calls, the mean, median and 95th percentile of how
+        long they took (seconds), and the calls per second
+    """
+    durations = []
+    for arguments in calls:
+        start = time.perf_counter()
+        function(*arguments)
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    total = sum(durations)
+    return {'calls' : len(durations), 'mean' : total / len(durations), 'median' : durations[len(durations) // 2],
+            'p95' : durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+            'ops_per_second' : len(durations) / total if total else 0.0}
+
+def run_scale(database_file : str, users_file : str, iterations : int, seed : int) -> Dict[str, Any]:
+    """Benchmarks every hot path on a generated dataset. This is run in a process of its own, so
+    that its peak memory is that of the dataset alone
+
+    Args:
+        database_file (str): The database file
+        users_file (str): The users file
+        iterations (int): How many calls to time of each benchmark
+        seed (int): The seed of the queries and reviews
+
+    Returns:
+        Dict[str, Any]: How long loading took (seconds), the memory resident after loading and at
+        peak (bytes), how long a full save (which writes the binary snapshot too) took, and the
+        timings of each benchmark (see time_calls)
+    """
+    directory = os.path.dirname(database_file)
+    rng = random.Random(seed)
+    results : Dict[str, Any] = dict()
+
+    start = time.perf_counter()
+    manager = DatabaseManager(database_file, os.path.join(directory, "database.journal"))
+    results['load_seconds'] = time.perf_counter() - start
+    results['rss_after_load_bytes'] = peak_rss()
+    start = time.perf_counter()
+    Users(users_file, os.path.join(directory, "users.journal"))
+    results['users_load_seconds'] = time.perf_counter() - start
+
+    names = list(manager.restaurant_map)
+    largest = max(names, key=lambda name: len(manager.restaurant_map[name].reviews))
+    def sample_names() -> List[str]:
+        return [rng.choice(names) for _ in range(iterations)]
+    def fragment(name : str) -> str:
+        start = rng.randrange(len(name))
+        return name[start:start + rng.randint(3, 6)]
+    def typo(name : str) -> str:
+        i = rng.randrange(len(name) - 1)
+        return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+    def categories() -> Tuple:
+        return tuple(rng.sample(CATEGORIES, rng.randint(1, 2)))
+    def review() -> Review:
+        return Review(f"Benchmark Reviewer {rng.randrange(10 ** 9)}",
+                      {category.name : rng.randint(0, 5) for category in rng.sample(CATEGORIES, rng.randint(1, 4))},
+                      "benchmark review")
+
+    benchmarks = dict()
+    # Searches, for parts of names, starts of names, and names with a typo
+    benchmarks['search'] = time_calls(manager.get_restaurant_list, [(fragment(name),) for name in sample_names()])
+    benchmarks['search_prefix'] = time_calls(lambda query: manager.get_restaurant_list(query, prefix=True),
+                                             [(name[:rng.randint(1, 8)],) for name in sample_names()])
+    benchmarks['search_fuzzy'] = time_calls(manager.get_ranked_restaurant_list,
+                                            [(typo(name),) for name in sample_names()])
+    # Filters, of any restaurant and of the one with the most reviews
+    benchmarks['filter'] = time_calls(lambda name, filter: manager.restaurant_map[name].reviews.filter(*filter),
+                                      [(name, categories()) for name in sample_names()])
+    benchmarks['filter_largest'] = time_calls(lambda filter: manager.restaurant_map[largest].reviews.filter(*filter),
+                                              [(categories(),) for _ in range(iterations)])
+    # Serialization, without the webpage cache, with it, and of the restaurant with the most reviews
+    benchmarks['to_webpage_format'] = time_calls(lambda name: json.dumps(manager.restaurant_map[name].to_webpage_format(), cls=JSONEncoder),
+                                                 [(name,) for name in sample_names()])
+    benchmarks['to_webpage_json_cached'] = time_calls(lambda name: manager.restaurant_map[name].to_webpage_json(),
+                                                      [(name,) for name in sample_names()])
+    benchmarks['to_webpage_format_largest'] = time_calls(lambda: json.dumps(manager.restaurant_map[largest].to_webpage_format(), cls=JSONEncoder),
+                                                         [() for _ in range(max(1, iterations // 100))])
+    start = time.perf_counter()
+    written, _ = manager.save()
+    results['save_seconds'] = time.perf_counter() - start
+    results['save_bytes'] = written
+    # Adding reviews, in memory only, and durably through the manager (journaled and fsynced)
+    benchmarks['reviews_add_review'] = time_calls(lambda name, review: manager.restaurant_map[name].reviews.add_review(review),
+                                                  [(name, review()) for name in sample_names()])
+    benchmarks['add_review'] = time_calls(manager.add_review, [(name, review()) for name in sample_names()])
+    manager.journal.close()
+
+    results['peak_rss_bytes'] = peak_rss()
+    results['benchmarks'] = benchmarks
+    return results
+
+def run_startup(database_file : str, binary : bool) -> Dict[str, Any]:
+    """Benchmarks starting up from the saved database file, either from its JSON or from its
+    binary snapshot. This is run in a process of its own, so that nothing is cached or resident yet,
+    and with an empty journal, so that only the load itself is measured
+
+    Args:
+        database_file (str): The database file, saved along with its binary snapshot
+        binary (bool): Whether to load from the binary snapshot
+
+    Returns:
+        Dict[str, Any]: Whether the binary snapshot was used, how long loading took (seconds), the
+        memory resident after loading (bytes), and how long encoding the webpage format of the
+        restaurant with the most reviews took the first time (seconds)
+    """
+    journal_file = os.path.join(os.path.dirname(database_file), f"startup-{os.getpid()}.journal")
+    try:
+        start = time.perf_counter()
+        manager = DatabaseManager(database_file, journal_file, binary=binary)
+        results : Dict[str, Any] = {'binary' : manager.snapshot is not None, 'load_seconds' : time.perf_counter() - start,
+                                    'rss_after_load_bytes' : peak_rss()}
+        largest = max(manager.restaurant_map.values(), key=lambda restaurant_data: len(restaurant_data.reviews))
+        start = time.perf_counter()
+        largest.to_webpage_json()
+        results['first_largest_seconds'] = time.perf_counter() - start
+        manager.journal.close()
+    finally:
+        os.remove(journal_file)
+    return results
+
+def spawn(function : str, *args : Any) -> Any:
+    """Calls a function of this module in a fresh process, spawned rather than forked, so that
+    nothing of this process counts towards its memory. When this is run as a script, the function
+    is taken from this module under its own name, since the spawned process can't find functions in __main__
+
+    Args:
+        function (str): The name of the function
+        args (varargs, Any): Its arguments
+
+    Returns:
+        Any: What it returned
+    """
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(getattr(importlib.import_module(__spec__.name), function), *args).result()
+
+def run(scales : List[str], iterations : int = DEFAULT_ITERATIONS, seed : int = DEFAULT_SEED,
+        density : float = DEFAULT_CATEGORY_DENSITY, exponent : float = DEFAULT_ZIPF_EXPONENT) -> Dict[str, Any]:
+    """Generates the dataset of each scale, and benchmarks it in a fresh process
+
+    Args:
+        scales (List[str]): The scales to run, out of SCALES
+        iterations (int, optional): How many calls to time of each benchmark. Defaults to DEFAULT_ITERATIONS.
+        seed (int, optional): The seed of the datasets, queries and reviews. Defaults to DEFAULT_SEED.
+        density (float, optional): The chance a review rates each category. Defaults to DEFAULT_CATEGORY_DENSITY.
+        exponent (float, optional): The Zipf exponent of reviews per restaurant. Defaults to DEFAULT_ZIPF_EXPONENT.
+
+    Returns:
+        Dict[str, Any]: What was run and where (meta), and the dataset and results of each scale
+    """
+    report = {'meta' : {'python' : platform.python_version(), 'platform' : platform.platform(),
+                        'processor' : platform.processor(), 'cpus' : os.cpu_count(),
+                        'time' : time.strftime("%Y-%m-%dT%H:%M:%S%z"), 'iterations' : iterations,
+                        'seed' : seed, 'density' : density, 'exponent' : exponent},
+              'scales' : dict()}
+    for scale in scales:
+        restaurants, reviews = SCALES[scale]
+        directory = tempfile.mkdtemp(prefix=f"benchmark-{scale}-")
+        try:
+            database_file = os.path.join(directory, "database.json")
+            users_file = os.path.join(directory, "users.json")
+            start = time.perf_counter()
+            dataset = DatasetGenerator(restaurants, reviews, density, exponent, seed=seed).write(database_file, users_file)
+            dataset['generate_seconds'] = time.perf_counter() - start
+            print(f"{scale}: generated {dataset}", file=sys.stderr)
+
+            results = spawn('run_scale', database_file, users_file, iterations, seed)
+            print(f"{scale}: loaded in {results['load_seconds']:.2f}s", file=sys.stderr)
+            # Startup, from the file run_scale saved, through each format
+            results['startup'] = {kind : spawn('run_startup', database_file, kind == 'binary')
+                                  for kind in ('json', 'binary')}
+            print(f"{scale}: started in {results['startup']['json']['load_seconds']:.2f}s from JSON and "
+                  f"{results['startup']['binary']['load_seconds']:.2f}s from the binary snapshot", file=sys.stderr)
+            report['scales'][scale] = {'dataset' : dataset, **results}
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return report
+
+def measurements(results : Dict[str, Any]) -> Dict[str, float]:
+    """Picks out what is compared between runs from the results of a scale
+
+    Args:
+        results (Dict[str, Any]): The results of a scale
+
+    Returns:
+        Dict[str, float]: Each measurement, by name, where lower is better
+    """
+    picked = {name : results[name] for name in ('load_seconds', 'users_load_seconds', 'save_seconds', 'peak_rss_bytes')
+              if results.get(name) is not None}
+    for name, timings in results['benchmarks'].items():
+        picked[f"{name}.median"] = timings['median']
+    for kind, startup in results.get('startup', dict()).items():
+        for name in ('load_seconds', 'rss_after_load_bytes', 'first_largest_seconds'):
+            if startup.get(name) is not None:
+                picked[f"startup_{kind}.{name}"] = startup[name]
+    return picked
+
+def compare(report : Dict[str, Any], baseline : Dict[str, Any], threshold : float = DEFAULT_THRESHOLD) -> Tuple[List[str], int]:
+    """Compares a run against a baseline, scale by scale. Only runs on the same machine are comparable
+
+    Args:
+        report (Dict[str, Any]): The run
+        baseline (Dict[str, Any]): The baseline
+        threshold (float, optional): How much worse than the baseline a measurement can be before it
+                                     is a regression. Defaults to DEFAULT_THRESHOLD.
+
+    Returns:
+        Tuple[List[str], int]: A line for each measurement in both, and the number of regressions
+    """
+    lines = [f"{'scale':<6} {'measurement':<34} {'baseline':>12} {'current':>12} {'change':>8}"]
+    regressions = 0
+    for scale, results in report['scales'].items():
+        if scale not in baseline['scales']:
+            continue
+        current, before = measurements(results), measurements(baseline['scales'][scale])
+        for name in current:
+            if name not in before or not before[name]:
+                continue
+            change = current[name] / before[name] - 1
+            regressed = change > threshold
+            regressions += regressed
+            lines.append(f"{scale:<6} {name:<34} {before[name]:>12.6g} {current[name]:>12.6g} {change:>+8.1%}"
+                         + ("  REGRESSION" if regressed else ""))
+    return lines, regressions
+
+def parse_args(argv : List[str] | None = None) -> argparse.Namespace:
+    """Parses out arguments on the command line for the benchmarks
+
+    Parameters (Command-Line):
+        --scales (List[str]): The scales to run
+        --iterations (int): How many calls to time of each benchmark
+        --seed (int): The seed
+        --density (float): The chance a review rates each category
+        --exponent (float): The Zipf exponent of reviews per restaurant
+        --output (str): The file to write the results to
+        --baseline (str): The results of an earlier run to compare against
+        --threshold (float): How much worse than the baseline is a regression
+
+    Args:
+        argv (List[str] | None, optional): The arguments to parse. Defaults to None,
+                                           for the command-line arguments.
+
+    Returns:
+        argparse.Namespace: The scales (List[str]), iterations (int), seed (int), density (float),
+        exponent (float), output (str | None), baseline (str | None) and threshold (float) to run with
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks loading, startup, search, filtering, adding reviews and serialization on generated datasets")
+    parser.add_argument("--scales", type=str, nargs="+", choices=list(SCALES), default=list(SCALES), help="Scales to run")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="Calls timed per benchmark")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed")
+    parser.add_argument("--density", type=float, default=DEFAULT_CATEGORY_DENSITY, help="Chance a review rates each category")
+    parser.add_argument("--exponent", type=float, default=DEFAULT_ZIPF_EXPONENT, help="Zipf exponent of reviews per restaurant")
+    parser.add_argument("--output", type=str, default=None, help="File to write the results to (JSON)")
+    parser.add_argument("--baseline", type=str, default=None, help="Results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Fraction worse than the baseline that is a regression")
+    return parser.parse_args(argv)
+
+def main(argv : List[str] | None = None) -> int:
+    """Runs the benchmarks, writes their results, and compares them against a baseline
+
+    Args:
+        argv (List[str] | None, optional): The arguments. Defaults to None, for the command-line arguments.
+
+    Returns:
+        int: 1 if anything regressed against the baseline, otherwise 0
+    """
+    args = parse_args(argv)
+    report = run(args.scales, args.iterations, args.seed, args.density, args.exponent)
+    encoded = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(encoded)
+    else:
+        print(encoded)
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline, 'r') as file:
+        baseline = json.load(file)
+    lines, regressions = compare(report, baseline, args.threshold)
+    print("\n".join(lines), file=sys.stderr)
+    print(f"{regressions} regression(s) over {args.threshold:.0%}", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
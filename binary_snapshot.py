@@ -0,0 +1,351 @@
+import gc
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+
+from ..common.constants import UNRATED, BINARY_SNAPSHOT_EXTENSION
+from ..common.files import write_atomically
+from ..common.json import JSONEncoder
+from ..common.review_categories import ReviewCategory, CATEGORIES
+from .restaurant import RestaurantDatabase, RestaurantInfo
+from .reviews import Review, Reviews
+
+from typing import Dict, Iterator, List, Set, Tuple
+
+# A binary snapshot is written next to the database file every time it is saved, so the server
+# can start without parsing the JSON. It is only used while the database file still has the size
+# and modification time it was saved with, so a database file that was replaced (or edited) since
+# is loaded from JSON instead.
+#
+# The file is the HEADER, the string table, the index and then a block for each restaurant:
+#   - The string table is the offset of each string (and of the end of the last one) as
+#     u64s, followed by the strings in UTF-8. The first strings are the users, and the rest are
+#     the names of the restaurants, in order.
+#   - The index is INDEX_ENTRY for each restaurant: the offset and length of its block, and the
+#     offset and length of its JSON in the database file, so the JSON of restaurants that
+#     haven't changed can be copied into the next save without encoding it again.
+#   - A block is BLOCK_HEADER (the number of reviews n, the sum and count of the ratings of
+#     each category and the length of the restaurant info), the restaurant info as JSON,
+#     the user of each review (u32 indices into the string table), the offset of each written
+#     review (and of the end of the last one) as u32s, the packed scores of each review
+#     (see Review) and then the written reviews in UTF-8.
+# Everything is little-endian. Users keep their index from one save to the next, so the block
+# of a restaurant that didn't change is copied as it is.
+MAGIC = b"RVWSNAP\n"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIIIQQQ")
+OFFSET = struct.Struct("<Q")
+INDEX_ENTRY = struct.Struct("<QQQQ")
+BLOCK_HEADER = struct.Struct(f"<I{len(CATEGORIES)}I{len(CATEGORIES)}II")
+# Maps each packed score to 1 if it is a rating, and 0 if it is UNRATED
+RATED = bytes(0 if score == UNRATED else 1 for score in range(256))
+
+def binary_path(database_file : str) -> str:
+    """Gets the binary snapshot that goes with a database file
+
+    Args:
+        database_file (str): The database file
+
+    Returns:
+        str: The path of its binary snapshot
+    """
+    return os.path.splitext(database_file)[0] + BINARY_SNAPSHOT_EXTENSION
+
+def fingerprint(file_name : str) -> Tuple[int, int]:
+    """Identifies the contents of a file without reading it
+
+    Args:
+        file_name (str): The file
+
+    Returns:
+        Tuple[int, int]: Its size, and its modification time in nanoseconds
+    """
+    status = os.stat(file_name)
+    return status.st_size, status.st_mtime_ns
+
+class UserTable:
+    """A UserTable numbers the users who wrote reviews, for the blocks of binary snapshots.
+    Users are only ever added, so the number of a user never changes
+    """
+
+    def __init__(self, users : List[str] | None = None):
+        """Creates a UserTable
+
+        Args:
+            users (List[str] | None, optional): The users numbered so far, in order. Defaults to None, for none.
+        """
+        self.users = users or []
+        self.numbers = {user : i for i, user in enumerate(self.users)}
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def number(self, user : str) -> int:
+        """Gets the number of a user, numbering them if they weren't numbered yet
+
+        Args:
+            user (str): The user
+
+        Returns:
+            int: Their number
+        """
+        number = self.numbers.get(user)
+        if number is None:
+            number = self.numbers[user] = len(self.users)
+            self.users.append(user)
+        return number
+
+def encode_block(data : Dict[str, Dict], users : UserTable) -> bytes:
+    """Encodes the block of a restaurant
+
+    Args:
+        data (Dict[str, Dict]): The restaurant, in RestaurantDatabase dictionary format (as to_dict makes it)
+        users (UserTable): The numbers of the users, which new users are added to
+
+    Returns:
+        bytes: The block
+    """
+    info = json.dumps(data['restaurant_info'], cls=JSONEncoder).encode('utf-8')
+    reviews : List[Review] = list(data['reviews']['reviews'].values())
+    texts = [review.review.encode('utf-8') for review in reviews]
+    count = len(reviews)
+    return b"".join([
+        BLOCK_HEADER.pack(count, *(data['reviews']['ratings_sum'][category] for category in CATEGORIES),
+                          *(data['reviews']['ratings_count'][category] for category in CATEGORIES), len(info)),
+        info,
+        struct.pack(f"<{count}I", *(users.number(review.user) for review in reviews)),
+        struct.pack(f"<{count + 1}I", *itertools.accumulate(map(len, texts), initial=0)),
+        *(review.scores for review in reviews),
+        *texts])
+
+def encode_snapshot(names : List[str], blocks : List[bytes], spans : List[Tuple[int, int]],
+                    users : UserTable, database_fingerprint : Tuple[int, int]) -> Iterator[bytes]:
+    """Encodes a binary snapshot
+
+    Args:
+        names (List[str]): The name of each restaurant, in order
+        blocks (List[bytes]): The block of each restaurant
+        spans (List[Tuple[int, int]]): The offset and length of the JSON of each restaurant in the database file
+        users (UserTable): The numbers of the users in the blocks
+        database_fingerprint (Tuple[int, int]): The fingerprint of the database file
+
+    Yields:
+        bytes: Consecutive chunks of the binary snapshot
+    """
+    strings = [string.encode('utf-8') for string in itertools.chain(users.users, names)]
+    string_offsets = list(itertools.accumulate(map(len, strings), initial=0))
+    index_offset = HEADER.size + OFFSET.size * len(string_offsets) + string_offsets[-1]
+    # Keep the index and the blocks after it aligned
+    padding = -index_offset % OFFSET.size
+    index_offset += padding
+    yield HEADER.pack(MAGIC, VERSION, len(CATEGORIES), len(names), len(users), 0, *database_fingerprint, index_offset)
+    yield struct.pack(f"<{len(string_offsets)}Q", *string_offsets)
+    yield b"".join(strings) + bytes(padding)
+    index = []
+    offset = index_offset + INDEX_ENTRY.size * len(names)
+    for block, (json_offset, json_length) in zip(blocks, spans):
+        index.append(INDEX_ENTRY.pack(offset, len(block), json_offset, json_length))
+        offset += len(block)
+    yield b"".join(index)
+    yield from blocks
+
+def write_snapshot(file_name : str, names : List[str], blocks : List[bytes], spans : List[Tuple[int, int]],
+                   users : UserTable, database_fingerprint : Tuple[int, int]) -> int:
+    """Writes a binary snapshot atomically
+
+    Args:
+        file_name (str): The binary snapshot file to write
+        names (List[str]): The name of each restaurant, in order
+        blocks (List[bytes]): The block of each restaurant
+        spans (List[Tuple[int, int]]): The offset and length of the JSON of each restaurant in the database file
+        users (UserTable): The numbers of the users in the blocks
+        database_fingerprint (Tuple[int, int]): The fingerprint of the database file
+
+    Returns:
+        int: The number of bytes written
+    """
+    return write_atomically(file_name, encode_snapshot(names, blocks, spans, users, database_fingerprint))
+
+class PackedReviews:
+    """PackedReviews are the reviews of a restaurant in a block of a binary snapshot, which
+    are only turned into Review objects once something reads them (see Reviews.from_packed).
+    The aggregates are read right away, since summaries and leaderboards only need those
+    """
+    __slots__ = ('snapshot', 'offset', 'count', 'sums', 'counts', 'info')
+
+    def __init__(self, snapshot : 'BinarySnapshot', offset : int):
+        """Reads the header of a block
+
+        Args:
+            snapshot (BinarySnapshot): The snapshot the block is in
+            offset (int): The offset of the block
+        """
+        categories = len(CATEGORIES)
+        head = BLOCK_HEADER.unpack_from(snapshot.map, offset)
+        self.snapshot = snapshot
+        self.offset = offset + BLOCK_HEADER.size
+        self.count : int = head[0]
+        self.sums : Tuple[int, ...] = head[1:1 + categories]
+        self.counts : Tuple[int, ...] = head[1 + categories:1 + 2 * categories]
+        self.info : int = head[-1]
+
+    def read_info(self) -> Dict[str, str | float]:
+        """Reads the restaurant info of the block
+
+        Returns:
+            Dict[str, str | float]: The restaurant info, in RestaurantInfo dictionary format
+        """
+        return json.loads(self.snapshot.map[self.offset:self.offset + self.info])
+
+    def materialize(self) -> Tuple[Dict[str, Review], Dict[str, int], Dict[ReviewCategory, Set[str]]]:
+        """Makes the reviews of the block
+
+        Returns:
+            Tuple[Dict[str, Review], Dict[str, int], Dict[ReviewCategory, Set[str]]]: The reviews,
+            the position of each reviewer and the reviewers who rated each category, as Reviews holds them
+        """
+        data = self.snapshot.map
+        categories = len(CATEGORIES)
+        count = self.count
+        position = self.offset + self.info
+        numbers = struct.unpack_from(f"<{count}I", data, position)
+        position += 4 * count
+        text_offsets = struct.unpack_from(f"<{count + 1}I", data, position)
+        position += 4 * (count + 1)
+        scores = data[position:position + categories * count]
+        position += categories * count
+        texts = data[position:position + text_offsets[-1]]
+
+        users = [self.snapshot.user(number) for number in numbers]
+        # Reviews can't make reference cycles, so collecting garbage while a large restaurant's are
+        # made would only take time (more than making them does)
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            reviews = {user : Review.from_packed(user, scores[i * categories:(i + 1) * categories],
+                                                 texts[text_offsets[i]:text_offsets[i + 1]].decode('utf-8'))
+                       for i, user in enumerate(users)}
+        finally:
+            if collecting:
+                gc.enable()
+        order = {user : i for i, user in enumerate(users)}
+        tagged = {category : set(itertools.compress(users, scores[i::categories].translate(RATED)))
+                  for i, category in enumerate(CATEGORIES)}
+        return reviews, order, tagged
+
+class BinarySnapshot:
+    """A BinarySnapshot is a binary snapshot file, memory-mapped read-only
+    """
+
+    def __init__(self, path : str):
+        """Maps a binary snapshot file
+
+        Args:
+            path (str): The binary snapshot file
+
+        Raises:
+            ValueError: If it isn't a binary snapshot this version can read
+        """
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise ValueError(f"{path} is not a binary snapshot")
+        (magic, version, categories, self.restaurants, users, _,
+         size, modified, self.index_offset) = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION or categories != len(CATEGORIES):
+            raise ValueError(f"{path} is not a version {VERSION} binary snapshot with {len(CATEGORIES)} categories")
+        self.fingerprint = (size, modified)
+        self.strings = HEADER.size + OFFSET.size * (users + self.restaurants + 1)
+        # Users are decoded the first time a review of theirs is
+        self.users : List[str | None] = [None] * users
+
+    @staticmethod
+    def open(database_file : str) -> 'BinarySnapshot | None':
+        """Maps the binary snapshot of a database file, if it has one that is up to date
+
+        Args:
+            database_file (str): The database file
+
+        Returns:
+            BinarySnapshot | None: The binary snapshot, or None if there isn't one, it can't be
+            read, or the database file has changed since it was written
+        """
+        try:
+            snapshot = BinarySnapshot(binary_path(database_file))
+        except (OSError, ValueError):
+            return None
+        if snapshot.fingerprint != fingerprint(database_file):
+            return None
+        return snapshot
+
+    def string(self, number : int) -> str:
+        """Reads a string of the string table
+
+        Args:
+            number (int): Its number
+
+        Returns:
+            str: The string
+        """
+        start, = OFFSET.unpack_from(self.map, HEADER.size + OFFSET.size * number)
+        end, = OFFSET.unpack_from(self.map, HEADER.size + OFFSET.size * (number + 1))
+        return sys.intern(self.map[self.strings + start:self.strings + end].decode('utf-8'))
+
+    def user(self, number : int) -> str:
+        """Gets a user of the string table
+
+        Args:
+            number (int): Their number
+
+        Returns:
+            str: The user
+        """
+        user = self.users[number]
+        if user is None:
+            user = self.users[number] = self.string(number)
+        return user
+
+    def user_table(self) -> UserTable:
+        """Makes a UserTable of every user of this, to write the next binary snapshot with
+
+        Returns:
+            UserTable: The users, with the numbers they have in this
+        """
+        return UserTable([self.user(number) for number in range(len(self.users))])
+
+    def entry(self, i : int) -> Tuple[int, int, int, int]:
+        """Reads the index entry of a restaurant
+
+        Args:
+            i (int): The position of the restaurant
+
+        Returns:
+            Tuple[int, int, int, int]: The offset and length of its block, and the offset and
+            length of its JSON in the database file
+        """
+        return INDEX_ENTRY.unpack_from(self.map, self.index_offset + INDEX_ENTRY.size * i)
+
+    def entries(self) -> Iterator[Tuple[str, int, int, int, int]]:
+        """Reads the index
+
+        Yields:
+            Tuple[str, int, int, int, int]: The name of each restaurant, the offset and length
+            of its block, and the offset and length of its JSON in the database file
+        """
+        for i in range(self.restaurants):
+            yield self.string(len(self.users) + i), *self.entry(i)
+
+    def restaurant(self, offset : int) -> RestaurantDatabase:
+        """Makes the database of a restaurant, whose reviews are materialized once they are used
+
+        Args:
+            offset (int): The offset of its block
+
+        Returns:
+            RestaurantDatabase: Its database
+        """
+        packed = PackedReviews(self, offset)
+        return RestaurantDatabase(RestaurantInfo.from_dict(packed.read_info()), Reviews.from_packed(packed))
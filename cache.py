@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+
+from typing import Any, Hashable
+
+class LRUCache:
+    """An LRUCache is a bounded mapping that evicts its least recently used entry
+    once it is full. It is safe to use from multiple threads
+    """
+    
+    def __init__(self, capacity : int):
+        """Creates an empty LRUCache
+
+        Args:
+            capacity (int): The most entries the cache holds
+        """
+        self.capacity = capacity
+        self.entries : OrderedDict[Hashable, Any] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key : Hashable) -> bool:
+        return key in self.entries
+
+    def get(self, key : Hashable, default : Any = None) -> Any:
+        """Gets an entry, marking it as the most recently used
+
+        Args:
+            key (Hashable): The key of the entry
+            default (Any, optional): What to return if there is no entry. Defaults to None.
+
+        Returns:
+            Any: The value of the entry, or default
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key : Hashable, value : Any):
+        """Adds or replaces an entry, evicting the least recently used entry if
+        the cache is full
+
+        Args:
+            key (Hashable): The key of the entry
+            value (Any): The value of the entry
+        """
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def pop(self, key : Hashable, default : Any = None) -> Any:
+        """Removes an entry
+
+        Args:
+            key (Hashable): The key of the entry
+            default (Any, optional): What to return if there is no entry. Defaults to None.
+
+        Returns:
+            Any: The value of the removed entry, or default
+        """
+        with self.lock:
+            return self.entries.pop(key, default)
+
+    def clear(self):
+        """Removes every entry
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def hit_rate(self) -> float:
+        """Gets the fraction of lookups that found an entry
+
+        Returns:
+            float: The hit rate, or 0.0 if there have been no lookups
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -1,10 +1,13 @@
-from enum import Enum
+from enum import IntEnum
 
-class HTTP_CODE(Enum):
+class HTTP_CODE(IntEnum):
     SUCCESS = 200
+    # 300 Level is Redirection
+    NOT_MODIFIED = 304 # The client already has the current version
     # 400 Level is Client-Side Problems
     BAD_REQUEST = 400 # Malformed Input
     UNAUTHORIZED = 401 # Not authentication was given
     NOT_FOUND = 404 # Resource Doesn't Exist
     # 500 Level is Server-Side Problems
-    SERVER_BAD = 500
\ No newline at end of file
+    SERVER_BAD = 500
+    SERVICE_UNAVAILABLE = 503 # Overloaded, try again later
\ No newline at end of file
@@ -0,0 +1,153 @@
+try:
+    import numpy
+except ImportError: # numpy is optional, and only needed for the columnar backend
+    numpy = None
+
+from ..common.constants import MIN_RATING, MAX_RATING, UNRATED
+from ..common.review_categories import ReviewCategory, CATEGORIES
+
+from typing import Dict, List, Tuple
+
+DEFAULT_PERCENTILES = (25, 50, 75, 90)
+
+class RatingsMatrix:
+    """A RatingsMatrix stores the ratings of a restaurant in columns: an int8 matrix
+    with a row per reviewer and a column per ReviewCategory, and a matching mask of
+    which ratings were given. Rows are grown by doubling, so adding reviews is
+    amortized O(1), and statistics are computed over whole columns at once
+    """
+    
+    def __init__(self, capacity : int = 16):
+        """Creates an empty RatingsMatrix
+
+        Args:
+            capacity (int, optional): The number of rows to allocate up front. Defaults to 16.
+
+        Raises:
+            ImportError: If numpy is not installed
+        """
+        if numpy is None:
+            raise ImportError("The columnar ratings backend requires numpy")
+        self.scores = numpy.zeros((max(capacity, 1), len(CATEGORIES)), dtype=numpy.int8)
+        self.rated = numpy.zeros((max(capacity, 1), len(CATEGORIES)), dtype=bool)
+        self.rows : Dict[str, int] = dict()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @staticmethod
+    def from_reviews(reviews : List):
+        """Creates a RatingsMatrix that holds reviews
+
+        Args:
+            reviews (List[Review]): The reviews, with one per reviewer
+
+        Returns:
+            RatingsMatrix: The matrix of the ratings of reviews
+        """
+        matrix = RatingsMatrix(len(reviews))
+        if reviews:
+            packed = numpy.frombuffer(b''.join(review.scores for review in reviews), dtype=numpy.uint8).reshape(len(reviews), len(CATEGORIES))
+            matrix.rated[:len(reviews)] = packed != UNRATED
+            matrix.scores[:len(reviews)] = numpy.where(packed != UNRATED, packed, 0)
+            matrix.rows = {review.user : i for i, review in enumerate(reviews)}
+        return matrix
+
+    def set(self, review):
+        """Stores the ratings of a review, replacing the ratings of the reviewer's previous review
+
+        Args:
+            review (Review): The review
+        """
+        row = self.rows.get(review.user)
+        if row is None:
+            row = len(self.rows)
+            if row == len(self.scores):
+                self.scores = numpy.concatenate((self.scores, numpy.zeros_like(self.scores)))
+                self.rated = numpy.concatenate((self.rated, numpy.zeros_like(self.rated)))
+            self.rows[review.user] = row
+        packed = numpy.frombuffer(review.scores, dtype=numpy.uint8)
+        self.rated[row] = packed != UNRATED
+        self.scores[row] = numpy.where(self.rated[row], packed, 0)
+
+    def columns(self) -> Tuple:
+        """Gets the filled part of the matrix
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray]: The scores and the mask of given ratings,
+            each with a row per reviewer
+        """
+        return self.scores[:len(self.rows)], self.rated[:len(self.rows)]
+
+    def statistics(self, percentiles : Tuple[int, ...] = DEFAULT_PERCENTILES) -> Dict[ReviewCategory, Dict]:
+        """Computes statistics for each category of this
+
+        Args:
+            percentiles (Tuple[int, ...], optional): The percentiles to compute. Defaults to DEFAULT_PERCENTILES.
+
+        Returns:
+            Dict[ReviewCategory, Dict]: See summarize
+        """
+        return summarize(*self.columns(), percentiles=percentiles)
+
+def summarize(scores, rated, percentiles : Tuple[int, ...] = DEFAULT_PERCENTILES) -> Dict[ReviewCategory, Dict]:
+    """Computes statistics for each category, vectorized over all rows and categories
+
+    Args:
+        scores (numpy.ndarray): An int8 matrix, with a row per review and a column per category
+        rated (numpy.ndarray): A bool matrix of which entries of scores were rated
+        percentiles (Tuple[int, ...], optional): The percentiles to compute. Defaults to DEFAULT_PERCENTILES.
+
+    Returns:
+        Dict[ReviewCategory, Dict]: For each category that has ratings:
+            count (int): The number of ratings,
+            mean (float): The mean rating,
+            median (float): The median rating,
+            std (float): The standard deviation of the ratings,
+            percentiles (Dict[int, float]): Each requested percentile of the ratings,
+            histogram (List[int]): The number of ratings of each value, from MIN_RATING to MAX_RATING
+    """
+    counts = rated.sum(axis=0)
+    result = dict()
+    if not counts.any():
+        return result
+    
+    values = numpy.where(rated, scores, numpy.nan)
+    rated_columns = counts > 0
+    values = values[:, rated_columns]
+    means = numpy.nanmean(values, axis=0)
+    medians = numpy.nanmedian(values, axis=0)
+    deviations = numpy.nanstd(values, axis=0)
+    quantiles = numpy.nanpercentile(values, percentiles, axis=0).reshape(len(percentiles), -1)
+    histograms = numpy.stack([((scores == rating) & rated).sum(axis=0) for rating in range(MIN_RATING, MAX_RATING + 1)], axis=1)
+    
+    column = 0
+    for i, category in enumerate(CATEGORIES):
+        if not counts[i]:
+            continue
+        result[category] = {
+            'count' : int(counts[i]),
+            'mean' : float(means[column]),
+            'median' : float(medians[column]),
+            'std' : float(deviations[column]),
+            'percentiles' : {percentile : float(quantiles[j, column]) for j, percentile in enumerate(percentiles)},
+            'histogram' : histograms[i].tolist(),
+        }
+        column += 1
+    return result
+
+def summarize_all(columns : List[Tuple], percentiles : Tuple[int, ...] = DEFAULT_PERCENTILES) -> Dict[ReviewCategory, Dict]:
+    """Computes statistics for each category across many restaurants at once
+
+    Args:
+        columns (List[Tuple]): The columns of each restaurant (see RatingsMatrix.columns)
+        percentiles (Tuple[int, ...], optional): The percentiles to compute. Defaults to DEFAULT_PERCENTILES.
+
+    Returns:
+        Dict[ReviewCategory, Dict]: See summarize
+    """
+    if numpy is None:
+        raise ImportError("The columnar ratings backend requires numpy")
+    scores = numpy.concatenate([column[0] for column in columns]) if columns else numpy.zeros((0, len(CATEGORIES)), dtype=numpy.int8)
+    rated = numpy.concatenate([column[1] for column in columns]) if columns else numpy.zeros((0, len(CATEGORIES)), dtype=bool)
+    return summarize(scores, rated, percentiles=percentiles)
@@ -0,0 +1,20 @@
+import zlib
+
+from .constants import DEFAULT_COMPRESSION_LEVEL
+
+# zlib makes a gzip stream (rather than a zlib one) with this window size
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+def gzip_compress(data : bytes, level : int = DEFAULT_COMPRESSION_LEVEL) -> bytes:
+    """Compresses data into the gzip format, for a Content-Encoding of gzip
+
+    Args:
+        data (bytes): The data
+        level (int, optional): The compression level, from 1 (fastest) to 9 (smallest).
+                               Defaults to DEFAULT_COMPRESSION_LEVEL.
+
+    Returns:
+        bytes: The compressed data
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
@@ -12,7 +12,80 @@ DEFAULT_USERS = os.path.join(
     os.path.dirname(os.path.abspath(__file__)),
     "users.json"
 )
+DEFAULT_RESTAURANT_ROWS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "restaurants.json"
+)
+DEFAULT_REVIEW_ROWS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "reviews.json"
+)
+DEFAULT_COMMENT_ROWS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "comments.json"
+)
+DEFAULT_DATABASE_JOURNAL = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "database.journal"
+)
+DEFAULT_USERS_JOURNAL = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "users.journal"
+)
+
+DEFAULT_SNAPSHOT_INTERVAL = 60.0
+DEFAULT_SNAPSHOT_THRESHOLD = 100
+# The binary snapshot of a database file is next to it, with this extension instead
+BINARY_SNAPSHOT_EXTENSION = ".snap"
+
+DEFAULT_SEARCH_CACHE_SIZE = 4096
+DEFAULT_FUZZY_LIMIT = 10
+MAX_BATCH_SIZE = 1000
+DEFAULT_TOP_K = 10
+MAX_TOP_K = 1000
+DEFAULT_NEARBY_K = 10
+MAX_NEARBY_K = 1000
+DEFAULT_REVIEW_SEARCH_LIMIT = 10
+MAX_REVIEW_SEARCH_LIMIT = 100
+# The BM25 parameters of review searches: how quickly repeating a term stops adding to a review's
+# score (k1), and how much longer reviews are penalized for their length (b)
+BM25_K1 = 1.2
+BM25_B = 0.75
+# The length of the snippet of each review found, in characters
+DEFAULT_SNIPPET_LENGTH = 160
+DEFAULT_CELL_DEGREES = 0.01
+DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_MAX_RESIDENT = 1024
+DEFAULT_WORKERS = 0
+DEFAULT_PUBLISH_INTERVAL = 0.05
+DEFAULT_ASYNC_THREADS = 32
+DEFAULT_HEARTBEAT_INTERVAL = 1.0
+DEFAULT_METRICS_INTERVAL = 5.0
+DEFAULT_PROFILE_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "profiles"
+)
+DEFAULT_SLOW_REQUEST = 0.5
+DEFAULT_SAMPLE_INTERVAL = 0.005
+DEFAULT_PROFILES_PER_MINUTE = 6
+DEFAULT_PROFILES_KEPT = 100
+DEFAULT_PARTITION_BYTES = 64 * 1024 * 1024
+DEFAULT_READ_CHUNK = 1024 * 1024
+DEFAULT_ZIPF_EXPONENT = 1.1
+DEFAULT_CATEGORY_DENSITY = 0.4
+DEFAULT_SEED = 0
+
+MIN_RATING = 0
+MAX_RATING = 5
+NO_RATING = -1
+UNRATED = 0xFF # The packed score of a category that was not rated
 
-TOKEN_LOWER_BOUND = 0
-TOKEN_HIGHER_BOUND = 10000000
+DEFAULT_SESSION_TTL = 1800.0
+PASSWORD_ITERATIONS = 600000
+DEFAULT_HASH_WORKERS = 4
+DEFAULT_HASH_QUEUE = 64
+DEFAULT_SQLITE_CONNECTIONS = 8
+DEFAULT_VERIFY_CACHE_SIZE = 1024
+DEFAULT_VERIFY_CACHE_TTL = 60.0
+TOKEN_BYTES = 16
 FAILURE_TOKEN = -1
\ No newline at end of file
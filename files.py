@@ -0,0 +1,41 @@
+import os
+import threading
+
+from typing import Iterable
+
+def write_atomically(file_name : str, chunks : Iterable[bytes]) -> int:
+    """Writes a file by writing a temporary file next to it and renaming it
+    over the original. Readers (and crashes) will either see the old file
+    or the new one, never a partially written one
+
+    Args:
+        file_name (str): The file to write
+        chunks (Iterable[bytes]): The contents of the file, in order
+
+    Returns:
+        int: The number of bytes written
+    """
+    directory = os.path.dirname(os.path.abspath(file_name))
+    # Threads of the same process may write the same file at once
+    temporary_file = f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    written = 0
+    try:
+        with open(temporary_file, 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+                written += len(chunk)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_file, file_name)
+    except BaseException:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+        raise
+    
+    # Make the rename itself durable
+    directory_descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_descriptor)
+    finally:
+        os.close(directory_descriptor)
+    return written
@@ -0,0 +1,308 @@
+import bisect
+import heapq
+import re
+
+from typing import Dict, List, Set, Tuple
+
+WORD_PATTERN = re.compile(r'\w+')
+MAX_TYPOS = 2
+
+def character_masks(word : str) -> Dict[str, int]:
+    """Precomputes the bitmasks edit_distance uses for a word, so that a word
+    compared against many others only has them computed once
+
+    Args:
+        word (str): The word
+
+    Returns:
+        Dict[str, int]: For each character, a bitmask of where it occurs in word
+    """
+    masks = dict()
+    for i, character in enumerate(word):
+        masks[character] = masks.get(character, 0) | (1 << i)
+    return masks
+
+def edit_distance(a : str, b : str, a_masks : Dict[str, int] | None = None) -> int:
+    """Computes the Levenshtein distance between two strings, with Myers' bit-parallel
+    algorithm (one pass over b, with a column of the distance matrix held in the bits of an int)
+
+    Args:
+        a (str): The first string
+        b (str): The second string
+        a_masks (Dict[str, int] | None, optional): character_masks(a), if already computed.
+                                                   Defaults to None.
+
+    Returns:
+        int: The number of single character insertions, deletions and substitutions
+        that turn a into b
+    """
+    if not a or not b:
+        return len(a) + len(b)
+    if a_masks is None:
+        a_masks = character_masks(a)
+    full = (1 << len(a)) - 1
+    last = 1 << (len(a) - 1)
+    positive = full
+    negative = 0
+    distance = len(a)
+    for character in b:
+        equal = a_masks.get(character, 0)
+        vertical = equal | negative
+        horizontal = (((equal & positive) + positive) ^ positive) | equal
+        positive_horizontal = negative | ~(horizontal | positive)
+        negative_horizontal = positive & horizontal
+        if positive_horizontal & last:
+            distance += 1
+        elif negative_horizontal & last:
+            distance -= 1
+        positive_horizontal = (positive_horizontal << 1) | 1
+        negative_horizontal = negative_horizontal << 1
+        positive = (negative_horizontal | ~(vertical | positive_horizontal)) & full
+        negative = positive_horizontal & vertical & full
+    return distance
+
+def tokenize(text : str) -> List[str]:
+    """Splits text into lowercase words
+
+    Args:
+        text (str): The text to split
+
+    Returns:
+        List[str]: The words of text, in order
+    """
+    return WORD_PATTERN.findall(text.lower())
+
+def deletions(word : str, depth : int) -> Set[str]:
+    """Gets every string that is made by deleting up to depth characters from word
+
+    Args:
+        word (str): The word
+        depth (int): The most characters to delete
+
+    Returns:
+        Set[str]: The deletions, including word itself
+    """
+    results = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {deletion[:i] + deletion[i + 1:] for deletion in frontier for i in range(len(deletion))}
+        results |= frontier
+    return results
+
+class DeletionIndex:
+    """A DeletionIndex (symmetric delete index) finds every word within an edit distance
+    of a query. Two words are within distance k of each other only if deleting at most k
+    characters from each of them can make them equal, so every deletion of every word is
+    indexed, and a query only has to measure the distance to the words that share one of
+    its deletions. Deletions are keyed by their hash to save memory, as collisions only
+    add candidates that get measured and rejected
+    """
+    
+    def __init__(self, *words : str, depth : int = MAX_TYPOS):
+        """Creates a DeletionIndex over words
+
+        Args:
+            words (varargs, str): The words to start with
+            depth (int, optional): The largest distance that can be searched for.
+                                   Defaults to MAX_TYPOS.
+        """
+        self.depth = depth
+        # A key maps to a single word (the common case), or a list of words
+        self.deletions : Dict[int, str | List[str]] = dict()
+        for word in words:
+            self.add(word)
+
+    def add(self, word : str):
+        """Adds a word to this. Words must only be added once
+
+        Args:
+            word (str): The word to add
+        """
+        for deletion in deletions(word, self.depth):
+            key = hash(deletion)
+            words = self.deletions.get(key)
+            if words is None:
+                self.deletions[key] = word
+            elif isinstance(words, str):
+                self.deletions[key] = [words, word]
+            else:
+                words.append(word)
+
+    def remove(self, word : str):
+        """Removes a word from this
+
+        Args:
+            word (str): The word to remove
+        """
+        for deletion in deletions(word, self.depth):
+            key = hash(deletion)
+            words = self.deletions.get(key)
+            if words == word:
+                del self.deletions[key]
+            elif isinstance(words, list) and word in words:
+                words.remove(word)
+                if len(words) == 1:
+                    self.deletions[key] = words[0]
+
+    def search(self, word : str, max_distance : int) -> List[Tuple[int, str]]:
+        """Finds every word within max_distance of word
+
+        Args:
+            word (str): The word to look for
+            max_distance (int): The largest edit distance allowed. It is capped at the depth of this
+
+        Returns:
+            List[Tuple[int, str]]: (distance, word) for each word found
+        """
+        max_distance = min(max_distance, self.depth)
+        candidates = set()
+        for deletion in deletions(word, max_distance):
+            words = self.deletions.get(hash(deletion))
+            if isinstance(words, str):
+                candidates.add(words)
+            elif words:
+                candidates.update(words)
+        
+        masks = character_masks(word)
+        results = []
+        for candidate in candidates:
+            if abs(len(candidate) - len(word)) <= max_distance:
+                distance = edit_distance(word, candidate, masks)
+                if distance <= max_distance:
+                    results.append((distance, candidate))
+        return results
+
+class FuzzyIndex:
+    """A FuzzyIndex finds names despite typos. Each word of a query is matched against
+    the words of all names with a DeletionIndex, and the last word of a query may also be an
+    unfinished prefix of a word. Names containing a match for every query word are
+    ranked by the total number of typos, then by whether they start with the query
+    """
+    
+    def __init__(self, *names : str):
+        """Creates a FuzzyIndex that contains names
+
+        Args:
+            names (varargs, str): The names to start with
+        """
+        self.name_words : Dict[str, List[str]] = dict()
+        self.lowered : Dict[str, str] = dict()
+        # Postings are dicts used as ordered sets, so that they stay in the order names were added
+        self.postings : Dict[str, Dict[str, None]] = dict()
+        self.sorted_words : List[str] = []
+        self.typos = DeletionIndex()
+        for name in names:
+            self.add(name)
+
+    def __len__(self) -> int:
+        return len(self.name_words)
+
+    def add(self, name : str) -> bool:
+        """Adds a name to this
+
+        Args:
+            name (str): The name to add
+
+        Returns:
+            bool: True iff the name was added, False if it was already in this
+        """
+        if name in self.name_words:
+            return False
+        self.name_words[name] = tokenize(name)
+        self.lowered[name] = name.lower()
+        for word in set(self.name_words[name]):
+            if word not in self.postings:
+                self.postings[word] = dict()
+                self.typos.add(word)
+                bisect.insort(self.sorted_words, word)
+            self.postings[word][name] = None
+        return True
+
+    def remove(self, name : str) -> bool:
+        """Removes a name from this
+
+        Args:
+            name (str): The name to remove
+
+        Returns:
+            bool: True iff the name was removed, False if it wasn't in this
+        """
+        words = self.name_words.pop(name, None)
+        if words is None:
+            return False
+        del self.lowered[name]
+        for word in set(words):
+            posting = self.postings[word]
+            posting.pop(name, None)
+            if not posting:
+                del self.postings[word]
+                del self.sorted_words[bisect.bisect_left(self.sorted_words, word)]
+                self.typos.remove(word)
+        return True
+
+    def match_word(self, word : str, max_distance : int, prefix : bool) -> Dict[str, int]:
+        """Finds the indexed words that match a query word
+
+        Args:
+            word (str): The query word
+            max_distance (int): The most typos allowed
+            prefix (bool): Whether indexed words that start with word also match
+
+        Returns:
+            Dict[str, int]: The number of typos for each matching word
+        """
+        matches = {match : distance for distance, match in self.typos.search(word, max_distance)}
+        if prefix:
+            i = bisect.bisect_left(self.sorted_words, word)
+            while i < len(self.sorted_words) and self.sorted_words[i].startswith(word):
+                matches[self.sorted_words[i]] = 0
+                i += 1
+        return matches
+
+    def search(self, query : str, max_distance : int | None = None, limit : int = 10) -> List[str]:
+        """Finds the names that best match query
+
+        Args:
+            query (str): The text to look for
+            max_distance (int | None, optional): The most typos allowed per word. Defaults to None,
+                                                 which allows none in words of up to 2 characters,
+                                                 one in 3 character words, and MAX_TYPOS otherwise.
+                                                 It can't be more than MAX_TYPOS
+            limit (int, optional): The most names to return. Defaults to 10.
+
+        Returns:
+            List[str]: The matching names, best first
+        """
+        query_words = tokenize(query)
+        if not query_words or limit <= 0:
+            return []
+        
+        matches = []
+        for i, word in enumerate(query_words):
+            allowed = max_distance if max_distance is not None else min(MAX_TYPOS, max(len(word) - 2, 0))
+            word_matches = self.match_word(word, allowed, prefix=i == len(query_words) - 1)
+            if not word_matches:
+                return []
+            matches.append(word_matches)
+        
+        # Gather candidates from the query word with the fewest names, with their fewest typos
+        smallest = min(matches, key=lambda word_matches: sum(len(self.postings[match]) for match in word_matches))
+        typos : Dict[str, int] = dict()
+        for match, distance in smallest.items():
+            for name in self.postings[match]:
+                if distance < typos.get(name, distance + 1):
+                    typos[name] = distance
+        
+        # Then, only keep candidates that match the other query words as well
+        for word_matches in matches:
+            if word_matches is smallest:
+                continue
+            for name in list(typos):
+                distances = [word_matches[word] for word in self.name_words[name] if word in word_matches]
+                if distances:
+                    typos[name] += min(distances)
+                else:
+                    del typos[name]
+        
+        lowered_query = query.lower()
+        return heapq.nsmallest(limit, typos, key=lambda name: (typos[name], not self.lowered[name].startswith(lowered_query), len(name), name))
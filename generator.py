@@ -0,0 +1,214 @@
+import argparse
+import json
+import random
+
+from ..common.constants import DEFAULT_ZIPF_EXPONENT, DEFAULT_CATEGORY_DENSITY, DEFAULT_SEED, MIN_RATING, MAX_RATING
+from ..common.files import write_atomically
+from ..common.review_categories import CATEGORIES
+from .importer import encode_database
+from .journal import Journal
+
+from typing import Any, Dict, Iterator, List, Tuple
+
+# Words that names and reviews are made of, so that searches for parts of names find
+# realistic numbers of restaurants
+NAME_WORDS = ("Golden", "Blue", "Corner", "Little", "Harbor", "Garden", "Royal", "Rustic", "Sunny", "Urban",
+              "Old", "Happy", "Green", "Silver", "Lucky", "Red", "Maple", "Ocean", "Spice", "Village")
+NAME_KINDS = ("Cafe", "Bistro", "Diner", "Grill", "Kitchen", "Tavern", "Noodle House", "Taqueria", "Bakery", "Pizzeria",
+              "Deli", "Eatery", "Steakhouse", "Sushi Bar", "Brasserie", "Canteen")
+REVIEW_WORDS = ("the", "ramp", "was", "easy", "hard", "to", "use", "staff", "were", "helpful", "menu", "had",
+                "braille", "seating", "tight", "roomy", "waiting", "area", "quiet", "loud", "service", "animal",
+                "welcome", "food", "great", "okay", "door", "wide", "narrow", "table", "height", "good")
+USER_NAME = "Benchmark User {}"
+PASSWORD = "benchmark password {}"
+# The area restaurants are placed in, around Seattle
+CENTER = (47.6062, -122.3321)
+SPREAD_DEGREES = 0.2
+
+def zipf_counts(total : int, buckets : int, exponent : float) -> List[int]:
+    """Splits a total into buckets whose sizes follow a Zipf distribution, exactly and without
+    randomness: bucket i gets a share proportional to 1 / (i + 1) ** exponent, and the parts left
+    over by rounding down go to the buckets that lost the most
+
+    Args:
+        total (int): The total
+        buckets (int): The number of buckets
+        exponent (float): The skew. 0 splits the total evenly, and larger exponents give more to the first buckets
+
+    Returns:
+        List[int]: The size of each bucket, largest first, adding up to total
+    """
+    if not buckets:
+        return []
+    weights = [1 / (rank + 1) ** exponent for rank in range(buckets)]
+    scale = total / sum(weights)
+    shares = [weight * scale for weight in weights]
+    counts = [int(share) for share in shares]
+    leftover = total - sum(counts)
+    for bucket in sorted(range(buckets), key=lambda bucket: counts[bucket] - shares[bucket])[:leftover]:
+        counts[bucket] += 1
+    return counts
+
+class DatasetGenerator:
+    """A DatasetGenerator makes a synthetic database and users file for benchmarks. The same
+    arguments always make the same files.
+
+    Reviews are spread over restaurants following a Zipf distribution (a few restaurants have
+    most of them), each review rates each category with probability density, and every review
+    of a restaurant is from a different user
+    """
+
+    def __init__(self, restaurants : int, reviews : int, density : float = DEFAULT_CATEGORY_DENSITY,
+                 exponent : float = DEFAULT_ZIPF_EXPONENT, users : int = 0, seed : int = DEFAULT_SEED):
+        """Creates a DatasetGenerator. Nothing is generated until restaurants or users is iterated
+
+        Args:
+            restaurants (int): The number of restaurants
+            reviews (int): The total number of reviews
+            density (float, optional): The chance that a review rates any one category.
+                                       Defaults to DEFAULT_CATEGORY_DENSITY.
+            exponent (float, optional): The Zipf exponent of reviews per restaurant. Defaults to DEFAULT_ZIPF_EXPONENT.
+            users (int, optional): The number of users. It is raised to the most reviews any
+                                   restaurant has, if it is less. Defaults to 0.
+            seed (int, optional): The seed of everything that is random. Defaults to DEFAULT_SEED.
+        """
+        self.restaurant_count = restaurants
+        self.review_count = reviews
+        self.density = density
+        self.exponent = exponent
+        self.seed = seed
+        # Which restaurant gets the most reviews is random too, so that it isn't always the first
+        self.counts = zipf_counts(reviews, restaurants, exponent)
+        random.Random(seed).shuffle(self.counts)
+        self.user_count = max([users, *self.counts])
+        self.names = self.make_names()
+
+    def make_names(self) -> List[str]:
+        """Makes the name of each restaurant, which are unique
+
+        Returns:
+            List[str]: The names, in order
+        """
+        rng = random.Random(f"{self.seed}:names")
+        return [f"{rng.choice(NAME_WORDS)} {rng.choice(NAME_WORDS)} {rng.choice(NAME_KINDS)} {i}"
+                for i in range(self.restaurant_count)]
+
+    def restaurant(self, rng : random.Random, name : str, count : int) -> Dict[str, Any]:
+        """Makes a restaurant
+
+        Args:
+            rng (random.Random): The random numbers to make it from
+            name (str): Its name
+            count (int): How many reviews it has
+
+        Returns:
+            Dict[str, Any]: Its database, in RestaurantDatabase dictionary format
+        """
+        reviews = dict()
+        for user in rng.sample(range(self.user_count), count):
+            user_name = USER_NAME.format(user)
+            ratings = {category.name : rng.randint(MIN_RATING, MAX_RATING)
+                       for category in CATEGORIES if rng.random() < self.density}
+            review = " ".join(rng.choice(REVIEW_WORDS) for _ in range(rng.randint(4, 24)))
+            reviews[user_name] = {'user' : user_name, 'ratings' : ratings, 'review' : review}
+        info = {'summary' : f"{name} serves " + " ".join(rng.choice(REVIEW_WORDS) for _ in range(8)),
+                'hours' : "9:00 AM - 9:00 PM", 'address' : f"{rng.randint(1, 9999)} {rng.choice(NAME_WORDS)} St",
+                'phone' : f"206-555-{rng.randint(0, 9999):04d}",
+                'latitude' : round(CENTER[0] + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES), 6),
+                'longitude' : round(CENTER[1] + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES), 6)}
+        return {'restaurant_info' : info, 'reviews' : {'reviews' : reviews}}
+
+    def restaurants(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Makes every restaurant, one at a time
+
+        Yields:
+            Tuple[str, Dict[str, Any]]: The name of each restaurant, with its database in
+            RestaurantDatabase dictionary format
+        """
+        rng = random.Random(f"{self.seed}:restaurants")
+        for name, count in zip(self.names, self.counts):
+            yield name, self.restaurant(rng, name, count)
+
+    def users(self) -> Dict[str, str]:
+        """Makes every user. Passwords are plaintext, which the server accepts (and hashes on
+        each user's first login), since hashing them all here would take far longer than the rest
+
+        Returns:
+            Dict[str, str]: {Username : password}
+        """
+        return {USER_NAME.format(user) : PASSWORD.format(user) for user in range(self.user_count)}
+
+    def write(self, database_file : str, users_file : str | None = None) -> Dict[str, int]:
+        """Writes the database file, and the users file
+
+        Args:
+            database_file (str): The database file to write
+            users_file (str | None, optional): The users file to write. Defaults to None, for none.
+
+        Returns:
+            Dict[str, int]: The number of restaurants, reviews and users, and the bytes of the database file
+        """
+        written = write_atomically(database_file, encode_database(self.restaurants()))
+        if users_file:
+            write_atomically(users_file, [json.dumps(self.users()).encode('utf-8')])
+        return {'restaurants' : self.restaurant_count, 'reviews' : self.review_count,
+                'users' : self.user_count, 'database_bytes' : written}
+
+def parse_args(argv : List[str] | None = None) -> argparse.Namespace:
+    """Parses out arguments on the command line for the generator
+
+    Parameters (Command-Line):
+        --restaurants (int): The number of restaurants
+        --reviews (int): The total number of reviews
+        --density (float): The chance that a review rates any one category
+        --exponent (float): The Zipf exponent of reviews per restaurant
+        --users (int): The least number of users
+        --seed (int): The seed
+        --database (str): The database file to write. Required
+        --journal (str): The journal of the database, which is emptied. Not touched if not specified
+        --users-file (str): The users file to write. Required
+        --users-journal (str): The journal of the users file, which is emptied. Not touched if not specified
+
+    Args:
+        argv (List[str] | None, optional): The arguments to parse. Defaults to None,
+                                           for the command-line arguments.
+
+    Returns:
+        argparse.Namespace: The restaurants (int), reviews (int), density (float), exponent (float),
+        users (int), seed (int), database (str), journal (str | None), users_file (str) and
+        users_journal (str | None) to generate with
+    """
+    parser = argparse.ArgumentParser(description="Generates a synthetic database and users file for benchmarks")
+    parser.add_argument("--restaurants", type=int, default=1000, help="Number of restaurants")
+    parser.add_argument("--reviews", type=int, default=100000, help="Total number of reviews")
+    parser.add_argument("--density", type=float, default=DEFAULT_CATEGORY_DENSITY, help="Chance a review rates each category")
+    parser.add_argument("--exponent", type=float, default=DEFAULT_ZIPF_EXPONENT, help="Zipf exponent of reviews per restaurant")
+    parser.add_argument("--users", type=int, default=0, help="Least number of users")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed")
+    # The files are required, so that the server's own database is never replaced by accident
+    parser.add_argument("--database", type=str, required=True, help="Database file to write")
+    parser.add_argument("--journal", type=str, default=None, help="Journal of the database to empty")
+    parser.add_argument("--users-file", type=str, required=True, help="Users file to write")
+    parser.add_argument("--users-journal", type=str, default=None, help="Journal of the users file to empty")
+    return parser.parse_args(argv)
+
+def main(argv : List[str] | None = None):
+    """Generates a database and users file. To replace the ones a server uses, name its files and
+    its journals, and run this while the server is stopped
+
+    Args:
+        argv (List[str] | None, optional): The arguments. Defaults to None, for the command-line arguments.
+    """
+    args = parse_args(argv)
+    generator = DatasetGenerator(args.restaurants, args.reviews, args.density, args.exponent, args.users, args.seed)
+    print(generator.write(args.database, args.users_file))
+    # The journals named hold changes to the files that were just replaced
+    for journal_file in (args.journal, args.users_journal):
+        if journal_file is None:
+            continue
+        journal = Journal(journal_file)
+        journal.checkpoint()
+        journal.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from ..common.constants import DEFAULT_HEARTBEAT_INTERVAL
+
+from typing import Any, Dict, List
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_CLIENTS = 10000
+DEFAULT_SECONDS = 5.0
+DEFAULT_LOAD_PORT = 3150
+# Clients connect in batches, so the listen backlog isn't overrun
+CONNECT_BATCH = 500
+# A client that gets fewer beats than this share of those sent while it was watched missed some
+MIN_BEAT_SHARE = 0.8
+
+def raise_file_limit(needed : int):
+    """Raises the limit on open files of this process (and the processes it starts) as far as
+    allowed, since every client, and every connection the server accepts, is a file
+
+    Args:
+        needed (int): The number of files needed
+    """
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed if hard == resource.RLIM_INFINITY else min(needed, hard), hard))
+
+def resident_bytes(pid : int) -> int | None:
+    """Gets the memory a process has resident
+
+    Args:
+        pid (int): The process
+
+    Returns:
+        int | None: Its resident set size in bytes, or None where it can't be read (off Linux)
+    """
+    try:
+        with open(f"/proc/{pid}/statm", 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+async def wait_for_server(host : str, port : int, timeout : float):
+    """Waits until a server accepts connections
+
+    Args:
+        host (str): Its host
+        port (int): Its port
+        timeout (float): The most seconds to wait
+
+    Raises:
+        TimeoutError: If it didn't accept a connection in time
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Nothing accepted connections on {host}:{port} within {timeout}s")
+            await asyncio.sleep(0.2)
+
+async def request_latency(host : str, port : int, target : str) -> float:
+    """Times a request, on a connection of its own
+
+    Args:
+        host (str): The server's host
+        port (int): The server's port
+        target (str): The path and query to get
+
+    Returns:
+        float: How long the whole response took, in seconds
+
+    Raises:
+        RuntimeError: If the response wasn't a 200
+    """
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode('ascii'))
+    response = await reader.read()
+    writer.close()
+    elapsed = time.perf_counter() - start
+    status = response.split(b"\r\n", 1)[0]
+    if status.split()[1:2] != [b"200"]:
+        raise RuntimeError(f"GET {target} returned {status!r}")
+    return elapsed
+
+async def heartbeat_client(host : str, port : int, beats : List[int], i : int):
+    """Connects to /heartbeat, and counts the events received, until cancelled
+
+    Args:
+        host (str): The server's host
+        port (int): The server's port
+        beats (List[int]): The events received by each client
+        i (int): The number of this client
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"GET /heartbeat HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('ascii'))
+        await reader.readuntil(b"\r\n\r\n")
+        while True:
+            await reader.readuntil(b"\n\n")
+            beats[i] += 1
+    finally:
+        writer.close()
+
+async def load(host : str, port : int, clients : int, seconds : float, interval : float,
+               server_pid : int | None = None) -> Dict[str, Any]:
+    """Holds many heartbeat streams open at once, and checks every one of them keeps getting
+    beats, and that other requests are still answered quickly meanwhile
+
+    Args:
+        host (str): The server's host
+        port (int): The server's port
+        clients (int): The number of heartbeat streams
+        seconds (float): How long to watch the streams once they are all open
+        interval (float): The seconds between the server's heartbeats
+        server_pid (int | None, optional): The server's process, to measure its memory. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: The number of clients, how many failed, how long they took to connect, the
+        fewest and total beats received while watched and the fewest expected, the server's memory
+        before and after they connected (and per client), and the latency of /search meanwhile
+    """
+    results : Dict[str, Any] = {'clients' : clients}
+    results['rss_before_bytes'] = resident_bytes(server_pid) if server_pid else None
+    beats = [0] * clients
+    tasks = []
+    start = time.perf_counter()
+    for i in range(clients):
+        tasks.append(asyncio.create_task(heartbeat_client(host, port, beats, i)))
+        if i % CONNECT_BATCH == CONNECT_BATCH - 1:
+            await asyncio.sleep(0.05)
+    # Every client has its first beat once it is connected
+    while not all(beats) and not any(task.done() for task in tasks) and time.perf_counter() - start < 60 + clients / 100:
+        await asyncio.sleep(0.1)
+    results['connect_seconds'] = time.perf_counter() - start
+
+    before = list(beats)
+    await asyncio.sleep(seconds)
+    received = [after - earlier for after, earlier in zip(beats, before)]
+    results['failed'] = sum(task.done() for task in tasks)
+    results['beats'] = sum(received)
+    results['min_beats'] = min(received) if received else 0
+    results['expected_min_beats'] = int(seconds / interval * MIN_BEAT_SHARE)
+    results['rss_after_bytes'] = resident_bytes(server_pid) if server_pid else None
+    if results['rss_before_bytes'] and results['rss_after_bytes']:
+        results['rss_per_client_bytes'] = (results['rss_after_bytes'] - results['rss_before_bytes']) / clients
+    results['search_seconds'] = [await request_latency(host, port, "/search?query=M") for _ in range(5)]
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return results
+
+def parse_args(argv : List[str] | None = None) -> argparse.Namespace:
+    """Parses out arguments on the command line for the load test
+
+    Parameters (Command-Line):
+        --clients (int): The number of heartbeat streams to hold open
+        --seconds (float): How long to watch them
+        --host (str): The server's host
+        --port (int): The server's port
+        --spawn (bool): Specifying this flag starts the server (with --asyncio) rather than using a running one
+        --interval (float): The seconds between the server's heartbeats
+
+    Args:
+        argv (List[str] | None, optional): The arguments to parse. Defaults to None,
+                                           for the command-line arguments.
+
+    Returns:
+        argparse.Namespace: The clients (int), seconds (float), host (str), port (int), spawn (bool)
+        and interval (float) to run with
+    """
+    parser = argparse.ArgumentParser(description="Holds many /heartbeat streams open against a server, and checks they all keep beating")
+    parser.add_argument("--clients", type=int, default=DEFAULT_CLIENTS, help="Heartbeat streams to hold open")
+    parser.add_argument("--seconds", type=float, default=DEFAULT_SECONDS, help="Seconds to watch them")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host of the server")
+    parser.add_argument("--port", type=int, default=DEFAULT_LOAD_PORT, help="Port of the server")
+    parser.add_argument("--spawn", action="store_true", default=False, help="Start the server with --asyncio, and measure its memory")
+    parser.add_argument("--interval", type=float, default=DEFAULT_HEARTBEAT_INTERVAL, help="Seconds between heartbeats")
+    return parser.parse_args(argv)
+
+def main(argv : List[str] | None = None) -> int:
+    """Runs the load test, and prints its results
+
+    Args:
+        argv (List[str] | None, optional): The arguments. Defaults to None, for the command-line arguments.
+
+    Returns:
+        int: 1 if any client failed or missed beats, otherwise 0
+    """
+    args = parse_args(argv)
+    # The clients, and with --spawn, the server's connections too
+    raise_file_limit(2 * args.clients + 256)
+    server = None
+    if args.spawn:
+        package = __spec__.name.split(".")[0]
+        server = subprocess.Popen([sys.executable, "-m", package, "--asyncio", "--host", args.host, "--port", str(args.port)])
+    try:
+        asyncio.run(wait_for_server(args.host, args.port, 60))
+        results = asyncio.run(load(args.host, args.port, args.clients, args.seconds, args.interval,
+                                   server.pid if server else None))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    print(json.dumps(results, indent=2))
+    return 1 if results['failed'] or results['min_beats'] < results['expected_min_beats'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
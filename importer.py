@@ -0,0 +1,461 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from ..common.constants import (DEFAULT_DATABASE, DEFAULT_DATABASE_JOURNAL, DEFAULT_RESTAURANT_ROWS, DEFAULT_REVIEW_ROWS,
+                                DEFAULT_COMMENT_ROWS, DEFAULT_PARTITION_BYTES, DEFAULT_READ_CHUNK, MIN_RATING, MAX_RATING, NO_RATING)
+from ..common.files import write_atomically
+from ..common.json import JSONEncoder
+from ..common.review_categories import CATEGORIES, CATEGORY_INDEX, resolve_category
+from .journal import Journal
+from .shards import ShardedStore
+from .sqlite_storage import SQLiteStorage
+from .storage import Storage
+
+from typing import Any, Dict, Iterator, List, Tuple
+
+# The rows only identify users by id, so this names the user with each id
+USER_NAME = "User {}"
+# The most characters one row may take up, so that a malformed file is never buffered whole
+MAX_ROW_CHARS = 16 * 1024 * 1024
+# How many rows are read between progress reports
+PROGRESS_ROWS = 1000000
+
+NOT_WHITESPACE = re.compile(r"\S")
+
+def read_rows(file_name : str, chunk_size : int = DEFAULT_READ_CHUNK) -> Iterator[Any]:
+    """Reads the elements of a file that holds a JSON array one at a time, so that only
+    about chunk_size characters of it are in memory at once
+
+    Args:
+        file_name (str): The file
+        chunk_size (int, optional): How many characters to read at a time. Defaults to DEFAULT_READ_CHUNK.
+
+    Raises:
+        ValueError: If the file is not a JSON array, or holds an element over MAX_ROW_CHARS long
+
+    Yields:
+        Any: Each element of the array, in order
+    """
+    decoder = json.JSONDecoder()
+    with open(file_name, 'r', encoding='utf-8') as file:
+        buffer = ""
+        position = 0
+        eof = False
+        # What may come next: the opening bracket, an element or the closing bracket,
+        # an element, or a comma or the closing bracket
+        expected = "["
+        while True:
+            match = NOT_WHITESPACE.search(buffer, position)
+            if match is not None:
+                position = match.start()
+                character = buffer[position]
+                if expected == "[":
+                    if character != "[":
+                        raise ValueError(f"{file_name} is not a JSON array")
+                    position += 1
+                    expected = "element or ]"
+                    continue
+                if character == "]" and expected != "element":
+                    return
+                if expected == ", or ]":
+                    if character != ",":
+                        raise ValueError(f"Expected , or ] in {file_name}, found {character!r}")
+                    position += 1
+                    expected = "element"
+                    continue
+                try:
+                    row, end = decoder.raw_decode(buffer, position)
+                    # An element that runs up to the end of the buffer might continue in the next chunk
+                    if end < len(buffer) or eof:
+                        yield row
+                        position = end
+                        expected = ", or ]"
+                        continue
+                except json.JSONDecodeError:
+                    if eof:
+                        raise ValueError(f"{file_name} has a malformed element at character {position} of its last chunk")
+            elif eof:
+                raise ValueError(f"{file_name} ends before its array does")
+
+            # Read more, keeping only what was not consumed yet
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            if len(buffer) > MAX_ROW_CHARS:
+                raise ValueError(f"{file_name} has an element longer than {MAX_ROW_CHARS} characters")
+
+class RowImporter:
+    """A RowImporter converts the row-oriented restaurants, reviews (one rating per row) and
+    comments files into restaurant databases, grouping the rows of each restaurant by user into
+    reviews, and summing the ratings of each category as the rows are read.
+
+    Every file is streamed. Restaurants are kept in memory (they are few), but rating and
+    comment rows are not: if those files are bigger than partition_bytes, their rows are first
+    spilled into temporary partitions of consecutive restaurants, which are then grouped one at
+    a time. Restaurants come out in the order of the restaurants file either way.
+
+    Rows that are malformed, that refer to a restaurant that doesn't exist, or that have an
+    unknown category or an invalid rating, are rejected (and counted) rather than imported
+    """
+
+    def __init__(self, restaurants_file : str = DEFAULT_RESTAURANT_ROWS, reviews_file : str = DEFAULT_REVIEW_ROWS,
+                 comments_file : str | None = DEFAULT_COMMENT_ROWS, partition_bytes : int = DEFAULT_PARTITION_BYTES,
+                 chunk_size : int = DEFAULT_READ_CHUNK):
+        """Creates a RowImporter. Nothing is read until restaurants is iterated
+
+        Args:
+            restaurants_file (str, optional): The restaurant rows, each with a restaurant_id, name,
+                                              description and address, and optionally a latitude
+                                              and longitude. Defaults to DEFAULT_RESTAURANT_ROWS.
+            reviews_file (str, optional): The rating rows, each with a restaurant_id, user_id,
+                                          category and rating. Defaults to DEFAULT_REVIEW_ROWS.
+            comments_file (str | None, optional): The comment rows, each with a restaurant_id, user_id,
+                                                  category and comment, or None for no comments.
+                                                  Defaults to DEFAULT_COMMENT_ROWS.
+            partition_bytes (int, optional): The most bytes of rating and comment rows to group at once.
+                                             Defaults to DEFAULT_PARTITION_BYTES.
+            chunk_size (int, optional): How many characters to read at a time. Defaults to DEFAULT_READ_CHUNK.
+        """
+        self.restaurants_file = restaurants_file
+        self.reviews_file = reviews_file
+        self.comments_file = comments_file
+        self.partition_bytes = partition_bytes
+        self.chunk_size = chunk_size
+
+        # The name and info of each restaurant, by its position in the restaurants file
+        self.names : List[str] = []
+        self.infos : List[Dict[str, str | float]] = []
+        self.ordinals : Dict[Any, int] = dict()
+
+        self.rows : Dict[str, int] = dict()
+        self.rejected : Dict[str, int] = dict()
+        self.partitions = 0
+        self.start = 0.0
+        self.elapsed = 0.0
+
+    def count(self, kind : str, accepted : bool):
+        """Counts a row that was read, reporting progress every PROGRESS_ROWS rows
+
+        Args:
+            kind (str): Which file the row is from
+            accepted (bool): If the row was accepted
+        """
+        rows = self.rows[kind] = self.rows.get(kind, 0) + 1
+        if not accepted:
+            self.rejected[kind] = self.rejected.get(kind, 0) + 1
+        if rows % PROGRESS_ROWS == 0:
+            elapsed = time.perf_counter() - self.start
+            print(f"{kind}: {rows} rows ({rows / elapsed:.0f} rows/s)", file=sys.stderr)
+
+    def read_restaurants(self):
+        """Reads every restaurant. A restaurant with the id or name of an earlier one is rejected
+        """
+        names = set()
+        for row in read_rows(self.restaurants_file, self.chunk_size):
+            accepted = (isinstance(row, dict) and isinstance(row.get('name'), str) and
+                        self.is_id(row.get('restaurant_id')) and row['restaurant_id'] not in self.ordinals and
+                        row['name'] not in names)
+            if accepted:
+                self.ordinals[row['restaurant_id']] = len(self.names)
+                names.add(row['name'])
+                self.names.append(row['name'])
+                info = {'summary' : str(row.get('description', "")), 'hours' : str(row.get('hours', "")),
+                        'address' : str(row.get('address', "")), 'phone' : str(row.get('phone', ""))}
+                # A location is only kept if it is a valid one
+                latitude, longitude = row.get('latitude'), row.get('longitude')
+                if self.is_coordinate(latitude, 90) and self.is_coordinate(longitude, 180):
+                    info['latitude'] = float(latitude)
+                    info['longitude'] = float(longitude)
+                self.infos.append(info)
+            self.count('restaurants', accepted)
+
+    def read_reviews(self) -> Iterator[Tuple[int, str, int | str, int | str]]:
+        """Reads the rating and comment rows, keeping those that are valid
+
+        Yields:
+            Tuple[int, str, int | str, int | str]: The ordinal of the restaurant and the id of the user
+            of each row (as a string, so that 7 and "7" are the same user), with the index of the
+            category and the rating of a rating row, or the label of the category and the comment
+            of a comment row
+        """
+        for row in read_rows(self.reviews_file, self.chunk_size):
+            rating = self.parse_rating(row)
+            self.count('reviews', rating is not None)
+            if rating is not None:
+                yield rating
+        if self.comments_file:
+            for row in read_rows(self.comments_file, self.chunk_size):
+                comment = self.parse_comment(row)
+                self.count('comments', comment is not None)
+                if comment is not None:
+                    yield comment
+
+    def parse_rating(self, row : Any) -> Tuple[int, str, int, int] | None:
+        """Validates a rating row
+
+        Args:
+            row (Any): The row
+
+        Returns:
+            Tuple[int, str, int, int] | None: The ordinal of the restaurant, the id of the user, the index of
+            the category and the rating, or None if the row is rejected (a rating of NO_RATING is rejected too)
+        """
+        if not isinstance(row, dict) or not self.is_id(row.get('restaurant_id')) or not self.is_id(row.get('user_id')):
+            return None
+        if row['restaurant_id'] not in self.ordinals:
+            return None
+        category = resolve_category(row['category']) if isinstance(row.get('category'), str) else None
+        rating = row.get('rating')
+        if category is None or type(rating) is not int or rating == NO_RATING or not MIN_RATING <= rating <= MAX_RATING:
+            return None
+        return self.ordinals[row['restaurant_id']], str(row['user_id']), CATEGORY_INDEX[category], rating
+
+    def parse_comment(self, row : Any) -> Tuple[int, str, str, str] | None:
+        """Validates a comment row
+
+        Args:
+            row (Any): The row
+
+        Returns:
+            Tuple[int, str, str, str] | None: The ordinal of the restaurant, the id of the user, the label of
+            the category (which is free text, so it need not be a category) and the comment, or None if
+            the row is rejected
+        """
+        if not isinstance(row, dict) or not self.is_id(row.get('restaurant_id')) or not self.is_id(row.get('user_id')):
+            return None
+        if row['restaurant_id'] not in self.ordinals:
+            return None
+        if not isinstance(row.get('comment'), str):
+            return None
+        return self.ordinals[row['restaurant_id']], str(row['user_id']), str(row.get('category', "")), row['comment']
+
+    def is_id(self, identifier : Any) -> bool:
+        """Evaluates if a restaurant_id or user_id is valid
+
+        Args:
+            identifier (Any): The id
+
+        Returns:
+            bool: True iff it is an integer or a string
+        """
+        return isinstance(identifier, (int, str)) and not isinstance(identifier, bool)
+
+    def is_coordinate(self, degrees : Any, limit : int) -> bool:
+        """Evaluates if a latitude or longitude is valid
+
+        Args:
+            degrees (Any): The latitude or longitude
+            limit (int): The most degrees it can be from 0 (90 for latitudes, 180 for longitudes)
+
+        Returns:
+            bool: True iff it is a number from -limit to limit
+        """
+        return isinstance(degrees, (int, float)) and not isinstance(degrees, bool) and -limit <= degrees <= limit
+
+    def group(self, rows : Iterator[Tuple[int, str, int | str, int | str]]) -> Dict[int, Tuple[Dict, List[int], List[int]]]:
+        """Groups rows by restaurant and user, summing the ratings of each category as they come.
+        A later rating of the same category by the same user replaces the earlier one
+
+        Args:
+            rows (Iterator[Tuple[int, str, int | str, int | str]]): The rows, from read_reviews
+
+        Returns:
+            Dict[int, Tuple[Dict, List[int], List[int]]]: By ordinal, the reviews of each restaurant
+            ({user_id : [scores, comments]}, where scores has a rating or None for each category),
+            and the sum and count of the ratings of each category
+        """
+        groups : Dict[int, Tuple[Dict, List[int], List[int]]] = dict()
+        for ordinal, user_id, key, value in rows:
+            group = groups.get(ordinal)
+            if group is None:
+                group = groups[ordinal] = (dict(), [0] * len(CATEGORIES), [0] * len(CATEGORIES))
+            reviews, ratings_sum, ratings_count = group
+            review = reviews.get(user_id)
+            if review is None:
+                review = reviews[user_id] = ([None] * len(CATEGORIES), [])
+            scores, comments = review
+            if isinstance(key, int):
+                if scores[key] is None:
+                    ratings_count[key] += 1
+                    ratings_sum[key] += value
+                else:
+                    ratings_sum[key] += value - scores[key]
+                scores[key] = value
+            else:
+                comments.append(f"{key}: {value}" if key else value)
+        return groups
+
+    def encode(self, ordinal : int, group : Tuple[Dict, List[int], List[int]] | None) -> Dict:
+        """Converts a grouped restaurant into its database
+
+        Args:
+            ordinal (int): The ordinal of the restaurant
+            group (Tuple[Dict, List[int], List[int]] | None): Its group, from group, or None if it has no rows
+
+        Returns:
+            Dict: Its database, in RestaurantDatabase dictionary format
+        """
+        reviews, ratings_sum, ratings_count = group if group else (dict(), [0] * len(CATEGORIES), [0] * len(CATEGORIES))
+        encoded = dict()
+        for user_id, (scores, comments) in reviews.items():
+            user = USER_NAME.format(user_id)
+            encoded[user] = {'user' : user,
+                             'ratings' : {category.name : score for category, score in zip(CATEGORIES, scores) if score is not None},
+                             'review' : "\n".join(comments)}
+        return {'restaurant_info' : self.infos[ordinal],
+                'reviews' : {'reviews' : encoded,
+                             'ratings_sum' : {category.name : total for category, total in zip(CATEGORIES, ratings_sum)},
+                             'ratings_count' : {category.name : total for category, total in zip(CATEGORIES, ratings_count)}}}
+
+    def restaurants(self) -> Iterator[Tuple[str, Dict]]:
+        """Reads the files, and produces the database of each restaurant
+
+        Yields:
+            Tuple[str, Dict]: The name of each restaurant, with its database in RestaurantDatabase
+            dictionary format, in the order of the restaurants file
+        """
+        self.start = time.perf_counter()
+        self.read_restaurants()
+
+        size = os.path.getsize(self.reviews_file) + (os.path.getsize(self.comments_file) if self.comments_file else 0)
+        self.partitions = max(1, min(-(-size // self.partition_bytes), len(self.names)))
+        if self.partitions == 1:
+            groups = self.group(self.read_reviews())
+            for ordinal, name in enumerate(self.names):
+                yield name, self.encode(ordinal, groups.pop(ordinal, None))
+        else:
+            yield from self.restaurants_partitioned()
+        self.elapsed = time.perf_counter() - self.start
+
+    def restaurants_partitioned(self) -> Iterator[Tuple[str, Dict]]:
+        """Spills the rating and comment rows into partitions of consecutive restaurants,
+        and then groups the partitions one at a time
+
+        Yields:
+            Tuple[str, Dict]: The name of each restaurant, with its database in RestaurantDatabase
+            dictionary format, in the order of the restaurants file
+        """
+        directory = tempfile.mkdtemp(prefix="restaurant-import-")
+        try:
+            paths = [os.path.join(directory, f"partition-{i}.jsonl") for i in range(self.partitions)]
+            files = [open(path, 'w', encoding='utf-8') for path in paths]
+            try:
+                for row in self.read_reviews():
+                    files[row[0] * self.partitions // len(self.names)].write(json.dumps(row) + "\n")
+            finally:
+                for file in files:
+                    file.close()
+
+            ordinal = 0
+            for i, path in enumerate(paths):
+                with open(path, 'r', encoding='utf-8') as file:
+                    groups = self.group(tuple(json.loads(line)) for line in file)
+                os.remove(path)
+                # The first ordinal of the next partition
+                end = -(-(i + 1) * len(self.names) // self.partitions)
+                while ordinal < end:
+                    yield self.names[ordinal], self.encode(ordinal, groups.pop(ordinal, None))
+                    ordinal += 1
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def report(self) -> str:
+        """Describes what was imported, once restaurants has been iterated through
+
+        Returns:
+            str: How many rows of each file were read and rejected, and how fast
+        """
+        rows = sum(self.rows.values())
+        lines = [f"{kind}: {self.rows[kind]} rows, {self.rejected.get(kind, 0)} rejected" for kind in self.rows]
+        lines.append(f"{rows} rows in {self.elapsed:.2f}s ({rows / self.elapsed if self.elapsed else 0:.0f} rows/s), "
+                     f"grouped in {self.partitions} partition(s)")
+        return "\n".join(lines)
+
+def encode_database(restaurants : Iterator[Tuple[str, Dict]]) -> Iterator[bytes]:
+    """Encodes restaurants as a database file, one restaurant at a time, in the same
+    format DatabaseManager saves in
+
+    Args:
+        restaurants (Iterator[Tuple[str, Dict]]): The name of each restaurant, with its
+        database in RestaurantDatabase dictionary format, in order
+
+    Yields:
+        bytes: Consecutive chunks of the database file
+    """
+    yield b'{'
+    for i, (restaurant, data) in enumerate(restaurants):
+        yield (', ' if i else '').encode('utf-8') + json.dumps(restaurant).encode('utf-8') + b': ' + json.dumps(data, cls=JSONEncoder).encode('utf-8')
+    yield b'}'
+
+def parse_args(argv : List[str] | None = None) -> argparse.Namespace:
+    """Parses out arguments on the command line for the importer
+
+    Parameters (Command-Line):
+        --restaurants (str): The restaurant rows
+        --reviews (str): The rating rows
+        --comments (str): The comment rows (an empty string for none)
+        --database (str): The database file to replace, without --shards or --sqlite
+        --journal (str): The journal of the database, which is emptied
+        --shards (str): A sharded store to replace the restaurants of instead
+        --sqlite (str): A SQLite database to replace the restaurants of instead
+        --partition-mb (int): The most megabytes of rating and comment rows to group at once
+
+    Args:
+        argv (List[str] | None, optional): The arguments to parse. Defaults to None,
+                                           for the command-line arguments.
+
+    Returns:
+        argparse.Namespace: The restaurants (str), reviews (str), comments (str), database (str), journal (str),
+        shards (str | None), sqlite (str | None) and partition_mb (int) to import with
+    """
+    parser = argparse.ArgumentParser(description="Imports restaurants from row-oriented JSON files, replacing every restaurant in the storage")
+    parser.add_argument("--restaurants", type=str, default=DEFAULT_RESTAURANT_ROWS, help="Restaurant rows")
+    parser.add_argument("--reviews", type=str, default=DEFAULT_REVIEW_ROWS, help="Rating rows")
+    parser.add_argument("--comments", type=str, default=DEFAULT_COMMENT_ROWS, help="Comment rows ('' for none)")
+    parser.add_argument("--database", type=str, default=DEFAULT_DATABASE, help="Database file to replace")
+    parser.add_argument("--journal", type=str, default=DEFAULT_DATABASE_JOURNAL, help="Journal of the database")
+    storage = parser.add_mutually_exclusive_group()
+    storage.add_argument("--shards", type=str, default=None, help="Directory of a sharded store to import into")
+    storage.add_argument("--sqlite", type=str, default=None, help="SQLite database to import into")
+    parser.add_argument("--partition-mb", type=int, default=DEFAULT_PARTITION_BYTES // (1024 * 1024), help="Megabytes of rows grouped at once")
+    args = parser.parse_args(argv)
+    if args.partition_mb < 1:
+        parser.error("--partition-mb must be at least 1")
+    return args
+
+def main(argv : List[str] | None = None):
+    """Imports the row-oriented files into the storage the server would use with the same
+    --shards or --sqlite argument. Run this while the server is stopped
+
+    Args:
+        argv (List[str] | None, optional): The arguments. Defaults to None, for the command-line arguments.
+    """
+    args = parse_args(argv)
+    importer = RowImporter(args.restaurants, args.reviews, args.comments or None, args.partition_mb * 1024 * 1024)
+    store : Storage | None = None
+    if args.shards:
+        store = ShardedStore(args.shards)
+    elif args.sqlite:
+        store = SQLiteStorage(args.sqlite)
+
+    if store:
+        store.import_restaurants(importer.restaurants())
+    else:
+        write_atomically(args.database, encode_database(importer.restaurants()))
+    # The journal holds changes to the restaurants that were just replaced
+    if not (store and store.write_through):
+        journal = Journal(args.journal)
+        journal.checkpoint()
+        journal.close()
+    print(importer.report())
+    print(f"Imported {len(importer.names)} restaurants into {store.name if store else args.database}")
+
+if __name__ == "__main__":
+    main()
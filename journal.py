@@ -0,0 +1,153 @@
+import json
+import os
+import threading
+
+from ..common.files import write_atomically
+from ..common.json import JSONEncoder
+
+from typing import Dict, Iterator
+
+class Journal:
+    """A Journal is an append-only write-ahead log of mutations. Every mutation is
+    written as a single compact JSON line, so the cost of recording a change is
+    proportional to the size of the change rather than to the size of the data it
+    changes. Concurrent appends share fsync calls (group commit).
+    """
+
+    def __init__(self, journal_file : str):
+        """Opens (or creates) a journal file for appending
+
+        Args:
+            journal_file (str): The file that holds the journal
+        """
+        self.journal_file = journal_file
+        self.file = open(journal_file, 'a+b')
+        self.lock = threading.Lock()
+        self.committed = threading.Condition(self.lock)
+        self.written = 0 # Sequence number of the last record written
+        self.durable = 0 # Sequence number of the last record that has been fsynced
+        self.syncing = False
+
+    def replay(self) -> Iterator[Dict]:
+        """Reads back every record in the journal, in the order they were appended.
+        A torn record at the end of the journal (from a crash in the middle of an
+        append) is discarded and truncated away, so new records are never appended
+        after a partial line.
+
+        Yields:
+            Dict: Each journaled record
+        """
+        with self.lock:
+            self.file.seek(0)
+            valid_length = 0
+            for line in self.file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                valid_length += len(line)
+                yield record
+            self.file.truncate(valid_length)
+            self.file.seek(0, os.SEEK_END)
+
+    def write(self, record : Dict) -> int:
+        """Writes a record to the end of the journal without waiting for it to
+        become durable. Callers that write while holding their own lock can
+        commit the record after releasing it, so that the order of the journal
+        matches the order changes were applied in without fsyncing under that lock
+
+        Args:
+            record (Dict): The record to write. It must be JSON serializable with
+            the common JSONEncoder
+
+        Returns:
+            int: The sequence number of the record, to be passed into commit
+        """
+        line = json.dumps(record, cls=JSONEncoder, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self.lock:
+            self.file.write(line)
+            self.written += 1
+            return self.written
+
+    def commit(self, sequence : int):
+        """Returns once the record with the given sequence number is durable.
+
+        While one committer is inside fsync, others queue up behind it; the next
+        fsync then commits all of their records at once (group commit).
+
+        Args:
+            sequence (int): The sequence number returned by write
+        """
+        with self.lock:
+            while self.durable < sequence:
+                if self.syncing:
+                    self.committed.wait()
+                    continue
+                
+                # Become the leader of this group, and commit everything written so far
+                self.syncing = True
+                target = self.written
+                self.file.flush()
+                self.lock.release()
+                try:
+                    os.fsync(self.file.fileno())
+                finally:
+                    self.lock.acquire()
+                    self.syncing = False
+                    self.committed.notify_all()
+                self.durable = max(self.durable, target)
+
+    def append(self, record : Dict):
+        """Appends a record to the journal, and returns once it is durable
+
+        Args:
+            record (Dict): The record to append. It must be JSON serializable with
+            the common JSONEncoder
+        """
+        self.commit(self.write(record))
+
+    def position(self) -> int:
+        """Gets the current end of the journal, which can later be passed into
+        checkpoint
+
+        Returns:
+            int: The size of the journal in bytes
+        """
+        with self.lock:
+            self.file.flush()
+            return self.file.tell()
+
+    def checkpoint(self, position : int | None = None):
+        """Discards the start of the journal. Only call this after every record
+        before position has been written into a durable snapshot. Records written
+        after position are kept, by atomically replacing the journal with them
+
+        Args:
+            position (int | None, optional): The position (from the position method)
+            to discard records up to. Defaults to None, which empties the journal
+        """
+        with self.lock:
+            # A group commit's leader fsyncs the file outside of the lock, so it can't be
+            # replaced until the leader is done with it
+            while self.syncing:
+                self.committed.wait()
+            self.file.flush()
+            if position is None:
+                position = self.file.tell()
+            self.file.seek(position)
+            remainder = self.file.read()
+            write_atomically(self.journal_file, [remainder])
+            self.file.close()
+            self.file = open(self.journal_file, 'a+b')
+            # The records kept were fsynced along with the new journal
+            self.durable = self.written
+
+    def close(self):
+        """Closes the journal file
+        """
+        with self.lock:
+            while self.syncing:
+                self.committed.wait()
+            self.file.close()
@@ -10,6 +10,8 @@ class JSONEncoder(json.JSONEncoder):
         elif isinstance(obj, dict):
             if len(obj) > 0 and isinstance(obj.__iter__().__next__(), Enum):
                 return {key : obj[key] for key in obj}
+        elif hasattr(obj, "to_dict"):
+            return obj.to_dict()
         elif hasattr(obj, "__dict__"):
             return obj.__dict__
         return super().default(obj)
\ No newline at end of file
@@ -0,0 +1,191 @@
+import random
+
+from ..common.locks import RWLock
+from ..common.review_categories import ReviewCategory, CATEGORIES
+from .reviews import Reviews
+
+from typing import Any, Dict, Iterator, List, Tuple
+
+# Each node of a skip list is linked at one more level with probability SKIP_PROBABILITY,
+# up to MAX_LEVEL levels, which keeps a search at O(log N) for far more than 2^16 entries
+SKIP_PROBABILITY = 0.25
+MAX_LEVEL = 16
+
+class SkipNode:
+    """A SkipNode is an entry of a SkipList, with its successor at each level it is linked at
+    """
+    __slots__ = ('key', 'value', 'next')
+
+    def __init__(self, key : Any, value : Any, level : int):
+        self.key = key
+        self.value = value
+        self.next : List[SkipNode | None] = [None] * level
+
+class SkipList:
+    """A SkipList keeps entries sorted by key, with O(log N) expected insertion and removal
+    and O(1) per entry iteration from the smallest key. Keys must be unique
+    """
+
+    def __init__(self, seed : int | None = None):
+        """Creates an empty SkipList
+
+        Args:
+            seed (int | None, optional): The seed of the levels given to entries. Defaults to None.
+        """
+        self.head = SkipNode(None, None, MAX_LEVEL)
+        self.level = 1
+        self.size = 0
+        self.random = random.Random(seed)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Iterator[Tuple[Any, Any]]:
+        node = self.head.next[0]
+        while node:
+            yield node.key, node.value
+            node = node.next[0]
+
+    def random_level(self) -> int:
+        """Picks the number of levels to link a new entry at
+
+        Returns:
+            int: From 1 to MAX_LEVEL, each level being SKIP_PROBABILITY times as likely as the one below
+        """
+        level = 1
+        while level < MAX_LEVEL and self.random.random() < SKIP_PROBABILITY:
+            level += 1
+        return level
+
+    def predecessors(self, key : Any) -> List[SkipNode]:
+        """Finds the last node before key at every level
+
+        Args:
+            key (Any): The key
+
+        Returns:
+            List[SkipNode]: For each level, the last node whose key is smaller than key (or the head)
+        """
+        update = [self.head] * MAX_LEVEL
+        node = self.head
+        for level in range(self.level - 1, -1, -1):
+            while node.next[level] and node.next[level].key < key:
+                node = node.next[level]
+            update[level] = node
+        return update
+
+    def insert(self, key : Any, value : Any):
+        """Adds an entry. key must not be in this already
+
+        Args:
+            key (Any): The key
+            value (Any): The value
+        """
+        update = self.predecessors(key)
+        level = self.random_level()
+        self.level = max(self.level, level)
+        node = SkipNode(key, value, level)
+        for i in range(level):
+            node.next[i] = update[i].next[i]
+            update[i].next[i] = node
+        self.size += 1
+
+    def remove(self, key : Any) -> bool:
+        """Removes an entry
+
+        Args:
+            key (Any): The key of the entry
+
+        Returns:
+            bool: True iff the entry was removed, False if there is no entry with key
+        """
+        update = self.predecessors(key)
+        node = update[0].next[0]
+        if not node or node.key != key:
+            return False
+        for i in range(len(node.next)):
+            update[i].next[i] = node.next[i]
+        while self.level > 1 and not self.head.next[self.level - 1]:
+            self.level -= 1
+        self.size -= 1
+        return True
+
+class Leaderboards:
+    """Leaderboards rank restaurants by their mean rating in each category, highest first
+    (ties broken by name), so that the top k of a category are the first k entries of its
+    SkipList. Only restaurants with ratings in a category are ranked in it.
+
+    Updating a restaurant costs O(log N) per category. It is safe to use from multiple
+    threads
+    """
+
+    def __init__(self):
+        """Creates Leaderboards that rank no restaurants
+        """
+        self.boards : Dict[ReviewCategory, SkipList] = {category : SkipList() for category in CATEGORIES}
+        # The key and review count each restaurant is ranked under, in each category it is ranked in
+        self.entries : Dict[str, Dict[ReviewCategory, Tuple[Tuple[float, str], int]]] = dict()
+        self.lock = RWLock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def update(self, restaurant : str, reviews : Reviews):
+        """Ranks a restaurant by its current reviews, moving it only in the categories where
+        its mean rating or number of ratings changed
+
+        Args:
+            restaurant (str): The name of the restaurant
+            reviews (Reviews): Its reviews
+        """
+        with self.lock.writing():
+            old = self.entries.get(restaurant, {})
+            new = dict()
+            for category in CATEGORIES:
+                count = reviews.ratings_count[category]
+                if count:
+                    new[category] = ((-reviews.ratings_sum[category] / count, restaurant), count)
+            for category in old.keys() | new.keys():
+                if old.get(category) == new.get(category):
+                    continue
+                if category in old:
+                    self.boards[category].remove(old[category][0])
+                if category in new:
+                    self.boards[category].insert(*new[category])
+            self.entries[restaurant] = new
+
+    def remove(self, restaurant : str):
+        """Stops ranking a restaurant
+
+        Args:
+            restaurant (str): The name of the restaurant
+        """
+        with self.lock.writing():
+            for category, (key, _) in self.entries.pop(restaurant, {}).items():
+                self.boards[category].remove(key)
+
+    def top(self, category : ReviewCategory, k : int, min_reviews : int = 1) -> List[Dict[str, str | float | int]]:
+        """Gets the restaurants with the highest mean rating in a category. This costs O(k),
+        plus one step for each higher ranked restaurant with fewer than min_reviews ratings
+
+        Args:
+            category (ReviewCategory): The category
+            k (int): The most restaurants to return
+            min_reviews (int, optional): The fewest ratings in category a restaurant needs to be
+                                         ranked. Defaults to 1.
+
+        Returns:
+            List[Dict[str, str | float | int]]: The name, mean rating and number of ratings of
+            each restaurant, highest mean first
+        """
+        top = []
+        if k <= 0:
+            return top
+        with self.lock.reading():
+            for (mean, restaurant), count in self.boards[category]:
+                if count < min_reviews:
+                    continue
+                top.append({'restaurant' : restaurant, 'mean' : -mean, 'count' : count})
+                if len(top) == k:
+                    break
+        return top
@@ -0,0 +1,72 @@
+import threading
+from contextlib import contextmanager
+
+from typing import Iterator
+
+class RWLock:
+    """An RWLock is a lock that any number of readers can hold at once, or a single writer.
+    Writers are preferred: once a writer is waiting, new readers wait behind it, so a steady
+    stream of readers never starves writers. It is not reentrant, so a thread must not
+    acquire it again (in either mode) while holding it
+    """
+
+    def __init__(self):
+        """Creates an RWLock that nobody holds
+        """
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    def acquire_read(self):
+        """Acquires this as a reader, waiting for the writer (and any waiting writers) first
+        """
+        with self.condition:
+            while self.writer or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+
+    def release_read(self):
+        """Releases this as a reader
+        """
+        with self.condition:
+            self.readers -= 1
+            if not self.readers:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        """Acquires this as the writer, waiting for every reader and the current writer first
+        """
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writer or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+
+    def release_write(self):
+        """Releases this as the writer
+        """
+        with self.condition:
+            self.writer = False
+            self.condition.notify_all()
+
+    @contextmanager
+    def reading(self) -> Iterator[None]:
+        """Holds this as a reader for the duration of a with block
+        """
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """Holds this as the writer for the duration of a with block
+        """
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
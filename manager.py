@@ -1,40 +1,622 @@
+import heapq
 import json
+import mmap
+import secrets
+import threading
 
-from ..common.constants import DEFAULT_DATABASE
+from ..common.cache import LRUCache
+from ..common.constants import DEFAULT_DATABASE, DEFAULT_DATABASE_JOURNAL, DEFAULT_SEARCH_CACHE_SIZE, DEFAULT_FUZZY_LIMIT, DEFAULT_MAX_RESIDENT, DEFAULT_REVIEW_SEARCH_LIMIT
+from ..common.files import write_atomically
 from ..common.json import JSONEncoder
+from ..common.locks import RWLock
+from ..common.metrics import timed
+from ..common.review_categories import ReviewCategory
 
-from typing import Dict, List
+from typing import Callable, Dict, Iterator, List, Set, Tuple
+from .binary_snapshot import BinarySnapshot, PackedReviews, UserTable, binary_path, encode_block, fingerprint, write_snapshot
+from .columnar import summarize_all, DEFAULT_PERCENTILES
+from .fuzzy import FuzzyIndex
+from .journal import Journal
+from .leaderboard import Leaderboards
 from .restaurant import RestaurantDatabase
-from ..common.constants import DEFAULT_DATABASE
+from .reviews import Review
+from .shards import LazyRestaurantMap
+from .spatial import GridIndex
+from .storage import Storage
+from .text_index import TextQuery, inverse_document_frequency, snippet
+from .trigram import TrigramIndex
 
 class DatabaseManager:
     """A DatabaseManager manages all databases for restaurants registered with the "manager". Thus, a restaurant "exists" iff it is registered in the DatabaseManager.
+
+    It is safe to use from multiple threads. Changes are made one at a time under lock, so that they
+    are logged in the order they are applied and saves see a consistent state, but they only block
+    readers of the same restaurant (see RestaurantDatabase). Adding or removing a restaurant also
+    holds the catalog lock as the writer, which searches hold as a reader
     """
     
-    def __init__(self, database_file : str = DEFAULT_DATABASE):
-        """Initializes a DatabaseManager from a json file
+    @timed("manager.load")
+    def __init__(self, database_file : str = DEFAULT_DATABASE, journal_file : str = DEFAULT_DATABASE_JOURNAL,
+                 store : Storage | None = None, max_resident : int = DEFAULT_MAX_RESIDENT, binary : bool = True):
+        """Initializes a DatabaseManager from a json file, and then replays
+        every change journaled since that file was last saved. With a write-through
+        store, there is no journal, since every change is durable in the store
 
         Args:
             database_file (str, optional): The database file to grab the manager from.
                                            Defaults to DEFAULT_DATABASE. The format must
                                            be:
                 {Restaurant Name : RestaurantDatabase Dictionary Format}
+            journal_file (str, optional): The journal that changes are recorded in.
+                                          Defaults to DEFAULT_DATABASE_JOURNAL.
+            store (Storage | None, optional): A storage to keep restaurants in, instead of the
+                                              database file (e.g. a ShardedStore or SQLiteStorage).
+                                              Restaurants are then only loaded when they are first
+                                              used. If nothing was imported into the storage yet,
+                                              it is filled from the database file. Defaults to None.
+            max_resident (int, optional): With a store, the most restaurants to keep in memory.
+                                          Defaults to DEFAULT_MAX_RESIDENT.
+            binary (bool, optional): Without a store, whether to load from the binary snapshot of the
+                                     database file when it is up to date (reviews are then only
+                                     materialized once they are used), and to write one with every
+                                     save. Defaults to True.
+        """
+        # Snapshot bookkeeping. Fragments are the encoded JSON of each restaurant as of
+        # the last snapshot, so that only dirty restaurants have to be encoded again
+        self.lock = threading.RLock()
+        self.catalog = RWLock()
+        self.saving = threading.Lock()
+        # With a snapshot store, a restaurant is written by saves (outside of lock) and written
+        # back when it is evicted (under lock), one write at a time. Unsaved restaurants were
+        # copied by a save that hasn't written them yet, so they are written back if they are
+        # evicted first, and then the save skips them
+        self.writing = threading.Lock()
+        self.unsaved : Set[str] = set()
+        self.dirty : Set[str] = set()
+        self.catalog_changed = False
+        self.fragments : Dict[str, bytes | memoryview] = dict()
+        # The block of each restaurant in the last binary snapshot, with the database and version
+        # it encodes. Blocks and fragments that didn't change are views of the files they were
+        # last saved in, which are mapped into memory
+        self.binary = binary and not store
+        self.blocks : Dict[str, Tuple[RestaurantDatabase, int, bytes | memoryview]] = dict()
+        self.users : UserTable | None = None
+        self.snapshot : BinarySnapshot | None = None
+        self.database_map : mmap.mmap | None = None
+        self.on_change : Callable[[int], None] | None = None
+        
+        # Versions for entity tags. The epoch is new every time a manager is created, so versions
+        # never repeat across restarts. A restaurant's stamp is the number of changes made in this
+        # epoch as of its last change (0 if it didn't change), and the catalog version goes up
+        # whenever a restaurant is added or removed
+        self.epoch = secrets.token_hex(4)
+        self.changes = 0
+        self.stamps : Dict[str, int] = dict()
+        self.catalog_version = 0
+        
+        # Built on the first request for a leaderboard (or for nearby restaurants), and then
+        # kept up to date by every change
+        self.leaderboards : Leaderboards | None = None
+        self.spatial_index : GridIndex | None = None
+        
+        self.database_file = database_file
+        self.store = store
+        if self.store:
+            restaurants = self.store.read_index()
+            if restaurants is None:
+                restaurants = self.store.import_database(database_file)
+            self.restaurant_map = LazyRestaurantMap(self.store, restaurants, max_resident, self.lock, self.write_back)
+        elif self.binary and (snapshot := BinarySnapshot.open(database_file)):
+            self.load_binary(database_file, snapshot)
+        else:
+            with open(database_file, '+r') as file:
+                data = json.load(file)
+                self.restaurant_map : Dict[str, RestaurantDatabase] = dict()
+                for restaurant in data:
+                    self.restaurant_map[restaurant] = RestaurantDatabase.from_dict(data[restaurant])
+        self.search_index = TrigramIndex(*self.restaurant_map)
+        self.fuzzy_index = FuzzyIndex(*self.restaurant_map)
+        self.fuzzy_cache = LRUCache(DEFAULT_SEARCH_CACHE_SIZE)
+        
+        # Replay everything that happened after the snapshot was taken
+        self.journal = None if self.store and self.store.write_through else Journal(journal_file)
+        for record in self.journal.replay() if self.journal else ():
+            if self.apply(record):
+                self.dirty.add(record['restaurant'])
+
+    def load_binary(self, database_file : str, snapshot : BinarySnapshot):
+        """Loads the restaurants from the binary snapshot of the database file. Their reviews
+        are materialized once they are used, and until they change, their blocks and JSON
+        fragments are views of the two files
+
+        Args:
+            database_file (str): The database file
+            snapshot (BinarySnapshot): Its binary snapshot, which is up to date
+        """
+        with open(database_file, 'rb') as file:
+            self.database_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.snapshot = snapshot
+        self.restaurant_map : Dict[str, RestaurantDatabase] = dict()
+        blocks = memoryview(snapshot.map)
+        fragments = memoryview(self.database_map)
+        for restaurant, offset, length, json_offset, json_length in snapshot.entries():
+            restaurant_data = snapshot.restaurant(offset)
+            self.restaurant_map[restaurant] = restaurant_data
+            self.blocks[restaurant] = (restaurant_data, restaurant_data.version, blocks[offset:offset + length])
+            self.fragments[restaurant] = fragments[json_offset:json_offset + json_length]
+
+    @timed("manager.save")
+    def save(self, database_file : str | None = None) -> Tuple[int, int]:
+        """Saves a Database Manager into a json file, and discards the part of the
+        journal that is now part of the saved file.
+
+        Only restaurants that changed since the last save are encoded again, and the
+        file is replaced atomically. Changes are only blocked while the dirty
+        restaurants are copied, not while they are encoded or written. The binary
+        snapshot of the file is written after it, the same way.
+
+        With a snapshot store, this writes each dirty restaurant into the store instead
+        (and the index, if restaurants were added or removed). With a write-through store,
+        everything is saved already, so this does nothing.
+
+        Args:
+            database_file (str | None, optional): The database file to save the manager into.
+                                                  Defaults to the file this was loaded from.
+                                                  Ignored with a store.
+
+        Returns:
+            Tuple[int, int]: The number of bytes written, and the number of dirty
+            restaurants that were saved
+        """
+        if self.journal is None:
+            return 0, 0
+        if self.store:
+            return self.save_shards()
+        database_file = database_file or self.database_file
+        with self.saving:
+            # Capture the dirty restaurants, and where the journal was at that moment
+            with self.lock:
+                dirty = self.dirty
+                self.dirty = set()
+                names = list(self.restaurant_map)
+                stale = {restaurant : self.restaurant_map[restaurant].to_dict() for restaurant in names
+                         if restaurant in dirty or restaurant not in self.fragments}
+                changed = dict()
+                if self.binary:
+                    for restaurant in names:
+                        restaurant_data = self.restaurant_map[restaurant]
+                        block = self.blocks.get(restaurant)
+                        if not block or block[0] is not restaurant_data or block[1] != restaurant_data.version:
+                            changed[restaurant] = (restaurant_data, restaurant_data.version,
+                                                   stale.get(restaurant) or restaurant_data.to_dict())
+                position = self.journal.position()
+            
+            try:
+                for restaurant in stale:
+                    self.fragments[restaurant] = json.dumps(stale[restaurant], cls=JSONEncoder).encode('utf-8')
+                spans : List[Tuple[int, int]] = []
+                written = write_atomically(database_file, self.encode_fragments(names, spans))
+                if self.binary:
+                    written += self.save_binary(database_file, names, spans, changed)
+            except BaseException:
+                with self.lock:
+                    self.dirty |= dirty
+                raise
+            
+            self.fragments = {restaurant : self.fragments[restaurant] for restaurant in names}
+            self.journal.checkpoint(position)
+            return written, len(dirty)
+
+    def save_binary(self, database_file : str, names : List[str], spans : List[Tuple[int, int]],
+                    changed : Dict[str, Tuple[RestaurantDatabase, int, Dict]]) -> int:
+        """Writes the binary snapshot of a database file that was just saved, encoding only the
+        blocks of restaurants that changed since the last one. Afterwards, every block and JSON
+        fragment is a view of the new files, and so are the reviews that haven't been materialized,
+        so the old files aren't kept around
+
+        Args:
+            database_file (str): The database file
+            names (List[str]): The restaurants that were saved, in order
+            spans (List[Tuple[int, int]]): The offset and length of the JSON of each restaurant in the database file
+            changed (Dict[str, Tuple[RestaurantDatabase, int, Dict]]): The database, version and
+            dictionary form of each restaurant whose block is out of date
+
+        Returns:
+            int: The number of bytes written
+        """
+        if self.users is None:
+            # Users keep their numbers from the snapshot that was loaded, so its blocks stay valid
+            self.users = self.snapshot.user_table() if self.snapshot else UserTable()
+        for restaurant, (restaurant_data, version, data) in changed.items():
+            self.blocks[restaurant] = (restaurant_data, version, encode_block(data, self.users))
+        snapshot_file = binary_path(database_file)
+        written = write_snapshot(snapshot_file, names, [self.blocks[restaurant][2] for restaurant in names],
+                                 spans, self.users, fingerprint(database_file))
+
+        with open(database_file, 'rb') as file:
+            self.database_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.snapshot = BinarySnapshot(snapshot_file)
+        blocks = memoryview(self.snapshot.map)
+        fragments = memoryview(self.database_map)
+        for i, restaurant in enumerate(names):
+            offset, length, json_offset, json_length = self.snapshot.entry(i)
+            restaurant_data, version, _ = self.blocks[restaurant]
+            self.blocks[restaurant] = (restaurant_data, version, blocks[offset:offset + length])
+            self.fragments[restaurant] = fragments[json_offset:json_offset + json_length]
+            restaurant_data.reviews.repack(PackedReviews(self.snapshot, offset))
+        self.blocks = {restaurant : self.blocks[restaurant] for restaurant in names}
+        return written
+
+    def save_shards(self) -> Tuple[int, int]:
+        """Saves the dirty restaurants into the snapshot store, and discards the part of the
+        journal that is now part of the store. Dirty restaurants that were evicted
+        have already been written back
+
+        Returns:
+            Tuple[int, int]: The number of bytes written, and the number of dirty
+            restaurants that were saved
+        """
+        with self.saving:
+            with self.lock:
+                dirty = self.dirty
+                self.dirty = set()
+                catalog_changed = self.catalog_changed
+                self.catalog_changed = False
+                names = list(self.restaurant_map)
+                stale = {restaurant : self.restaurant_map.resident[restaurant].to_dict() for restaurant in dirty
+                         if restaurant in self.restaurant_map.resident}
+                self.unsaved = set(stale)
+                removed = [restaurant for restaurant in dirty if restaurant not in self.restaurant_map]
+                position = self.journal.position()
+            
+            try:
+                written = 0
+                for restaurant in stale:
+                    encoded = json.dumps(stale[restaurant], cls=JSONEncoder).encode('utf-8')
+                    with self.lock:
+                        if restaurant not in self.unsaved:
+                            continue
+                        self.writing.acquire()
+                    try:
+                        written += self.store.write(restaurant, encoded)
+                    finally:
+                        self.writing.release()
+                    with self.lock:
+                        self.unsaved.discard(restaurant)
+                if catalog_changed:
+                    written += self.store.write_index(names)
+                    for restaurant in removed:
+                        self.store.delete(restaurant)
+            except BaseException:
+                with self.lock:
+                    self.unsaved = set()
+                    self.dirty |= dirty
+                    self.catalog_changed |= catalog_changed
+                raise
+            
+            self.journal.checkpoint(position)
+            return written, len(dirty)
+
+    def write_back(self, restaurant : str, restaurant_data : RestaurantDatabase):
+        """Writes a restaurant that is about to be evicted into the store, if it has
+        changed since it was last saved
+
+        Args:
+            restaurant (str): The name of the restaurant
+            restaurant_data (RestaurantDatabase): Its database
+        """
+        if restaurant in self.dirty or restaurant in self.unsaved:
+            with self.writing:
+                self.store.write(restaurant, json.dumps(restaurant_data.to_dict(), cls=JSONEncoder).encode('utf-8'))
+            self.dirty.discard(restaurant)
+            self.unsaved.discard(restaurant)
+
+    def storage_stats(self) -> Dict[str, int | float | bool]:
+        """Gets statistics about how restaurants are stored
+
+        Returns:
+            Dict[str, int | float | bool]: The kind of storage, and with a store, the
+            residency, hit-rate and load-latency statistics of the restaurant map
+        """
+        if not self.store:
+            return {'storage' : 'json', 'restaurants' : len(self.restaurant_map), 'resident' : len(self.restaurant_map)}
+        return {'storage' : self.store.name, **self.restaurant_map.stats()}
+
+    def encode_fragments(self, names : List[str], spans : List[Tuple[int, int]] | None = None) -> Iterator[bytes]:
+        """Encodes the database file out of the fragments of each restaurant,
+        in the same format json.dump would produce
+
+        Args:
+            names (List[str]): The restaurants to encode, in order
+            spans (List[Tuple[int, int]] | None, optional): A list to add the offset and length of each
+                                                            fragment in the file to. Defaults to None.
+
+        Yields:
+            bytes: Consecutive chunks of the database file
+        """
+        yield b'{'
+        offset = 1
+        for i, restaurant in enumerate(names):
+            key = (', ' if i else '').encode('utf-8') + json.dumps(restaurant).encode('utf-8') + b': '
+            fragment = self.fragments[restaurant]
+            if spans is not None:
+                spans.append((offset + len(key), len(fragment)))
+            offset += len(key) + len(fragment)
+            yield key + fragment
+        yield b'}'
+
+    def pending_changes(self) -> int:
+        """Gets the number of restaurants that changed since the last save
+
+        Returns:
+            int: The size of the dirty set
+        """
+        return len(self.dirty)
+
+    def count_reviews(self) -> int | None:
+        """Counts the reviews of every restaurant
+
+        Returns:
+            int | None: The number of reviews, or None with a store, where counting them would
+            load every restaurant
+        """
+        if self.store:
+            return None
+        with self.catalog.reading():
+            return sum(len(restaurant_data.reviews) for restaurant_data in self.restaurant_map.values())
+
+    def log(self, record : Dict) -> int | None:
+        """Makes a change durable before it is applied, by journaling it (and marking its
+        restaurant dirty) or by recording it in a write-through store. This must be done
+        with the lock held, so that changes are logged in the order they are applied
+
+        Args:
+            record (Dict): The change
+
+        Returns:
+            int | None: The journal sequence number to commit once the lock is released,
+            or None if the change is durable already
+        """
+        if self.journal is None:
+            self.store.record(record)
+            return None
+        self.dirty.add(record['restaurant'])
+        return self.journal.write(record)
+
+    def log_many(self, records : List[Dict]) -> int | None:
+        """Makes many changes durable at once, as log does. A write-through store records all
+        of them in one transaction. This must be done with the lock held
+
+        Args:
+            records (List[Dict]): The changes, in order
+
+        Returns:
+            int | None: The journal sequence number of the last change, to commit once the lock
+            is released, or None if the changes are durable already
+        """
+        if self.journal is None:
+            self.store.record_many(records)
+            return None
+        sequence = None
+        for record in records:
+            sequence = self.log(record)
+        return sequence
+
+    def sync(self, sequence : int | None):
+        """Waits for a logged change to be durable. Do this without the lock held
+
+        Args:
+            sequence (int | None): What log returned
+        """
+        if sequence is not None:
+            self.journal.commit(sequence)
+
+    def apply(self, record : Dict) -> RestaurantDatabase | None:
+        """Applies a journaled change to this, without journaling it again
+
+        Args:
+            record (Dict): A record made by one of the mutating methods of this, either
+            as it was read back from the journal, or as it was given to the journal
+
+        Returns:
+            RestaurantDatabase | None: The database of the restaurant that changed,
+            or None if the restaurant does not exist
+        """
+        restaurant = record['restaurant']
+        if record['op'] == 'add_restaurant':
+            data = record['data']
+            self.restaurant_map[restaurant] = data if isinstance(data, RestaurantDatabase) else RestaurantDatabase.from_dict(data)
+            self.search_index.add(restaurant)
+            self.fuzzy_index.add(restaurant)
+            self.fuzzy_cache.clear()
+            if self.leaderboards is not None:
+                self.leaderboards.update(restaurant, self.restaurant_map[restaurant].reviews)
+            if self.spatial_index is not None:
+                self.locate(restaurant, self.restaurant_map[restaurant])
+        elif record['op'] == 'remove_restaurant':
+            if restaurant in self.restaurant_map:
+                del self.restaurant_map[restaurant]
+                self.search_index.remove(restaurant)
+                self.fuzzy_index.remove(restaurant)
+                self.fuzzy_cache.clear()
+                if self.leaderboards is not None:
+                    self.leaderboards.remove(restaurant)
+                if self.spatial_index is not None:
+                    self.spatial_index.remove(restaurant)
+            return None
+        
+        restaurant_data = self.restaurant_map.get(restaurant)
+        if restaurant_data and record['op'] == 'add_review':
+            restaurant_data.add_review(Review.from_dict(record['review']))
+        return restaurant_data
+
+    def add_restaurant(self, restaurant : str, restaurant_data : RestaurantDatabase) -> bool:
+        """Registers a new restaurant
+
+        Args:
+            restaurant (str): The name of the restaurant
+            restaurant_data (RestaurantDatabase): The database for the restaurant
+
+        Returns:
+            bool: True iff the restaurant was added, False if it already exists
         """
-        with open(database_file, '+r') as file:
-            data = json.load(file)
-            self.restaurant_map : Dict[str, RestaurantDatabase] = dict()
-            for restaurant in data:
-                self.restaurant_map[restaurant] = RestaurantDatabase.from_dict(data[restaurant])
+        return self.record_change({'op' : 'add_restaurant', 'restaurant' : restaurant, 'data' : restaurant_data}, must_exist=False)
 
-    def save(self, database_file : str = DEFAULT_DATABASE):
-        """Saves a Database Manager into a json file
+    def remove_restaurant(self, restaurant : str) -> bool:
+        """Unregisters a restaurant, along with all of its reviews
 
         Args:
-            database_file (str, optional): The database file to save the manager into.
-                                           Defaults to DEFAULT_DATABASE.
+            restaurant (str): The name of the restaurant
+
+        Returns:
+            bool: True iff the restaurant was removed, False if it doesn't exist
+        """
+        return self.record_change({'op' : 'remove_restaurant', 'restaurant' : restaurant}, must_exist=True)
+
+    def record_change(self, record : Dict, must_exist : bool) -> bool:
+        """Logs and applies a change that adds or removes a restaurant
+
+        Args:
+            record (Dict): The change to make
+            must_exist (bool): Whether the restaurant must already exist (or must not exist)
+            for the change to be made
+
+        Returns:
+            bool: True iff the change was made
         """
-        with open(database_file, 'w+') as file:
-            json.dump({restaurant : self.restaurant_map[restaurant] for restaurant in self.restaurant_map}, file, cls=JSONEncoder)
+        restaurant = record['restaurant']
+        with self.lock:
+            if (restaurant in self.restaurant_map) != must_exist:
+                return False
+            sequence = self.log(record)
+            with self.catalog.writing():
+                self.apply(record)
+            self.catalog_changed = True
+            self.catalog_version += 1
+            self.stamp(restaurant)
+            pending = len(self.dirty)
+        self.sync(sequence)
+        if self.on_change:
+            self.on_change(pending)
+        return True
+
+    @timed("manager.add_review")
+    def add_review(self, restaurant : str, review : Review) -> RestaurantDatabase | None:
+        """Adds a review to a restaurant. The review is logged in the same order it is
+        applied, and this returns once it is durable
+
+        Args:
+            restaurant (str): The restaurant to add the review to
+            review (Review): The review to add
+
+        Returns:
+            RestaurantDatabase | None: The database for the restaurant, or None if the restaurant does not exist
+        """
+        with self.lock:
+            restaurant_data = self.restaurant_map.get(restaurant)
+            if not restaurant_data:
+                return None
+            sequence = self.log({'op' : 'add_review', 'restaurant' : restaurant, 'review' : review})
+            restaurant_data.add_review(review)
+            self.rank(restaurant, restaurant_data)
+            self.stamp(restaurant)
+            pending = len(self.dirty)
+        self.sync(sequence)
+        if self.on_change:
+            self.on_change(pending)
+        return restaurant_data
+
+    @timed("manager.add_reviews")
+    def add_reviews(self, reviews : List[Tuple[str, Review]]) -> List[bool]:
+        """Adds many reviews at once, as if add_review was called on each in order. The reviews
+        of each restaurant are applied together (see RestaurantDatabase.add_reviews), and this
+        returns once all of them are durable, which takes a single sync of the journal (or with
+        a write-through store, one transaction per restaurant)
+
+        Args:
+            reviews (List[Tuple[str, Review]]): The restaurant to add each review to, with the review
+
+        Returns:
+            List[bool]: For each review, True iff it was added (False if its restaurant does not exist)
+        """
+        grouped : Dict[str, List[Review]] = dict()
+        for restaurant, review in reviews:
+            grouped.setdefault(restaurant, []).append(review)
+        added = set()
+        sequence = None
+        with self.lock:
+            for restaurant, batch in grouped.items():
+                restaurant_data = self.restaurant_map.get(restaurant)
+                if not restaurant_data:
+                    continue
+                sequence = self.log_many([{'op' : 'add_review', 'restaurant' : restaurant, 'review' : review}
+                                          for review in batch])
+                restaurant_data.add_reviews(batch)
+                self.rank(restaurant, restaurant_data)
+                self.stamp(restaurant)
+                added.add(restaurant)
+            pending = len(self.dirty)
+        self.sync(sequence)
+        if added and self.on_change:
+            self.on_change(pending)
+        return [restaurant in added for restaurant, _ in reviews]
+
+    def stamp(self, restaurant : str):
+        """Records that a restaurant changed, once the change is applied. This must be done
+        with the lock held
+
+        Args:
+            restaurant (str): The restaurant
+        """
+        self.changes += 1
+        self.stamps[restaurant] = self.changes
+
+    def rank(self, restaurant : str, restaurant_data : RestaurantDatabase):
+        """Moves a restaurant whose reviews changed in the leaderboards, if they were built. This
+        must be done with the lock held
+
+        Args:
+            restaurant (str): The restaurant
+            restaurant_data (RestaurantDatabase): Its database
+        """
+        if self.leaderboards is not None:
+            self.leaderboards.update(restaurant, restaurant_data.reviews)
+
+    def locate(self, restaurant : str, restaurant_data : RestaurantDatabase):
+        """Puts a restaurant in the spatial index, if it has a location. The spatial index
+        must be built, and the lock must be held
+
+        Args:
+            restaurant (str): The restaurant
+            restaurant_data (RestaurantDatabase): Its database
+        """
+        location = restaurant_data.restaurant_info.location
+        if location:
+            self.spatial_index.add(restaurant, *location)
+        else:
+            self.spatial_index.remove(restaurant)
+
+    def restaurant_etag(self, restaurant : str) -> str | None:
+        """Gets a tag that changes whenever a restaurant does, without loading it. Read it
+        before the restaurant, so that what is read is never older than the tag
+
+        Args:
+            restaurant (str): The restaurant
+
+        Returns:
+            str | None: The tag, or None if the restaurant does not exist
+        """
+        if restaurant not in self.restaurant_map:
+            return None
+        return f"{self.epoch}.{self.stamps.get(restaurant, 0)}"
+
+    def catalog_etag(self) -> str:
+        """Gets a tag that changes whenever a restaurant is added or removed
+
+        Returns:
+            str: The tag
+        """
+        return f"{self.epoch}.c{self.catalog_version}"
 
     def contains_restaurant(self, restaurant : str) -> bool:
         """Evaluates if a restaurant exists
@@ -58,16 +640,218 @@ class DatabaseManager:
         """
         return self.restaurant_map.get(restaurant)
 
-    def get_restaurant_list(self, query : str = "") -> List[str]:
+    @timed("manager.search")
+    def get_restaurant_list(self, query : str = "", prefix : bool = False, ignore_case : bool = False,
+                            limit : int | None = None, offset : int = 0) -> List[str]:
         """Obtains the list of restaurants in the database based on a query
 
         Args:
             query (str, optional): The query used to filter out some restaurants. Defaults to "".
+            prefix (bool, optional): Whether restaurants must start with query. Defaults to False.
+            ignore_case (bool, optional): Whether to match regardless of case. Defaults to False.
+            limit (int | None, optional): The most restaurants to return. Defaults to None (no limit).
+            offset (int, optional): The number of matching restaurants to skip. Defaults to 0.
 
         Returns:
             List[str]: Returns all restaurants that contains the substring query
         """
-        if not query:
-            return list(self.restaurant_map.keys())
+        with self.catalog.reading():
+            if not query and limit is None and not offset:
+                return list(self.restaurant_map.keys())
+
+            return self.search_index.search(query, prefix=prefix, ignore_case=ignore_case, limit=limit, offset=offset)
+
+    @timed("manager.fuzzy_search")
+    def get_ranked_restaurant_list(self, query : str, max_distance : int | None = None,
+                                   limit : int = DEFAULT_FUZZY_LIMIT) -> List[str]:
+        """Obtains the restaurants that best match a query, tolerating typos in it.
+        Results are cached until a restaurant is added or removed
+
+        Args:
+            query (str): The query, which may contain typos
+            max_distance (int | None, optional): The most typos allowed per word of query.
+                                                 Defaults to None, which scales it with the
+                                                 length of each word.
+            limit (int, optional): The most restaurants to return. Defaults to DEFAULT_FUZZY_LIMIT.
+
+        Returns:
+            List[str]: The matching restaurants, ranked by the number of typos and then
+            by whether they start with query
+        """
+        key = (query, max_distance, limit)
+        results = self.fuzzy_cache.get(key)
+        if results is None:
+            # Caching under the catalog lock keeps a result from outliving the clear done by a change
+            with self.catalog.reading():
+                results = self.fuzzy_index.search(query, max_distance=max_distance, limit=limit)
+                self.fuzzy_cache.put(key, results)
+        return list(results)
+
+    @timed("manager.top")
+    def get_top_restaurants(self, category : ReviewCategory, k : int, min_reviews : int = 1) -> List[Dict[str, str | float | int]]:
+        """Gets the restaurants with the highest mean rating in a category (see Leaderboards.top).
+        The first call ranks every restaurant, loading each one that isn't resident; after that,
+        this costs O(k)
+
+        Args:
+            category (ReviewCategory): The category
+            k (int): The most restaurants to return
+            min_reviews (int, optional): The fewest ratings in category a restaurant needs to be
+                                         ranked. Defaults to 1.
+
+        Returns:
+            List[Dict[str, str | float | int]]: The name, mean rating and number of ratings of
+            each restaurant, highest mean first
+        """
+        leaderboards = self.leaderboards
+        if leaderboards is None:
+            with self.lock:
+                if self.leaderboards is None:
+                    leaderboards = Leaderboards()
+                    for restaurant in list(self.restaurant_map):
+                        leaderboards.update(restaurant, self.restaurant_map[restaurant].reviews)
+                    self.leaderboards = leaderboards
+                leaderboards = self.leaderboards
+        return leaderboards.top(category, k, min_reviews)
+
+    @timed("manager.nearby")
+    def get_nearby_restaurants(self, latitude : float, longitude : float, k : int, radius : float | None = None,
+                               categories : Tuple[ReviewCategory, ...] = (), min_rating : float | None = None) -> List[Dict]:
+        """Gets the restaurants closest to a location, closest first, optionally only those with good
+        enough ratings. Only restaurants with a location are found. The first call indexes every
+        restaurant, loading each one that isn't resident; after that, restaurants are visited in
+        order of distance, and only those that are visited are checked against the ratings
+
+        Args:
+            latitude (float): The latitude of the location, in degrees
+            longitude (float): The longitude of the location, in degrees
+            k (int): The most restaurants to return
+            radius (float | None, optional): The furthest a restaurant may be, in kilometers. Defaults to None (no limit).
+            categories (Tuple[ReviewCategory, ...], optional): The categories a restaurant must have ratings in. Defaults to ().
+            min_rating (float | None, optional): The lowest mean rating a restaurant may have in each of categories
+                                                 (or, without categories, in every category it has ratings in,
+                                                 of which it needs at least one). Defaults to None.
+
+        Returns:
+            List[Dict]: For each restaurant, its name (restaurant), distance in kilometers (distance),
+            latitude, longitude and mean rating of each category (accessibility_summary)
+        """
+        spatial_index = self.spatial_index
+        if spatial_index is None:
+            with self.lock:
+                if self.spatial_index is None:
+                    self.spatial_index = GridIndex()
+                    for restaurant in list(self.restaurant_map):
+                        self.locate(restaurant, self.restaurant_map[restaurant])
+                spatial_index = self.spatial_index
+        
+        nearby = []
+        if k <= 0:
+            return nearby
+        for distance, restaurant in spatial_index.nearest(latitude, longitude, radius):
+            restaurant_data = self.restaurant_map.get(restaurant)
+            if not restaurant_data or not restaurant_data.restaurant_info.location:
+                continue
+            summary = restaurant_data.get_ratings_summary()
+            if not all(category in summary for category in categories):
+                continue
+            if min_rating is not None:
+                rated = [summary[category] for category in categories] if categories else list(summary.values())
+                if not rated or min(rated) < min_rating:
+                    continue
+            location = restaurant_data.restaurant_info.location
+            nearby.append({'restaurant' : restaurant, 'distance' : distance, 'latitude' : location[0],
+                           'longitude' : location[1], 'accessibility_summary' : summary})
+            if len(nearby) == k:
+                break
+        return nearby
+
+    @timed("manager.ratings_statistics")
+    def get_ratings_statistics(self, restaurant : str | None = None,
+                               percentiles : Tuple[int, ...] = DEFAULT_PERCENTILES) -> Dict[ReviewCategory, Dict] | None:
+        """Computes detailed rating statistics for a restaurant, or across every restaurant
+        at once. This uses the columnar backend of each restaurant, which requires numpy
+
+        Args:
+            restaurant (str | None, optional): The restaurant. Defaults to None, for all restaurants.
+            percentiles (Tuple[int, ...], optional): The percentiles to compute. Defaults to DEFAULT_PERCENTILES.
+
+        Returns:
+            Dict[ReviewCategory, Dict] | None: The count, mean, median, standard deviation, percentiles
+            and histogram of each category (see columnar.summarize), or None if the restaurant doesn't exist
+        """
+        if restaurant is None:
+            with self.catalog.reading():
+                names = list(self.restaurant_map)
+            restaurants = [self.restaurant_map.get(name) for name in names]
+            return summarize_all([restaurant_data.get_rating_columns() for restaurant_data in restaurants if restaurant_data], percentiles)
+        restaurant_data = self.restaurant_map.get(restaurant)
+        if not restaurant_data:
+            return None
+        return restaurant_data.get_ratings_statistics(percentiles)
+
+    @timed("manager.search_reviews")
+    def search_reviews(self, query : str, restaurant : str | None = None, categories : Tuple[ReviewCategory, ...] = (),
+                       offset : int = 0, limit : int = DEFAULT_REVIEW_SEARCH_LIMIT) -> Dict | None:
+        """Searches the text of reviews, of one restaurant or of every restaurant, ranked with BM25
+        over the reviews searched. A review is found iff it contains every term of the search, and
+        every phrase in double quotes (see TextQuery). Each restaurant's text index is built the
+        first time it is searched (so the first search of every restaurant builds them all, loading
+        each one that isn't resident), and after that, add_review keeps it up to date
 
-        return [restaurant for restaurant in self.restaurant_map if query in restaurant]
\ No newline at end of file
+        Args:
+            query (str): The search, such as: "narrow door" braille
+            restaurant (str | None, optional): The restaurant to search. Defaults to None, for every restaurant.
+            categories (Tuple[ReviewCategory, ...], optional): The categories a review must have rated. Defaults to ().
+            offset (int, optional): The number of the best reviews found to skip. Defaults to 0.
+            limit (int, optional): The most reviews to return. Defaults to DEFAULT_REVIEW_SEARCH_LIMIT.
+
+        Returns:
+            Dict | None: The number of reviews found (total), and for the page of them asked for,
+            best first (hits): the restaurant, user, score, ratings, and a snippet of the review
+            with the start and end of each term in it (highlights). None if the restaurant doesn't exist
+        """
+        parsed = TextQuery.parse(query)
+        if restaurant is not None:
+            restaurant_data = self.restaurant_map.get(restaurant)
+            if not restaurant_data:
+                return None
+            targets = [(restaurant, restaurant_data)]
+        else:
+            with self.catalog.reading():
+                names = list(self.restaurant_map)
+            targets = [(name, self.restaurant_map.get(name)) for name in names]
+        if not parsed.terms:
+            return {'total' : 0, 'hits' : []}
+        
+        # Weigh the terms over every review searched, and then find and rank the reviews of each
+        # restaurant, keeping only enough of each to fill the page
+        documents = total_length = 0
+        frequencies = [0] * len(parsed.terms)
+        searched = []
+        for i, (_, restaurant_data) in enumerate(targets):
+            if not restaurant_data:
+                continue
+            count, length, document_frequencies = restaurant_data.get_text_statistics(parsed.terms)
+            documents += count
+            total_length += length
+            frequencies = [a + b for a, b in zip(frequencies, document_frequencies)]
+            # Restaurants without a review containing every term can't have a match
+            if all(document_frequencies):
+                searched.append((i, restaurant_data))
+        weights = [inverse_document_frequency(documents, frequency) for frequency in frequencies]
+        average_length = total_length / documents if documents else 0.0
+        
+        total = 0
+        best = []
+        for i, restaurant_data in searched:
+            found, ranked = restaurant_data.search_reviews(parsed, weights, average_length, offset + limit, *categories)
+            total += found
+            best.extend((score, i, position, review) for score, position, review in ranked)
+        best = heapq.nlargest(offset + limit, best, key=lambda hit: (hit[0], -hit[1], -hit[2])) if limit > 0 else []
+        hits = []
+        for score, i, _, review in best[offset:]:
+            text, highlights = snippet(review.review, parsed.terms)
+            hits.append({'restaurant' : targets[i][0], 'user' : review.user, 'score' : score, 'ratings' : review.ratings,
+                         'snippet' : text, 'highlights' : highlights})
+        return {'total' : total, 'hits' : hits}
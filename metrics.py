@@ -0,0 +1,329 @@
+import bisect
+import functools
+import threading
+import time
+
+from typing import Any, Callable, Dict, List, Tuple
+
+# Latency buckets double from 10 microseconds to about 21 seconds, and size buckets
+# quadruple from 64 bytes to 64 megabytes, so both cover their range in a few buckets
+LATENCY_BUCKETS = tuple(0.00001 * 2 ** i for i in range(22))
+SIZE_BUCKETS = tuple(64 * 4 ** i for i in range(11))
+
+# A snapshot of a metric: its kind, help, label names, and its value for each set of label values
+# (a number, or for a histogram, its upper bounds, the count in each bucket and the sum)
+MetricSnapshot = Tuple[str, str, Tuple[str, ...], Dict[Tuple[str, ...], Any]]
+
+def escape(value : str) -> str:
+    """Escapes a label value for the Prometheus text format
+
+    Args:
+        value (str): The label value
+
+    Returns:
+        str: The escaped value
+    """
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(names : Tuple[str, ...], values : Tuple[str, ...], extra : str = "") -> str:
+    """Formats the labels of a sample for the Prometheus text format
+
+    Args:
+        names (Tuple[str, ...]): The label names
+        values (Tuple[str, ...]): The label values
+        extra (str, optional): Another, already formatted, label to add. Defaults to "".
+
+    Returns:
+        str: The labels in braces, or nothing if there are none
+    """
+    labels = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+def format_number(value : float) -> str:
+    """Formats a sample value for the Prometheus text format
+
+    Args:
+        value (float): The value
+
+    Returns:
+        str: The value, as an integer if it is a whole number
+    """
+    if value == float('inf'):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    """A Counter is a count for each set of label values, which only goes up
+    """
+    kind = "counter"
+
+    def __init__(self, name : str, help : str, labels : Tuple[str, ...] = ()):
+        """Creates a Counter at zero
+
+        Args:
+            name (str): The name of the metric
+            help (str): What it counts
+            labels (Tuple[str, ...], optional): The names of its labels. Defaults to ().
+        """
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values : Dict[Tuple[str, ...], float] = dict()
+        self.lock = threading.Lock()
+
+    def inc(self, *labels : str, amount : float = 1):
+        """Adds to the count of a set of label values
+
+        Args:
+            labels (varargs, str): The label values, in the order of the label names
+            amount (float, optional): How much to add. Defaults to 1.
+        """
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self) -> MetricSnapshot:
+        """Copies this
+
+        Returns:
+            MetricSnapshot: This, as it is now
+        """
+        with self.lock:
+            return self.kind, self.help, self.labels, dict(self.values)
+
+class HistogramChild:
+    """A HistogramChild is the histogram of one set of label values of a Histogram
+    """
+    __slots__ = ('bounds', 'counts', 'sum', 'lock')
+
+    def __init__(self, bounds : Tuple[float, ...]):
+        self.bounds = bounds
+        # The last count is of observations above every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value : float):
+        """Records an observation
+
+        Args:
+            value (float): The observation
+        """
+        bucket = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.sum += value
+
+class Histogram:
+    """A Histogram counts observations (such as latencies) into buckets with fixed upper bounds,
+    for each set of label values. Recording an observation costs a binary search over the bounds
+    and one uncontended lock
+    """
+    kind = "histogram"
+
+    def __init__(self, name : str, help : str, labels : Tuple[str, ...] = (), bounds : Tuple[float, ...] = LATENCY_BUCKETS):
+        """Creates an empty Histogram
+
+        Args:
+            name (str): The name of the metric
+            help (str): What it observes
+            labels (Tuple[str, ...], optional): The names of its labels. Defaults to ().
+            bounds (Tuple[float, ...], optional): The upper bound of each bucket, in increasing order.
+                                                  Defaults to LATENCY_BUCKETS.
+        """
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.bounds = bounds
+        self.children : Dict[Tuple[str, ...], HistogramChild] = dict()
+        self.lock = threading.Lock()
+
+    def child(self, *labels : str) -> HistogramChild:
+        """Gets the histogram of a set of label values, so that it can be observed without looking it up each time
+
+        Args:
+            labels (varargs, str): The label values, in the order of the label names
+
+        Returns:
+            HistogramChild: Its histogram
+        """
+        child = self.children.get(labels)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(labels, HistogramChild(self.bounds))
+        return child
+
+    def observe(self, value : float, *labels : str):
+        """Records an observation for a set of label values
+
+        Args:
+            value (float): The observation
+            labels (varargs, str): The label values, in the order of the label names
+        """
+        self.child(*labels).observe(value)
+
+    def snapshot(self) -> MetricSnapshot:
+        """Copies this
+
+        Returns:
+            MetricSnapshot: This, as it is now
+        """
+        values = dict()
+        for labels, child in list(self.children.items()):
+            with child.lock:
+                values[labels] = (self.bounds, list(child.counts), child.sum)
+        return self.kind, self.help, self.labels, values
+
+class Gauge:
+    """A Gauge is a value that can go up and down, which is read from a function whenever
+    metrics are collected, so keeping it up to date costs nothing
+    """
+    kind = "gauge"
+
+    def __init__(self, name : str, help : str, function : Callable[[], float | Dict[Tuple[str, ...], float] | None],
+                 labels : Tuple[str, ...] = ()):
+        """Creates a Gauge
+
+        Args:
+            name (str): The name of the metric
+            help (str): What it measures
+            function (Callable[[], float | Dict[Tuple[str, ...], float] | None]): Reads the value, or without labels,
+                                                                                  the value of each set of label values.
+                                                                                  None leaves the gauge out
+            labels (Tuple[str, ...], optional): The names of its labels. Defaults to ().
+        """
+        self.name = name
+        self.help = help
+        self.function = function
+        self.labels = labels
+
+    def snapshot(self) -> MetricSnapshot:
+        """Reads this
+
+        Returns:
+            MetricSnapshot: This, as it is now
+        """
+        value = self.function()
+        if value is None:
+            values = dict()
+        elif isinstance(value, dict):
+            values = value
+        else:
+            values = {() : value}
+        return self.kind, self.help, self.labels, values
+
+class Registry:
+    """A Registry holds the metrics of a process, and renders them in the Prometheus text format.
+    Snapshots of the registries of several processes can be merged, adding up their values
+    """
+
+    def __init__(self):
+        """Creates a Registry with no metrics
+        """
+        self.metrics : Dict[str, Counter | Histogram | Gauge] = dict()
+        self.lock = threading.Lock()
+
+    def register(self, metric : Counter | Histogram | Gauge) -> Counter | Histogram | Gauge:
+        """Adds a metric, replacing any metric with the same name
+
+        Args:
+            metric (Counter | Histogram | Gauge): The metric
+
+        Returns:
+            Counter | Histogram | Gauge: The metric
+        """
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> Dict[str, MetricSnapshot]:
+        """Copies every metric, so it can be merged with other processes' or rendered
+
+        Returns:
+            Dict[str, MetricSnapshot]: Each metric, by name
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name : metric.snapshot() for metric in metrics}
+
+    @staticmethod
+    def merge(*snapshots : Dict[str, MetricSnapshot]) -> Dict[str, MetricSnapshot]:
+        """Merges the snapshots of several registries, adding up the values (and histogram buckets)
+        of the same metric and label values
+
+        Args:
+            snapshots (varargs, Dict[str, MetricSnapshot]): The snapshots
+
+        Returns:
+            Dict[str, MetricSnapshot]: The merged snapshot
+        """
+        merged : Dict[str, MetricSnapshot] = dict()
+        for snapshot in snapshots:
+            for name, (kind, help, labels, values) in snapshot.items():
+                if name not in merged:
+                    merged[name] = (kind, help, labels, dict())
+                totals = merged[name][3]
+                for key, value in values.items():
+                    if key not in totals:
+                        totals[key] = (value[0], list(value[1]), value[2]) if kind == "histogram" else value
+                    elif kind == "histogram":
+                        bounds, counts, total = totals[key]
+                        totals[key] = (bounds, [a + b for a, b in zip(counts, value[1])], total + value[2])
+                    else:
+                        totals[key] += value
+        return merged
+
+    @staticmethod
+    def render(snapshot : Dict[str, MetricSnapshot]) -> str:
+        """Renders a snapshot in the Prometheus text exposition format
+
+        Args:
+            snapshot (Dict[str, MetricSnapshot]): The snapshot
+
+        Returns:
+            str: The metrics, one family after another
+        """
+        lines : List[str] = []
+        for name in sorted(snapshot):
+            kind, help, labels, values = snapshot[name]
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key in sorted(values, key=lambda key: tuple(map(str, key))):
+                if kind != "histogram":
+                    lines.append(f"{name}{format_labels(labels, key)} {format_number(values[key])}")
+                    continue
+                bounds, counts, total = values[key]
+                cumulative = 0
+                for bound, count in zip((*bounds, float('inf')), counts):
+                    cumulative += count
+                    le = 'le="' + format_number(bound) + '"'
+                    lines.append(f"{name}_bucket{format_labels(labels, key, le)} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels, key)} {format_number(total)}")
+                lines.append(f"{name}_count{format_labels(labels, key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+# The metrics of this process
+REGISTRY = Registry()
+SPANS : Histogram = REGISTRY.register(Histogram("span_duration_seconds", "Time spent in named spans of the hot paths", ("span",)))
+
+def timed(span : str) -> Callable[[Callable], Callable]:
+    """Makes a function record how long each call of it takes, as a named span
+
+    Args:
+        span (str): The name of the span
+
+    Returns:
+        Callable[[Callable], Callable]: A decorator for the function
+    """
+    child = SPANS.child(span)
+    def decorate(function : Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    return decorate
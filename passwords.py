@@ -0,0 +1,177 @@
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ..common.constants import PASSWORD_ITERATIONS, DEFAULT_HASH_WORKERS, DEFAULT_HASH_QUEUE
+
+from typing import Any, Callable, Dict
+
+# Hashed passwords are stored as "pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>".
+# Anything else is a legacy plaintext password
+ALGORITHM = "pbkdf2_sha256"
+SALT_BYTES = 16
+
+def hash_password(password : str, iterations : int = PASSWORD_ITERATIONS) -> str:
+    """Hashes a password with a new random salt
+
+    Args:
+        password (str): The password
+        iterations (int, optional): The number of PBKDF2 iterations. Defaults to PASSWORD_ITERATIONS.
+
+    Returns:
+        str: The stored form of the password
+    """
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return f"{ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+def is_hashed(stored : str) -> bool:
+    """Evaluates if a stored password is hashed, rather than legacy plaintext
+
+    Args:
+        stored (str): The stored form of a password
+
+    Returns:
+        bool: True iff it was made by hash_password
+    """
+    return stored.startswith(ALGORITHM + "$")
+
+def verify_password(password : str, stored : str) -> bool:
+    """Checks a password against its stored form, in constant time
+
+    Args:
+        password (str): The password to check
+        stored (str): The stored form of the real password, hashed or plaintext
+
+    Returns:
+        bool: True iff the password is correct
+    """
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    _, iterations, salt, digest = stored.split("$")
+    attempt = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(attempt, bytes.fromhex(digest))
+
+class PoolSaturated(Exception):
+    """Raised when too much hashing is already waiting to be done
+    """
+
+class PasswordHasher:
+    """A PasswordHasher hashes and verifies passwords on a bounded pool of worker threads
+    (PBKDF2 releases the GIL, so they run in parallel). At most max_pending jobs may be
+    queued or running at once; past that, new jobs are rejected with PoolSaturated instead
+    of queueing up behind a burst
+    """
+
+    def __init__(self, workers : int = DEFAULT_HASH_WORKERS, max_pending : int = DEFAULT_HASH_QUEUE,
+                 iterations : int = PASSWORD_ITERATIONS):
+        """Creates a PasswordHasher, whose workers are started as they are needed
+
+        Args:
+            workers (int, optional): The number of worker threads. Defaults to DEFAULT_HASH_WORKERS.
+            max_pending (int, optional): The most jobs queued or running at once. Defaults to DEFAULT_HASH_QUEUE.
+            iterations (int, optional): The PBKDF2 iterations for new hashes. Defaults to PASSWORD_ITERATIONS.
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.iterations = iterations
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="password-hasher")
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.peak_pending = 0
+        self.jobs = 0
+        self.rejected = 0
+        self.job_time = 0.0
+        self.wait_time = 0.0
+
+    def run(self, function : Callable[..., Any], *args : Any) -> Any:
+        """Runs a job on the pool, and waits for its result
+
+        Args:
+            function (Callable[..., Any]): The job
+            args (Any): Its arguments
+
+        Raises:
+            PoolSaturated: If max_pending jobs are already queued or running
+
+        Returns:
+            Any: What the job returned
+        """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise PoolSaturated(f"{self.pending} password jobs are already pending")
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+        try:
+            return self.executor.submit(self.timed, time.perf_counter(), function, *args).result()
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def timed(self, submitted : float, function : Callable[..., Any], *args : Any) -> Any:
+        """Runs a job on a worker, recording how long it waited and ran
+
+        Args:
+            submitted (float): When the job was submitted, on time.perf_counter
+            function (Callable[..., Any]): The job
+            args (Any): Its arguments
+
+        Returns:
+            Any: What the job returned
+        """
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.jobs += 1
+                self.job_time += end - start
+                self.wait_time += start - submitted
+
+    def hash(self, password : str) -> str:
+        """Hashes a password on the pool
+
+        Args:
+            password (str): The password
+
+        Raises:
+            PoolSaturated: If the pool is saturated
+
+        Returns:
+            str: The stored form of the password
+        """
+        return self.run(hash_password, password, self.iterations)
+
+    def verify(self, password : str, stored : str) -> bool:
+        """Checks a password against its stored form on the pool
+
+        Args:
+            password (str): The password to check
+            stored (str): The stored form of the real password
+
+        Raises:
+            PoolSaturated: If the pool is saturated
+
+        Returns:
+            bool: True iff the password is correct
+        """
+        return self.run(verify_password, password, stored)
+
+    def stats(self) -> Dict[str, int | float]:
+        """Gets statistics about the hashing done on the pool
+
+        Returns:
+            Dict[str, int | float]: The number of workers, pending jobs, the most that were ever
+            pending and the limit, the number of jobs run and rejected, and the total and average
+            time (seconds) jobs spent running and waiting for a worker
+        """
+        with self.lock:
+            return {'workers' : self.workers, 'pending' : self.pending, 'peak_pending' : self.peak_pending,
+                    'max_pending' : self.max_pending, 'jobs' : self.jobs, 'rejected' : self.rejected,
+                    'job_time' : self.job_time, 'average_job_time' : self.job_time / self.jobs if self.jobs else 0.0,
+                    'wait_time' : self.wait_time, 'average_wait_time' : self.wait_time / self.jobs if self.jobs else 0.0}
@@ -0,0 +1,272 @@
+import collections
+import os
+import re
+import sys
+import threading
+import time
+
+from .constants import DEFAULT_PROFILE_DIRECTORY, DEFAULT_SAMPLE_INTERVAL, DEFAULT_PROFILES_PER_MINUTE, DEFAULT_PROFILES_KEPT
+
+from typing import Any, Counter, Deque, Dict, List, Tuple
+from types import CodeType, FrameType
+
+# The extension of collapsed stack files, which flamegraph.pl and speedscope read as they are
+PROFILE_EXTENSION = ".folded"
+
+# The name of each function profiled so far, since naming it again on every sample would
+# cost more than the sample
+NAMES : Dict[CodeType, str] = dict()
+
+def code_name(code : CodeType) -> str:
+    """Names a function in a collapsed stack
+
+    Args:
+        code (CodeType): The code of the function
+
+    Returns:
+        str: Its name, file and first line, without the semicolons that separate frames
+    """
+    name = NAMES.get(code)
+    if name is None:
+        name = f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+        NAMES[code] = name
+    return name
+
+def builtin_name(function : Any) -> str:
+    """Names a builtin (C) function in a collapsed stack
+
+    Args:
+        function (Any): The function
+
+    Returns:
+        str: Its module and name, or for a method, its class and name
+    """
+    module = getattr(function, '__module__', None)
+    name = getattr(function, '__qualname__', None) or getattr(function, '__name__', repr(function))
+    return (f"{module}.{name}" if module else name).replace(";", ":")
+
+def collapse(frame : FrameType, root : FrameType | None) -> str:
+    """Collapses the stack of a frame into one line, outermost function first
+
+    Args:
+        frame (FrameType): The innermost frame
+        root (FrameType | None): The frame to stop at, which is left out, along with every frame
+                                 outside of it. Defaults to None, for the whole stack.
+
+    Returns:
+        str: The name of each function, separated by semicolons
+    """
+    names = []
+    while frame is not None and frame is not root:
+        names.append(code_name(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class TracedProfile:
+    """A TracedProfile is a deterministic profile of one thread: every call and return (including
+    calls to builtins) is traced, and each stack's own time, excluding the calls it made, is
+    added up in microseconds. Tracing makes the code it profiles several times slower, so it is
+    only for requests that asked to be profiled
+    """
+
+    def __init__(self):
+        """Creates a TracedProfile. Nothing is traced until start
+        """
+        self.stacks : Counter[str] = collections.Counter()
+        # Each open call: its stack, when it started, and the time spent in the calls it made
+        self.calls : List[List] = []
+
+    def start(self):
+        """Traces the calling thread, from its next call on
+        """
+        self.calls = [["", time.perf_counter(), 0.0]]
+        sys.setprofile(self.trace)
+
+    def stop(self) -> Counter[str]:
+        """Stops tracing
+
+        Returns:
+            Counter[str]: The microseconds spent in each collapsed stack
+        """
+        sys.setprofile(None)
+        now = time.perf_counter()
+        # Calls still open (the one that called stop) end now
+        while len(self.calls) > 1:
+            self.leave(now)
+        return self.stacks
+
+    def leave(self, now : float):
+        """Ends the innermost open call
+
+        Args:
+            now (float): When it ended
+        """
+        stack, started, inner = self.calls.pop()
+        elapsed = now - started
+        self.stacks[stack] += round((elapsed - inner) * 1e6)
+        self.calls[-1][2] += elapsed
+
+    def trace(self, frame : FrameType, event : str, arg : Any):
+        """Records an event of the traced thread (see sys.setprofile)
+
+        Args:
+            frame (FrameType): The frame the event happened in
+            event (str): The event
+            arg (Any): For calls to builtins, the builtin
+        """
+        now = time.perf_counter()
+        if event == 'call' or event == 'c_call':
+            name = code_name(frame.f_code) if event == 'call' else builtin_name(arg)
+            parent = self.calls[-1][0]
+            self.calls.append([f"{parent};{name}" if parent else name, now, 0.0])
+        elif len(self.calls) > 1:
+            # Returns from calls made before tracing started have nothing to end
+            self.leave(now)
+
+class Sampler:
+    """A Sampler takes a sample of the stack of every watched thread every interval, from a
+    thread of its own. It costs nothing while no thread is watched, and the watched threads
+    run at full speed, so every request can be sampled in case it turns out to be slow
+    """
+
+    def __init__(self, interval : float = DEFAULT_SAMPLE_INTERVAL):
+        """Creates a Sampler. Its thread starts when the first thread is watched
+
+        Args:
+            interval (float, optional): Seconds between samples. Defaults to DEFAULT_SAMPLE_INTERVAL.
+        """
+        self.interval = interval
+        # For each watched thread, the frame samples stop at and the samples of each collapsed stack
+        self.watched : Dict[int, Tuple[FrameType, Counter[str]]] = dict()
+        self.lock = threading.Lock()
+        self.waiting = threading.Event()
+        self.thread : threading.Thread | None = None
+
+    def watch(self, root : FrameType) -> Counter[str]:
+        """Samples the calling thread until unwatch, under a frame
+
+        Args:
+            root (FrameType): The frame of the calling thread that samples stop at
+
+        Returns:
+            Counter[str]: The samples of each collapsed stack, which fill in as they are taken
+        """
+        samples = collections.Counter()
+        with self.lock:
+            self.watched[threading.get_ident()] = (root, samples)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="sampler", daemon=True)
+                self.thread.start()
+        self.waiting.set()
+        return samples
+
+    def unwatch(self):
+        """Stops sampling the calling thread
+        """
+        with self.lock:
+            self.watched.pop(threading.get_ident(), None)
+
+    def run(self):
+        """Takes samples forever, waiting while no thread is watched
+        """
+        while True:
+            self.waiting.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                if not self.watched:
+                    self.waiting.clear()
+                    continue
+                for thread, (root, samples) in self.watched.items():
+                    frame = frames.get(thread)
+                    if frame is not None:
+                        samples[collapse(frame, root)] += 1
+            # Frames hold their locals, so they shouldn't be kept past the sample
+            del frames
+
+class ProfileWriter:
+    """A ProfileWriter writes profiles into a rotating directory, where only the newest ones are
+    kept, and limits how many automatic profiles are written each minute. It is safe to use from
+    multiple threads (and processes, sharing a directory)
+    """
+
+    def __init__(self, directory : str = DEFAULT_PROFILE_DIRECTORY, per_minute : int = DEFAULT_PROFILES_PER_MINUTE,
+                 kept : int = DEFAULT_PROFILES_KEPT):
+        """Creates a ProfileWriter, and the directory if it doesn't exist
+
+        Args:
+            directory (str, optional): The directory. Defaults to DEFAULT_PROFILE_DIRECTORY.
+            per_minute (int, optional): The most automatic profiles to write in any minute.
+                                        Defaults to DEFAULT_PROFILES_PER_MINUTE.
+            kept (int, optional): The most profiles to keep in the directory. Defaults to DEFAULT_PROFILES_KEPT.
+        """
+        self.directory = directory
+        self.per_minute = per_minute
+        self.kept = kept
+        os.makedirs(directory, exist_ok=True)
+        self.recent : Deque[float] = collections.deque()
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+
+    def allow(self) -> bool:
+        """Takes one of the automatic profiles allowed this minute, if any are left
+
+        Returns:
+            bool: True iff a profile may be written
+        """
+        now = time.monotonic()
+        with self.lock:
+            while self.recent and now - self.recent[0] >= 60:
+                self.recent.popleft()
+            if len(self.recent) >= self.per_minute:
+                self.dropped += 1
+                return False
+            self.recent.append(now)
+            return True
+
+    def write(self, label : str, stacks : Counter[str]) -> str | None:
+        """Writes a profile as collapsed stacks, one "stack value" line each, and removes the
+        oldest profiles past the most kept
+
+        Args:
+            label (str): What was profiled, which names the file along with the time and process
+            stacks (Counter[str]): The value (samples or microseconds) of each collapsed stack
+
+        Returns:
+            str | None: The name of the file, or None if there was nothing to write
+        """
+        lines = [f"{stack} {value}\n" for stack, value in stacks.items() if stack and value > 0]
+        if not lines:
+            return None
+        now = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f".{int(now % 1 * 1000):03d}"
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{stamp}-{os.getpid()}-{label}") + PROFILE_EXTENSION
+        with open(os.path.join(self.directory, name), 'w') as file:
+            file.writelines(lines)
+        with self.lock:
+            self.written += 1
+        self.rotate()
+        return name
+
+    def rotate(self):
+        """Removes the oldest profiles in the directory, past the most kept. Names start with
+        the time they were written, so the oldest sort first
+        """
+        profiles = sorted(name for name in os.listdir(self.directory) if name.endswith(PROFILE_EXTENSION))
+        for name in profiles[:max(0, len(profiles) - self.kept)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                # Another process rotated it already
+                pass
+
+    def stats(self) -> Dict[str, int | str]:
+        """Gets statistics about the profiles written
+
+        Returns:
+            Dict[str, int | str]: The directory, the number of profiles written, and the number of
+            automatic profiles dropped because too many were written that minute
+        """
+        with self.lock:
+            return {'directory' : self.directory, 'written' : self.written, 'dropped' : self.dropped}
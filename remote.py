@@ -0,0 +1,499 @@
+import importlib
+import json
+import threading
+import traceback
+from multiprocessing.connection import Client, Connection, Listener
+
+from ..common.cache import LRUCache
+from ..common.constants import DEFAULT_SEARCH_CACHE_SIZE, DEFAULT_FUZZY_LIMIT, DEFAULT_MAX_RESIDENT, DEFAULT_REVIEW_SEARCH_LIMIT
+from ..common.json import JSONEncoder
+from ..common.locks import RWLock
+from ..common.metrics import REGISTRY, Registry, MetricSnapshot, timed
+from ..common.review_categories import ReviewCategory
+from .columnar import summarize_all, DEFAULT_PERCENTILES
+from .fuzzy import FuzzyIndex
+from .manager import DatabaseManager
+from .passwords import PoolSaturated
+from .restaurant import RestaurantDatabase
+from .reviews import Review
+from .shared_snapshot import SnapshotPublisher, SnapshotReader
+from .snapshotter import Snapshotter
+from .trigram import TrigramIndex
+from .users import Users, User
+
+from typing import Any, Dict, List, Tuple
+
+# Exceptions that are raised again on the calling side of a remote call, so that request
+# handlers can treat them exactly as they would locally. Anything else becomes a RuntimeError
+REMOTE_EXCEPTIONS = {exception.__name__ : exception for exception in (ValueError, PoolSaturated)}
+
+def run_worker(routes : str, *args : Any):
+    """The entry point of a worker process. Spawned processes can't find functions in the
+    __main__ module of a package, so this imports the module with the routes under its own
+    name, and calls its serve_worker
+
+    Args:
+        routes (str): The name of the module with the routes
+        args (Any): The arguments of its serve_worker
+    """
+    importlib.import_module(routes).serve_worker(*args)
+
+class WriterService:
+    """A WriterService is what the writer process exposes to worker processes: every
+    operation that changes the restaurants or users, or that needs the state only the
+    writer has (login sessions, statistics). Workers call it through a WriterClient
+    """
+
+    # The methods workers may call
+    METHODS = frozenset(('add_review', 'add_reviews', 'get_top_restaurants', 'get_nearby_restaurants', 'search_reviews', 'add_user', 'login', 'logout', 'validate_user', 'contains_name',
+                         'auth_stats', 'session_stats', 'snapshot_stats', 'publisher_stats', 'report_metrics', 'metrics'))
+
+    def __init__(self, manager : DatabaseManager, users : Users, snapshotter : Snapshotter, publisher : SnapshotPublisher):
+        """Creates a WriterService
+
+        Args:
+            manager (DatabaseManager): The restaurants
+            users (Users): The users
+            snapshotter (Snapshotter): The snapshotter that saves them
+            publisher (SnapshotPublisher): The publisher of the snapshot workers read from
+        """
+        self.manager = manager
+        self.users = users
+        self.snapshotter = snapshotter
+        self.publisher = publisher
+        # The latest metrics each worker reported, by the name of its process
+        self.worker_metrics : Dict[str, Dict[str, MetricSnapshot]] = dict()
+        self.metrics_lock = threading.Lock()
+
+    def serve(self, listener : Listener):
+        """Accepts connections from workers forever, serving each on its own thread
+
+        Args:
+            listener (Listener): The listener workers connect to
+        """
+        while True:
+            connection = listener.accept()
+            threading.Thread(target=self.handle, args=(connection,), name="writer-connection", daemon=True).start()
+
+    def handle(self, connection : Connection):
+        """Serves calls from one connection until it closes. Each call is a (method, args)
+        tuple, answered by ('ok', result) or ('error', exception name, message)
+
+        Args:
+            connection (Connection): The connection
+        """
+        with connection:
+            while True:
+                try:
+                    method, args = connection.recv()
+                except EOFError:
+                    return
+                try:
+                    if method not in self.METHODS:
+                        raise ValueError(f"{method} cannot be called remotely")
+                    reply = ('ok', getattr(self, method)(*args))
+                except Exception as exception:
+                    if type(exception).__name__ not in REMOTE_EXCEPTIONS:
+                        traceback.print_exc()
+                    reply = ('error', type(exception).__name__, str(exception))
+                connection.send(reply)
+
+    def add_review(self, restaurant : str, review : Review) -> bytes | None:
+        """Adds a review to a restaurant, and has the change published
+
+        Args:
+            restaurant (str): The restaurant to add the review to
+            review (Review): The review to add
+
+        Returns:
+            bytes | None: The new database for the restaurant, as JSON in RestaurantDatabase
+            dictionary format, or None if the restaurant does not exist
+        """
+        restaurant_data = self.manager.add_review(restaurant, review)
+        if not restaurant_data:
+            return None
+        self.publisher.notify()
+        return json.dumps(restaurant_data.to_dict(), cls=JSONEncoder).encode('utf-8')
+
+    def add_reviews(self, reviews : List[Tuple[str, Review]]) -> List[bool]:
+        """Adds many reviews at once, and has the changes published
+
+        Args:
+            reviews (List[Tuple[str, Review]]): The restaurant to add each review to, with the review
+
+        Returns:
+            List[bool]: For each review, True iff it was added
+        """
+        added = self.manager.add_reviews(reviews)
+        if any(added):
+            self.publisher.notify()
+        return added
+
+    def get_top_restaurants(self, category : ReviewCategory, k : int, min_reviews : int) -> List[Dict[str, str | float | int]]:
+        """See DatabaseManager.get_top_restaurants"""
+        return self.manager.get_top_restaurants(category, k, min_reviews)
+
+    def get_nearby_restaurants(self, latitude : float, longitude : float, k : int, radius : float | None,
+                               categories : Tuple[ReviewCategory, ...], min_rating : float | None) -> List[Dict]:
+        """See DatabaseManager.get_nearby_restaurants"""
+        return self.manager.get_nearby_restaurants(latitude, longitude, k, radius, categories, min_rating)
+
+    def search_reviews(self, query : str, restaurant : str | None, categories : Tuple[ReviewCategory, ...],
+                       offset : int, limit : int) -> Dict | None:
+        """See DatabaseManager.search_reviews"""
+        return self.manager.search_reviews(query, restaurant, categories, offset, limit)
+
+    def add_user(self, user : User) -> bool:
+        """See Users.add_user"""
+        return self.users.add_user(user)
+
+    def login(self, user : User) -> str | None:
+        """See Users.login"""
+        return self.users.login(user)
+
+    def logout(self, token : str) -> bool:
+        """See Users.logout"""
+        return self.users.logout(token)
+
+    def validate_user(self, token : str) -> User | None:
+        """See Users.validate_user"""
+        return self.users.validate_user(token)
+
+    def contains_name(self, name : str) -> bool:
+        """See Users.contains_name"""
+        return self.users.contains_name(name)
+
+    def auth_stats(self) -> Dict[str, Dict[str, int | float]]:
+        """See Users.auth_stats"""
+        return self.users.auth_stats()
+
+    def session_stats(self) -> Dict[str, int | float]:
+        """See Users.session_stats"""
+        return self.users.session_stats()
+
+    def snapshot_stats(self) -> Dict[str, int | float]:
+        """See Snapshotter.stats"""
+        return self.snapshotter.stats()
+
+    def publisher_stats(self) -> Dict[str, int | float]:
+        """See SnapshotPublisher.stats"""
+        return self.publisher.stats()
+
+    def report_metrics(self, worker : str, snapshot : Dict[str, MetricSnapshot]):
+        """Keeps the latest metrics of a worker, to be merged into what the writer renders
+
+        Args:
+            worker (str): The name of the worker process
+            snapshot (Dict[str, MetricSnapshot]): Its metrics (see Registry.snapshot)
+        """
+        with self.metrics_lock:
+            self.worker_metrics[worker] = snapshot
+
+    def metrics(self, worker : str, snapshot : Dict[str, MetricSnapshot]) -> str:
+        """Renders the metrics of every process, with the latest metrics of the worker asking
+
+        Args:
+            worker (str): The name of the worker process
+            snapshot (Dict[str, MetricSnapshot]): Its metrics (see Registry.snapshot)
+
+        Returns:
+            str: The metrics of the writer and every worker, added up, in the Prometheus text format
+        """
+        self.report_metrics(worker, snapshot)
+        with self.metrics_lock:
+            snapshots = list(self.worker_metrics.values())
+        return Registry.render(Registry.merge(REGISTRY.snapshot(), *snapshots))
+
+class WriterClient:
+    """A WriterClient calls a WriterService in the writer process. It keeps a pool of idle
+    connections, so concurrent calls don't wait on each other, and connections are reused
+    across requests (which are each handled on their own thread)
+    """
+
+    def __init__(self, address : str, authkey : bytes):
+        """Creates a WriterClient. Connections are opened as they are needed
+
+        Args:
+            address (str): The address of the writer's listener
+            authkey (bytes): The key the listener authenticates connections with
+        """
+        self.address = address
+        self.authkey = authkey
+        self.idle : List[Connection] = []
+        self.lock = threading.Lock()
+
+    @timed("writer.call")
+    def call(self, method : str, *args : Any) -> Any:
+        """Calls a method of the WriterService, and waits for its result
+
+        Args:
+            method (str): The name of the method
+            args (Any): Its arguments, which must be picklable
+
+        Raises:
+            ValueError, PoolSaturated: If the method raised them
+            RuntimeError: If the method raised anything else
+
+        Returns:
+            Any: What the method returned
+        """
+        with self.lock:
+            connection = self.idle.pop() if self.idle else None
+        if connection is None:
+            connection = Client(self.address, authkey=self.authkey)
+        try:
+            connection.send((method, args))
+            reply = connection.recv()
+        except BaseException:
+            connection.close()
+            raise
+        with self.lock:
+            self.idle.append(connection)
+        if reply[0] == 'ok':
+            return reply[1]
+        _, name, message = reply
+        raise REMOTE_EXCEPTIONS.get(name, RuntimeError)(message)
+
+class RemoteUsers:
+    """RemoteUsers stands in for Users in a worker process, forwarding everything to the writer
+    """
+
+    def __init__(self, client : WriterClient):
+        """Creates a RemoteUsers
+
+        Args:
+            client (WriterClient): The client of the writer
+        """
+        self.client = client
+
+    def add_user(self, user : User) -> bool:
+        """See Users.add_user"""
+        return self.client.call('add_user', user)
+
+    def login(self, user : User) -> str | None:
+        """See Users.login"""
+        return self.client.call('login', user)
+
+    def logout(self, token : str) -> bool:
+        """See Users.logout"""
+        return self.client.call('logout', token)
+
+    def validate_user(self, token : str) -> User | None:
+        """See Users.validate_user"""
+        return self.client.call('validate_user', token)
+
+    def contains_name(self, name : str) -> bool:
+        """See Users.contains_name"""
+        return self.client.call('contains_name', name)
+
+    def auth_stats(self) -> Dict[str, Dict[str, int | float]]:
+        """See Users.auth_stats"""
+        return self.client.call('auth_stats')
+
+    def session_stats(self) -> Dict[str, int | float]:
+        """See Users.session_stats"""
+        return self.client.call('session_stats')
+
+class RemoteSnapshotter:
+    """RemoteSnapshotter stands in for the Snapshotter in a worker process
+    """
+
+    def __init__(self, client : WriterClient):
+        """Creates a RemoteSnapshotter
+
+        Args:
+            client (WriterClient): The client of the writer
+        """
+        self.client = client
+
+    def stats(self) -> Dict[str, int | float]:
+        """See Snapshotter.stats"""
+        return self.client.call('snapshot_stats')
+
+class SnapshotManager:
+    """A SnapshotManager stands in for the DatabaseManager in a worker process. It serves reads
+    from the latest shared snapshot, decoding restaurants as they are read (and keeping the most
+    recently read ones decoded, along with their cached webpage encodings, for as long as they
+    don't change). Reviews are forwarded to the writer.
+
+    Searches use indexes of the names in the snapshot, which are updated with the difference
+    whenever a generation adds or removes restaurants
+    """
+
+    def __init__(self, reader : SnapshotReader, client : WriterClient, max_resident : int = DEFAULT_MAX_RESIDENT):
+        """Creates a SnapshotManager
+
+        Args:
+            reader (SnapshotReader): The reader of the shared snapshot
+            client (WriterClient): The client of the writer
+            max_resident (int, optional): The most decoded restaurants to keep. Defaults to DEFAULT_MAX_RESIDENT.
+        """
+        self.reader = reader
+        self.client = client
+        self.decoded = LRUCache(max_resident)
+        self.catalog = RWLock()
+        self.refreshing = threading.Lock()
+        snapshot = reader.current()
+        self.catalog_stamp = snapshot.catalog
+        self.names : List[str] = snapshot.names
+        self.search_index = TrigramIndex(*self.names)
+        self.fuzzy_index = FuzzyIndex(*self.names)
+        self.fuzzy_cache = LRUCache(DEFAULT_SEARCH_CACHE_SIZE)
+
+    def refresh(self):
+        """Brings the search indexes up to date with the latest generation, if it added or
+        removed restaurants
+        """
+        snapshot = self.reader.current()
+        if snapshot.catalog == self.catalog_stamp:
+            return
+        with self.refreshing:
+            snapshot = self.reader.current()
+            if snapshot.catalog == self.catalog_stamp:
+                return
+            old, new = set(self.names), set(snapshot.names)
+            with self.catalog.writing():
+                for restaurant in self.names:
+                    if restaurant not in new:
+                        self.search_index.remove(restaurant)
+                        self.fuzzy_index.remove(restaurant)
+                for restaurant in snapshot.names:
+                    if restaurant not in old:
+                        self.search_index.add(restaurant)
+                        self.fuzzy_index.add(restaurant)
+                self.fuzzy_cache.clear()
+                self.names = snapshot.names
+                self.catalog_stamp = snapshot.catalog
+
+    def restaurant_etag(self, restaurant : str) -> str | None:
+        """Gets a tag that changes whenever a restaurant does, from its stamp in the latest generation
+
+        Args:
+            restaurant (str): The restaurant
+
+        Returns:
+            str | None: The tag, or None if the restaurant does not exist
+        """
+        snapshot = self.reader.current()
+        entry = snapshot.index.get(restaurant)
+        return f"{snapshot.epoch}.s{entry[0]}" if entry else None
+
+    def catalog_etag(self) -> str:
+        """Gets a tag that changes whenever a generation adds or removes restaurants
+
+        Returns:
+            str: The tag
+        """
+        snapshot = self.reader.current()
+        return f"{snapshot.epoch}.c{snapshot.catalog}"
+
+    def contains_restaurant(self, restaurant : str) -> bool:
+        """See DatabaseManager.contains_restaurant"""
+        return restaurant in self.reader.current().index
+
+    def get_restaurant(self, restaurant : str) -> RestaurantDatabase | None:
+        """Gets the database for a restaurant in the latest generation, if it exists
+
+        Args:
+            restaurant (str): The restaurant to obtain the database for
+
+        Returns:
+            RestaurantDatabase | None: The database for the restaurant, or None if the restaurant does not exist
+        """
+        snapshot = self.reader.current()
+        if restaurant not in snapshot.index:
+            return None
+        key = (restaurant, snapshot.index[restaurant][0])
+        restaurant_data = self.decoded.get(key)
+        if restaurant_data is None:
+            restaurant_data = RestaurantDatabase.from_dict(json.loads(snapshot.fragment(restaurant)))
+            self.decoded.put(key, restaurant_data)
+        return restaurant_data
+
+    @timed("manager.search")
+    def get_restaurant_list(self, query : str = "", prefix : bool = False, ignore_case : bool = False,
+                            limit : int | None = None, offset : int = 0) -> List[str]:
+        """See DatabaseManager.get_restaurant_list"""
+        self.refresh()
+        with self.catalog.reading():
+            if not query and limit is None and not offset:
+                return list(self.names)
+            return self.search_index.search(query, prefix=prefix, ignore_case=ignore_case, limit=limit, offset=offset)
+
+    @timed("manager.fuzzy_search")
+    def get_ranked_restaurant_list(self, query : str, max_distance : int | None = None,
+                                   limit : int = DEFAULT_FUZZY_LIMIT) -> List[str]:
+        """See DatabaseManager.get_ranked_restaurant_list"""
+        self.refresh()
+        key = (query, max_distance, limit)
+        results = self.fuzzy_cache.get(key)
+        if results is None:
+            with self.catalog.reading():
+                results = self.fuzzy_index.search(query, max_distance=max_distance, limit=limit)
+                self.fuzzy_cache.put(key, results)
+        return list(results)
+
+    @timed("manager.ratings_statistics")
+    def get_ratings_statistics(self, restaurant : str | None = None,
+                               percentiles : Tuple[int, ...] = DEFAULT_PERCENTILES) -> Dict[ReviewCategory, Dict] | None:
+        """See DatabaseManager.get_ratings_statistics"""
+        if restaurant is None:
+            snapshot = self.reader.current()
+            restaurants = [self.get_restaurant(name) for name in snapshot.names]
+            return summarize_all([restaurant_data.get_rating_columns() for restaurant_data in restaurants if restaurant_data], percentiles)
+        restaurant_data = self.get_restaurant(restaurant)
+        if not restaurant_data:
+            return None
+        return restaurant_data.get_ratings_statistics(percentiles)
+
+    def get_top_restaurants(self, category : ReviewCategory, k : int, min_reviews : int = 1) -> List[Dict[str, str | float | int]]:
+        """Gets the restaurants with the highest mean rating in a category, from the leaderboards
+        the writer keeps (see DatabaseManager.get_top_restaurants). They can be newer than the
+        latest generation of the snapshot
+        """
+        return self.client.call('get_top_restaurants', category, k, min_reviews)
+
+    def get_nearby_restaurants(self, latitude : float, longitude : float, k : int, radius : float | None = None,
+                               categories : Tuple[ReviewCategory, ...] = (), min_rating : float | None = None) -> List[Dict]:
+        """Gets the restaurants closest to a location, from the spatial index the writer keeps
+        (see DatabaseManager.get_nearby_restaurants)
+        """
+        return self.client.call('get_nearby_restaurants', latitude, longitude, k, radius, categories, min_rating)
+
+    def search_reviews(self, query : str, restaurant : str | None = None, categories : Tuple[ReviewCategory, ...] = (),
+                       offset : int = 0, limit : int = DEFAULT_REVIEW_SEARCH_LIMIT) -> Dict | None:
+        """Searches the text of reviews, with the text indexes the writer keeps
+        (see DatabaseManager.search_reviews)
+        """
+        return self.client.call('search_reviews', query, restaurant, categories, offset, limit)
+
+    def add_review(self, restaurant : str, review : Review) -> RestaurantDatabase | None:
+        """Adds a review to a restaurant, through the writer
+
+        Args:
+            restaurant (str): The restaurant to add the review to
+            review (Review): The review to add
+
+        Returns:
+            RestaurantDatabase | None: The database for the restaurant, or None if the restaurant does not exist
+        """
+        encoded = self.client.call('add_review', restaurant, review)
+        return RestaurantDatabase.from_dict(json.loads(encoded)) if encoded else None
+
+    def add_reviews(self, reviews : List[Tuple[str, Review]]) -> List[bool]:
+        """See DatabaseManager.add_reviews"""
+        return self.client.call('add_reviews', reviews)
+
+    def storage_stats(self) -> Dict[str, int | float | str]:
+        """Gets statistics about the snapshot this reads from
+
+        Returns:
+            Dict[str, int | float | str]: The kind of storage, the generation being read, the number
+            of restaurants in it, and the number of decoded restaurants with their hits and misses,
+            along with the statistics of the publisher in the writer
+        """
+        snapshot = self.reader.current()
+        return {'storage' : 'snapshot', 'generation' : snapshot.generation, 'restaurants' : len(snapshot.names),
+                'resident' : len(self.decoded), 'capacity' : self.decoded.capacity, 'hits' : self.decoded.hits,
+                'misses' : self.decoded.misses, 'hit_rate' : self.decoded.hit_rate(),
+                'publisher' : self.client.call('publisher_stats')}
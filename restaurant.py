@@ -1,14 +1,25 @@
 
-from typing import Dict, List
+import json
 
+from typing import Dict, FrozenSet, List, Sequence, Tuple
+
+from .columnar import DEFAULT_PERCENTILES
 from .reviews import Reviews, Review
+from .text_index import TextQuery
+from ..common.compression import gzip_compress
+from ..common.json import JSONEncoder
+from ..common.locks import RWLock
 from ..common.review_categories import ReviewCategory
+
+# The sections of the webpage format, in order
+WEBPAGE_FIELDS = ('summary', 'accessibility_summary', 'restaurant_info', 'review_summary', 'reviews')
     
 class RestaurantInfo:
     """Restaurant Info is a class that represents the
     basic information of a restaurant
     """
-    def __init__(self, summary : str, hours : str, address : str, phone : str):
+    def __init__(self, summary : str, hours : str, address : str, phone : str,
+                 latitude : float | None = None, longitude : float | None = None):
         """Creates a RestaurantInfo class based on its basic information
 
         Args:
@@ -16,11 +27,33 @@ class RestaurantInfo:
             hours (str): The hours it is open
             address (str): The address of the restaurant
             phone (str): The phone number for the restaurant
+            latitude (float | None, optional): The latitude of the restaurant, in degrees. Defaults to None.
+            longitude (float | None, optional): The longitude of the restaurant, in degrees. Defaults to None.
+
+        Raises:
+            ValueError: If only one of latitude and longitude is given, or either is out of range
         """
+        if (latitude is None) != (longitude is None):
+            raise ValueError("A restaurant needs both a latitude and a longitude, or neither")
+        if latitude is not None:
+            latitude, longitude = float(latitude), float(longitude)
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                raise ValueError(f"({latitude}, {longitude}) is not a valid latitude and longitude")
         self.summary = summary
         self.hours = hours
         self.address = address
         self.phone = phone
+        self.latitude = latitude
+        self.longitude = longitude
+
+    @property
+    def location(self) -> Tuple[float, float] | None:
+        """The location of the restaurant
+
+        Returns:
+            Tuple[float, float] | None: Its latitude and longitude, or None if it has no location
+        """
+        return None if self.latitude is None else (self.latitude, self.longitude)
     
     @staticmethod
     def from_dict(data : Dict[str, str]):
@@ -33,16 +66,36 @@ class RestaurantInfo:
                 summary : The summary,
                 hours : The hours it is open,
                 address : The address of the restaurant,
-                phone : The restaurant's phone number
+                phone : The restaurant's phone number,
+                latitude (optional) : Its latitude,
+                longitude (optional) : Its longitude
 
         Returns:
             RestaurantInfo: A RestaurantInfo object that corresponds to data
         """
-        return RestaurantInfo(data['summary'], data['hours'], data['address'], data['phone'])
+        return RestaurantInfo(data['summary'], data['hours'], data['address'], data['phone'],
+                              data.get('latitude'), data.get('longitude'))
+
+    def to_dict(self) -> Dict[str, str | float]:
+        """Converts this into its dictionary form, which is the inverse of from_dict.
+        The latitude and longitude are left out if this has no location
+
+        Returns:
+            Dict[str, str | float]: The dictionary form of this
+        """
+        data = {'summary' : self.summary, 'hours' : self.hours, 'address' : self.address, 'phone' : self.phone}
+        if self.latitude is not None:
+            data['latitude'] = self.latitude
+            data['longitude'] = self.longitude
+        return data
 
 class RestaurantDatabase:
     """RestaurantDatabase is a database that represents all the accessibility information and other
-    information that pertains to a single restaurant
+    information that pertains to a single restaurant.
+
+    It is safe to use from multiple threads: its lock is held as the writer while a review is added,
+    and as a reader while anything reads its reviews, so reads never block each other. Read its
+    reviews through its methods rather than through reviews directly
     """
     def __init__(self, restaurant_info : RestaurantInfo, reviews : Reviews):
         """Constructs a RestaurantDatabase from its review information and other information
@@ -53,6 +106,13 @@ class RestaurantDatabase:
         """
         self.restaurant_info = restaurant_info
         self.reviews = reviews
+        
+        # The version goes up every time this changes. The webpage cache holds the encoded
+        # webpage format for each set of filters and fields that was requested, with the version
+        # it encodes, and its gzip compression once that was requested too
+        self.version = 0
+        self.webpage_cache : Dict[Tuple[FrozenSet[ReviewCategory], Tuple[str, ...]], Tuple[int, bytes, bytes | None]] = dict()
+        self.lock = RWLock()
     
     @staticmethod
     def from_dict(data : Dict[str, RestaurantInfo | Reviews]):
@@ -68,6 +128,17 @@ class RestaurantDatabase:
             RestaurantDatabase: A RestaurantDatabase with the data from data
         """
         return RestaurantDatabase(RestaurantInfo.from_dict(data['restaurant_info']), Reviews.from_dict(data['reviews']))
+
+    def to_dict(self) -> Dict[str, Dict]:
+        """Converts this into its dictionary form, which is the inverse of from_dict.
+        The result is detached from this, so it can be serialized on another thread
+        while reviews keep getting added to this
+
+        Returns:
+            Dict[str, Dict]: The dictionary form of this
+        """
+        with self.lock.reading():
+            return {'restaurant_info' : self.restaurant_info.to_dict(), 'reviews' : self.reviews.to_dict()}
     
     def to_webpage_format(self, *filter : ReviewCategory) -> Dict[str, str | List[float] | List[str] | List[Review]]:
         """Prepares this to be displayed in website format by returning a
@@ -83,30 +154,187 @@ class RestaurantDatabase:
                 reviews (List[Review]): The reviews for this restaurant. Look into the Review data structure to
                 figure out the form of the JSON
         """
+        with self.lock.reading():
+            return self.make_webpage_format(*filter)
+
+    def make_webpage_format(self, *filter : ReviewCategory, fields : Tuple[str, ...] = WEBPAGE_FIELDS) -> Dict[str, str | List[float] | List[str] | List[Review]]:
+        """Makes the webpage format of this (see to_webpage_format). The lock must be held
+
+        Arguments:
+            filter (ReviewCategory, varargs): The filter(s) to apply to the reviews
+            fields (Tuple[str, ...], optional): The sections to make, out of WEBPAGE_FIELDS.
+                                                Sections that aren't asked for are never computed.
+                                                Defaults to WEBPAGE_FIELDS.
+
+        Returns:
+            Dict[str, str | List[float] | List[str] | Reviews]: The webpage format
+        """
         result = dict()
         
         # Make the summary section
-        result['summary'] = self.restaurant_info.summary
+        if 'summary' in fields:
+            result['summary'] = self.restaurant_info.summary
         
         # Make the accessibility summary section
-        result['accessibility_summary'] = self.reviews.get_ratings_summary()
+        if 'accessibility_summary' in fields:
+            result['accessibility_summary'] = self.reviews.get_ratings_summary()
         
         # Make the restaurant info section
-        result['restaurant_info'] = self.restaurant_info
-        del result['restaurant_info'].summary
+        if 'restaurant_info' in fields:
+            result['restaurant_info'] = self.restaurant_info.to_dict()
+            del result['restaurant_info']['summary']
     
         # Make the review summary section
-        result['review_summary'] = self.reviews.get_summary()
+        if 'review_summary' in fields:
+            result['review_summary'] = self.reviews.get_summary()
         
         # Make the reviews section
-        result['reviews'] = self.reviews.filter(*filter)
+        if 'reviews' in fields:
+            result['reviews'] = self.reviews.filter(*filter)
         
         return result
 
+    def to_webpage_json(self, *filter : ReviewCategory, fields : Tuple[str, ...] = WEBPAGE_FIELDS) -> bytes:
+        """Encodes the webpage format of this as JSON. The encoding is cached until
+        this changes, so repeated requests for the same filters and fields are a lookup
+
+        Arguments:
+            filter (ReviewCategory, varargs): The filter(s) to apply to the reviews
+            fields (Tuple[str, ...], optional): The sections to encode, in the order of WEBPAGE_FIELDS.
+                                                Defaults to WEBPAGE_FIELDS.
+
+        Returns:
+            bytes: The JSON encoding of to_webpage_format(*filter), with only the fields given
+        """
+        key = (frozenset(filter), fields)
+        cached = self.webpage_cache.get(key)
+        if cached and cached[0] == self.version:
+            return cached[1]
+        
+        with self.lock.reading():
+            version = self.version
+            encoded = json.dumps(self.make_webpage_format(*filter, fields=fields), cls=JSONEncoder).encode('utf-8')
+            self.webpage_cache[key] = (version, encoded, None)
+        return encoded
+
+    def to_webpage_gzip(self, *filter : ReviewCategory, fields : Tuple[str, ...] = WEBPAGE_FIELDS) -> bytes:
+        """Encodes the webpage format of this as gzipped JSON. The compressed bytes are cached
+        next to the uncompressed ones, so each version is only compressed once
+
+        Arguments:
+            filter (ReviewCategory, varargs): The filter(s) to apply to the reviews
+            fields (Tuple[str, ...], optional): The sections to encode, in the order of WEBPAGE_FIELDS.
+                                                Defaults to WEBPAGE_FIELDS.
+
+        Returns:
+            bytes: The gzip compression of to_webpage_json(*filter, fields=fields)
+        """
+        key = (frozenset(filter), fields)
+        cached = self.webpage_cache.get(key)
+        if cached and cached[0] == self.version and cached[2] is not None:
+            return cached[2]
+        
+        encoded = self.to_webpage_json(*filter, fields=fields)
+        compressed = gzip_compress(encoded)
+        # Only attach it to the same encoding, in case this changed in the meantime
+        cached = self.webpage_cache.get(key)
+        if cached and cached[1] is encoded:
+            self.webpage_cache[key] = (cached[0], encoded, compressed)
+        return compressed
+
+    def filter_reviews(self, *filter : ReviewCategory) -> List[Review]:
+        """Filters the reviews of this (see Reviews.filter)
+
+        Arguments:
+            filter (ReviewCategory, varargs): The filter(s) to apply to the reviews
+
+        Returns:
+            List[Review]: The reviews that obey the filter, in the order they were first reviewed
+        """
+        with self.lock.reading():
+            return self.reviews.filter(*filter)
+
+    def get_text_statistics(self, terms : Sequence[str]) -> Tuple[int, int, List[int]]:
+        """Gets the statistics of the text of the reviews of this (see Reviews.get_text_statistics)
+
+        Args:
+            terms (Sequence[str]): The terms of a search
+
+        Returns:
+            Tuple[int, int, List[int]]: The number of reviews, their total length, and the number
+            of them that contain each term
+        """
+        with self.lock.reading():
+            return self.reviews.get_text_statistics(terms)
+
+    def search_reviews(self, query : TextQuery, weights : Sequence[float], average_length : float, k : int,
+                       *filter : ReviewCategory) -> Tuple[int, List[Tuple[float, int, Review]]]:
+        """Finds and ranks the reviews of this that match a full-text search (see Reviews.search)
+
+        Arguments:
+            query (TextQuery): The search
+            weights (Sequence[float]): The inverse document frequency of each term of the search
+            average_length (float): The mean length of every review searched
+            k (int): The most reviews to return
+            filter (ReviewCategory, varargs): The categories a review must have rated to be found
+
+        Returns:
+            Tuple[int, List[Tuple[float, int, Review]]]: The number of reviews found, and the best k
+        """
+        with self.lock.reading():
+            return self.reviews.search(query, weights, average_length, k, *filter)
+
+    def get_ratings_summary(self) -> Dict[ReviewCategory, float]:
+        """Gets the mean rating of each category of this (see Reviews.get_ratings_summary)
+
+        Returns:
+            Dict[ReviewCategory, float]: The mean rating of each category with ratings
+        """
+        with self.lock.reading():
+            return self.reviews.get_ratings_summary()
+
+    def get_ratings_statistics(self, percentiles : Tuple[int, ...] = DEFAULT_PERCENTILES) -> Dict[ReviewCategory, Dict]:
+        """Computes detailed statistics of the ratings of this (see Reviews.get_ratings_statistics)
+
+        Args:
+            percentiles (Tuple[int, ...], optional): The percentiles to compute. Defaults to DEFAULT_PERCENTILES.
+
+        Returns:
+            Dict[ReviewCategory, Dict]: The statistics of each category
+        """
+        with self.lock.reading():
+            return self.reviews.get_ratings_statistics(percentiles)
+
+    def get_rating_columns(self) -> Tuple:
+        """Copies the columns of the ratings of this (see RatingsMatrix.columns), so they
+        can be read after the lock is released
+
+        Returns:
+            Tuple: A copy of the scores and rated arrays
+        """
+        with self.lock.reading():
+            scores, rated = self.reviews.get_columns().columns()
+            return scores.copy(), rated.copy()
+
     def add_review(self, review : Review):
-        """Adds a review to this restaurant
+        """Adds a review to this restaurant, which evicts the cached webpage encodings
 
         Args:
             review (Review): The review to add to this
         """
-        self.reviews.add_review(review)
\ No newline at end of file
+        with self.lock.writing():
+            self.reviews.add_review(review)
+            self.version += 1
+            self.webpage_cache = dict()
+
+    def add_reviews(self, reviews : List[Review]):
+        """Adds many reviews to this at once (see Reviews.add_reviews), so the lock is taken
+        and the cached webpage encodings are evicted once for all of them
+
+        Args:
+            reviews (List[Review]): The reviews to add to this, in order
+        """
+        with self.lock.writing():
+            self.reviews.add_reviews(reviews)
+            self.version += 1
+            self.webpage_cache = dict()
\ No newline at end of file
@@ -13,8 +13,23 @@ class ReviewCategory(str, Enum):
     def __str__(self) -> str:
         return self.name
 
+# Every category in declaration order, the ordinal of each, and each category by its lowercase name
+CATEGORIES = tuple(ReviewCategory)
+CATEGORY_INDEX = {category : i for i, category in enumerate(CATEGORIES)}
+CATEGORY_LOOKUP = {category.name.lower() : category for category in CATEGORIES}
+
 def resolve_category(category : str) -> ReviewCategory | None:
-    for value in ReviewCategory:
-        if category.lower() == value.name.lower():
-            return value
-    return None
\ No newline at end of file
+    """Finds the category a name or label refers to, ignoring case. Labels may use spaces
+    or hyphens instead of underscores (e.g. "Waiting Area" is WAITING_AREA)
+
+    Args:
+        category (str): The name or label
+
+    Returns:
+        ReviewCategory | None: The category, or None if there is no such category
+    """
+    category = category.lower()
+    resolved = CATEGORY_LOOKUP.get(category)
+    if resolved is None:
+        resolved = CATEGORY_LOOKUP.get(category.replace(" ", "_").replace("-", "_"))
+    return resolved
\ No newline at end of file
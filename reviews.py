@@ -1,21 +1,64 @@
-from ..common.review_categories import ReviewCategory, resolve_category
+import heapq
+import sys
+import threading
 
-from typing import Dict, List
+from ..common.constants import MIN_RATING, MAX_RATING, NO_RATING, UNRATED
+from ..common.metrics import timed
+from ..common.review_categories import ReviewCategory, CATEGORIES, CATEGORY_INDEX, resolve_category
+from .columnar import RatingsMatrix, DEFAULT_PERCENTILES
+from .text_index import TextIndex, TextQuery, bm25, tokenize, contains_phrase
+
+from typing import Any, Dict, List, Sequence, Set, Tuple
+
+UNRATED_SCORES = bytes([UNRATED]) * len(CATEGORIES)
+# The attributes of Reviews that are only made once they are first used, when it was loaded
+# from a binary snapshot, and the lock that makes them
+LAZY_ATTRIBUTES = frozenset(('reviews', 'order', 'tagged'))
+MATERIALIZING = threading.Lock()
 
 class Review:
-    """Review represents a single review on a given restaurant
+    """Review represents a single review on a given restaurant. Reviews are
+    never modified once created, and are kept compact since there are a lot of them:
+    they have no __dict__, and their ratings are packed into one byte per category
     """
+    __slots__ = ('user', 'scores', 'review')
+    
     def __init__(self, user : str, ratings : Dict[str, int], review : str):
         """Creates a Review from information about the review
 
         Args:
             user (str): The name of the user who made the review
-            ratings (Dict[str, int]): The ratings given for this review
+            ratings (Dict[str, int]): The ratings given for this review. Ratings
+            of NO_RATING, and categories that don't exist, are left out
             review (str): The written review
+
+        Raises:
+            ValueError: If a rating isn't an integer from MIN_RATING to MAX_RATING, or review isn't a string
         """
-        self.user = user
-        self.ratings = {resolve_category(category) : ratings[category] for category in ratings if resolve_category(category) and not ratings[category] == -1}
+        if not isinstance(review, str):
+            raise ValueError(f"Review must be a string, not {type(review).__name__}")
+        scores = bytearray(UNRATED_SCORES)
+        for category in ratings:
+            resolved = resolve_category(category)
+            rating = ratings[category]
+            if not resolved or rating == NO_RATING:
+                continue
+            # bool is an int too, but true isn't a rating
+            if type(rating) is not int or not MIN_RATING <= rating <= MAX_RATING:
+                raise ValueError(f"Rating for {resolved} must be from {MIN_RATING} to {MAX_RATING}, not {rating}")
+            scores[CATEGORY_INDEX[resolved]] = rating
+        self.user = sys.intern(user)
+        self.scores = bytes(scores)
         self.review = review
+
+    @property
+    def ratings(self) -> Dict[ReviewCategory, int]:
+        """The ratings given for this review, in category order
+
+        Returns:
+            Dict[ReviewCategory, int]: The rating of each category that was rated
+        """
+        return {category : score for category, score in zip(CATEGORIES, self.scores) if score != UNRATED}
         
     @staticmethod
     def from_dict(data : Dict[str, str | int]):
@@ -31,6 +74,33 @@ class Review:
             Review: The review associated with the data from this dictionary
         """
         return Review(data['user'], data['ratings'], data['review'])
+
+    @staticmethod
+    def from_packed(user : str, scores : bytes, review : str):
+        """Constructs a Review from its packed form, which is trusted to be valid
+        (e.g. as it was read from a binary snapshot)
+
+        Args:
+            user (str): The name of the user, interned
+            scores (bytes): The packed score of each category
+            review (str): The written review
+
+        Returns:
+            Review: The review
+        """
+        packed = Review.__new__(Review)
+        packed.user = user
+        packed.scores = scores
+        packed.review = review
+        return packed
+
+    def to_dict(self) -> Dict[str, str | Dict[ReviewCategory, int]]:
+        """Converts this into its dictionary form, which is the inverse of from_dict
+
+        Returns:
+            Dict[str, str | Dict[ReviewCategory, int]]: The dictionary form of this
+        """
+        return {'user' : self.user, 'ratings' : self.ratings, 'review' : self.review}
     
     def contains_tag(self, *category : ReviewCategory) -> bool:
         """Evaluates if this contains the tags given
@@ -44,9 +114,7 @@ class Review:
             (i.e. If the review gives ratings for each of the categories)
             given. Returns true if category is not provided
         """
-        if not category:
-            return True
-        return all(c in self.ratings for c in category)
+        return all(self.scores[CATEGORY_INDEX[c]] != UNRATED for c in category)
 
 class Reviews:
     """Reviews represents a collection of Review objects for a given restaurant
@@ -59,16 +127,53 @@ class Reviews:
             all reviews to initialize into this, where the key is the name of the reviewer,
             and the value is the dictionary representation of a Review object
         """
-        self.reviews = {name : Review.from_dict(reviews[name]) for name in reviews}
+        self.reviews = {sys.intern(name) : Review.from_dict(reviews[name]) for name in reviews}
+        self.packed = None
         self.ratings_sum = dict()
         self.ratings_count = dict()
+        # The reviewers who rated each category, and the position of each reviewer in reviews
+        self.tagged : Dict[ReviewCategory, Set[str]] = dict()
+        self.order : Dict[str, int] = {name : i for i, name in enumerate(self.reviews)}
+        # The columnar backend is optional, and only built once statistics are asked for.
+        # Likewise, the text index is only built once the text is searched
+        self.columns : RatingsMatrix | None = None
+        self.text_index : TextIndex | None = None
         for category in ReviewCategory:
             self.ratings_sum[category] = 0
             self.ratings_count[category] = 0
+            self.tagged[category] = set()
         for name in self.reviews:
-            for category in self.reviews[name].ratings:
-                self.ratings_sum[category] += self.reviews[name].ratings[category]
-                self.ratings_count[category] += 1
+            for category, score in zip(CATEGORIES, self.reviews[name].scores):
+                if score != UNRATED:
+                    self.ratings_sum[category] += score
+                    self.ratings_count[category] += 1
+                    self.tagged[category].add(name)
+
+    def __len__(self) -> int:
+        packed = self.__dict__.get('packed')
+        return packed.count if packed is not None else len(self.reviews)
+
+    def __getattr__(self, name : str) -> Any:
+        """Materializes the reviews of a Reviews that was loaded from a binary snapshot, the first
+        time they are used. This is only called for attributes that aren't set
+
+        Args:
+            name (str): The attribute
+
+        Returns:
+            Any: The attribute
+
+        Raises:
+            AttributeError: If the attribute isn't one that is materialized
+        """
+        if name not in LAZY_ATTRIBUTES:
+            raise AttributeError(name)
+        with MATERIALIZING:
+            packed = self.__dict__.get('packed')
+            if packed is not None:
+                self.reviews, self.order, self.tagged = packed.materialize()
+                self.packed = None
+        return object.__getattribute__(self, name)
 
     @staticmethod
     def from_dict(data : Dict[str, Dict[str, str | int]]):
@@ -83,6 +188,52 @@ class Reviews:
         """
         return Reviews(data['reviews'])
 
+    @staticmethod
+    def from_packed(packed):
+        """Constructs a Reviews object from the packed reviews of a binary snapshot. Only the
+        aggregates are read now, and the reviews themselves are materialized the first time
+        they are used
+
+        Args:
+            packed (PackedReviews): The packed reviews
+
+        Returns:
+            Reviews: A Reviews object based off of packed
+        """
+        reviews = Reviews.__new__(Reviews)
+        reviews.packed = packed
+        reviews.ratings_sum = dict(zip(CATEGORIES, packed.sums))
+        reviews.ratings_count = dict(zip(CATEGORIES, packed.counts))
+        reviews.columns = None
+        reviews.text_index = None
+        return reviews
+
+    def repack(self, packed) -> bool:
+        """Points a Reviews that hasn't been materialized yet at the same reviews in another
+        binary snapshot, so the old one can be unmapped
+
+        Args:
+            packed (PackedReviews): The packed reviews in the other snapshot
+
+        Returns:
+            bool: True iff this was still packed
+        """
+        with MATERIALIZING:
+            if self.__dict__.get('packed') is None:
+                return False
+            self.packed = packed
+            return True
+
+    def to_dict(self) -> Dict[str, Dict]:
+        """Converts this into its dictionary form, which is the inverse of from_dict.
+        Reviews themselves are never modified once added, so they are shared rather
+        than copied
+
+        Returns:
+            Dict[str, Dict]: The dictionary form of this
+        """
+        return {'reviews' : dict(self.reviews), 'ratings_sum' : dict(self.ratings_sum), 'ratings_count' : dict(self.ratings_count)}
+
     def get_ratings_summary(self) -> Dict[ReviewCategory, float]:
         """Provides a ratings summary of the reviews in this
 
@@ -92,6 +243,92 @@ class Reviews:
         """
         return {category : self.ratings_sum[category] / self.ratings_count[category] for category in ReviewCategory if self.ratings_count[category]}
 
+    @timed("reviews.ratings_statistics")
+    def get_ratings_statistics(self, percentiles : Tuple[int, ...] = DEFAULT_PERCENTILES) -> Dict[ReviewCategory, Dict]:
+        """Provides detailed statistics of the ratings of the reviews in this, from
+        the columnar backend (which is built on the first call, and requires numpy)
+
+        Args:
+            percentiles (Tuple[int, ...], optional): The percentiles to compute. Defaults to DEFAULT_PERCENTILES.
+
+        Returns:
+            Dict[ReviewCategory, Dict]: The count, mean, median, standard deviation,
+            percentiles and histogram of each category (see columnar.summarize)
+        """
+        return self.get_columns().statistics(percentiles)
+
+    def get_columns(self) -> RatingsMatrix:
+        """Gets the columnar backend of this, building it if it doesn't exist yet.
+        Once built, add_review keeps it up to date
+
+        Returns:
+            RatingsMatrix: The ratings of this, as columns
+        """
+        if self.columns is None:
+            self.columns = RatingsMatrix.from_reviews(list(self.reviews.values()))
+        return self.columns
+
+    def get_text_index(self) -> TextIndex:
+        """Gets the index of the text of the reviews of this, building it if it doesn't exist yet.
+        Once built, add_review keeps it up to date
+
+        Returns:
+            TextIndex: The index
+        """
+        if self.text_index is None:
+            # Reviews are in the order of their positions
+            self.text_index = TextIndex.build((self.order[user], user, review.review) for user, review in self.reviews.items())
+        return self.text_index
+
+    def get_text_statistics(self, terms : Sequence[str]) -> Tuple[int, int, List[int]]:
+        """Gets what BM25 needs to know about the reviews in this to weigh the terms of a search
+        (see TextIndex.statistics)
+
+        Args:
+            terms (Sequence[str]): The terms
+
+        Returns:
+            Tuple[int, int, List[int]]: The number of reviews, their total length, and the number
+            of them that contain each term
+        """
+        return self.get_text_index().statistics(terms)
+
+    @timed("reviews.search")
+    def search(self, query : TextQuery, weights : Sequence[float], average_length : float, k : int,
+               *filter : ReviewCategory) -> Tuple[int, List[Tuple[float, int, Review]]]:
+        """Finds the reviews in this that match a full-text search, and ranks them with BM25.
+        Only the best k are returned, so the cost of ranking the rest is only that of scoring them
+
+        Args:
+            query (TextQuery): The search, which must have terms
+            weights (Sequence[float]): The inverse document frequency of each term of the search
+            average_length (float): The mean length of every review searched, in tokens
+            k (int): The most reviews to return
+            filter (ReviewCategory, varargs): The categories a review must have rated to be found
+
+        Returns:
+            Tuple[int, List[Tuple[float, int, Review]]]: The number of reviews found, and the score,
+            position and review of the best k, best first (and first reviewed first, among equals)
+        """
+        index = self.get_text_index()
+        positions = index.candidates(query.terms)
+        wanted = None
+        if positions and (filter or query.phrases):
+            users = index.users
+            if filter:
+                positions = [position for position in positions if self.reviews[users[position]].contains_tag(*filter)]
+            if query.phrases:
+                positions = [position for position in positions
+                             if all(contains_phrase(tokenize(self.reviews[users[position]].review), phrase) for phrase in query.phrases)]
+        if not positions or k <= 0:
+            return len(positions), []
+        if len(query.terms) > 1:
+            wanted = set(positions)
+        frequencies = [index.frequencies(term, positions, wanted) for term in query.terms]
+        scores = bm25(frequencies, list(map(index.lengths.__getitem__, positions)), weights, average_length)
+        best = heapq.nlargest(k, range(len(positions)), key=lambda i: (scores[i], -i))
+        return len(positions), [(scores[i], positions[i], self.reviews[index.users[positions[i]]]) for i in best]
+
     def get_summary(self):
         """Provides a summary of the review
 
@@ -100,16 +337,24 @@ class Reviews:
         """
         return ""
 
+    @timed("reviews.filter")
     def filter(self, *filter : ReviewCategory) -> List[Review]:
-        """Filters the Reviews based on the filter
+        """Filters the Reviews based on the filter. This intersects the sets of reviewers
+        who rated each category, starting from the smallest, so it costs about as much as
+        the smallest set rather than as much as all reviews
         
         Arguments:
             filter (ReviewCategory, varargs): The filter(s) to apply to this
 
         Returns:
-            List[Review]: All Review objects in this that obey the filter
+            List[Review]: All Review objects in this that obey the filter, in the order
+            they were first reviewed
         """
-        return [self.reviews[name] for name in self.reviews if self.reviews[name].contains_tag(*filter)]
+        if not filter:
+            return list(self.reviews.values())
+        tagged = sorted((self.tagged[category] for category in set(filter)), key=len)
+        names = tagged[0].intersection(*tagged[1:])
+        return [self.reviews[name] for name in sorted(names, key=self.order.__getitem__)]
 
     def add_review(self, review : Review):
         """Adds a review to this
@@ -117,11 +362,51 @@ class Reviews:
         Args:
             review (Review): The review to add to this
         """
-        review = review
-        old_review = self.reviews.get(review.user)
-        self.reviews[review.user] = review
-        
-        # Update our ratings_sum and ratings_count
-        for category in ReviewCategory:
-            self.ratings_sum[category] += review.ratings.get(category, 0) - old_review.ratings.get(category, 0) if old_review else 0
-            self.ratings_count[category] += (1 if category in review.ratings else 0) - (1 if category in old_review.ratings else 0) if old_review else 0
\ No newline at end of file
+        self.add_reviews([review])
+
+    @timed("reviews.add_reviews")
+    def add_reviews(self, reviews : List[Review]):
+        """Adds many reviews to this, as if they were added one at a time in order (so a user's
+        last review wins), but with ratings_sum and ratings_count updated once for all of them
+
+        Args:
+            reviews (List[Review]): The reviews to add to this
+        """
+        sums = [0] * len(CATEGORIES)
+        counts = [0] * len(CATEGORIES)
+        # A later review from the same user replaces an earlier one, but keeps its position
+        latest = {review.user : review for review in reviews}
+        if self.text_index is not None:
+            # Indexing is the only part that can fail, so it happens before anything else changes
+            position = len(self.order)
+            for user, review in latest.items():
+                old_review = self.reviews.get(user)
+                if old_review:
+                    self.text_index.remove(self.order[user], old_review.review)
+                    self.text_index.add(self.order[user], user, review.review)
+                else:
+                    self.text_index.add(position, user, review.review)
+                    position += 1
+        for user, review in latest.items():
+            old_review = self.reviews.get(user)
+            self.reviews[user] = review
+            if not old_review:
+                self.order[user] = len(self.order)
+            
+            # Take out the replaced review first
+            if old_review:
+                for i, score in enumerate(old_review.scores):
+                    if score != UNRATED:
+                        sums[i] -= score
+                        counts[i] -= 1
+                        self.tagged[CATEGORIES[i]].discard(user)
+            for i, score in enumerate(review.scores):
+                if score != UNRATED:
+                    sums[i] += score
+                    counts[i] += 1
+                    self.tagged[CATEGORIES[i]].add(user)
+            if self.columns is not None:
+                self.columns.set(review)
+        for category, total, count in zip(CATEGORIES, sums, counts):
+            self.ratings_sum[category] += total
+            self.ratings_count[category] += count
\ No newline at end of file
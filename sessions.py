@@ -0,0 +1,173 @@
+import heapq
+import secrets
+import threading
+import time
+
+from ..common.constants import DEFAULT_SESSION_TTL, TOKEN_BYTES
+
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+# How many more heap entries than twice the number of sessions are allowed before the heap is rebuilt
+COMPACT_SLACK = 64
+
+class Session:
+    """A Session is a user that logged in, and when that login expires
+    """
+    __slots__ = ('user', 'expires')
+
+    def __init__(self, user : Any, expires : float):
+        """Creates a Session
+
+        Args:
+            user (Any): The user that logged in
+            expires (float): When the session expires, on the clock of its Sessions
+        """
+        self.user = user
+        self.expires = expires
+
+class Sessions:
+    """Sessions is a store of login sessions, each identified by a random token. A session
+    expires once it goes unused for ttl seconds, and using it renews it.
+
+    Expiry is tracked by a min-heap of (expiry, token) entries, with one entry per session.
+    Renewing a session only updates the session, not its entry, so entries can be early:
+    sweep re-pushes an early entry with the session's current expiry instead of evicting
+    it. Every entry is pushed and popped at most once per renewal, so sweeping is amortized
+    O(1) per session, while validate and end are O(1). Expired sessions that were not swept
+    yet are never valid
+    """
+
+    def __init__(self, ttl : float = DEFAULT_SESSION_TTL, clock : Callable[[], float] = time.monotonic):
+        """Creates an empty Sessions
+
+        Args:
+            ttl (float, optional): How long, in seconds, a session lasts without being used.
+                                   Defaults to DEFAULT_SESSION_TTL.
+            clock (Callable[[], float], optional): The clock that expiry is measured on.
+                                                   Defaults to time.monotonic.
+        """
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.sessions : Dict[str, Session] = dict()
+        self.tokens : Dict[Any, Set[str]] = dict()
+        self.expiry : List[Tuple[float, str]] = []
+        self.created = 0
+        self.ended = 0
+        self.evicted = 0
+
+    def create(self, user : Any) -> str:
+        """Starts a session for a user, sweeping expired sessions first
+
+        Args:
+            user (Any): The user
+
+        Returns:
+            str: The token of the session, which is TOKEN_BYTES random bytes in hex
+        """
+        token = secrets.token_hex(TOKEN_BYTES)
+        with self.lock:
+            now = self.clock()
+            self.sweep(now)
+            while token in self.sessions:
+                token = secrets.token_hex(TOKEN_BYTES)
+            expires = now + self.ttl
+            self.sessions[token] = Session(user, expires)
+            self.tokens.setdefault(user, set()).add(token)
+            heapq.heappush(self.expiry, (expires, token))
+            self.created += 1
+        return token
+
+    def validate(self, token : str) -> Any | None:
+        """Gets the user of a session, and renews the session
+
+        Args:
+            token (str): The token of the session
+
+        Returns:
+            Any | None: The user, or None if there is no such session or it expired
+        """
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            now = self.clock()
+            if session.expires <= now:
+                self.discard(token)
+                self.evicted += 1
+                return None
+            session.expires = now + self.ttl
+            return session.user
+
+    def end(self, token : str) -> bool:
+        """Ends a session. Its heap entry is left behind, and dropped once it is swept
+        (or once the heap is rebuilt, when left-behind entries outnumber sessions)
+
+        Args:
+            token (str): The token of the session
+
+        Returns:
+            bool: True iff the session existed (and had not expired)
+        """
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return False
+            self.discard(token)
+            if len(self.expiry) > 2 * len(self.sessions) + COMPACT_SLACK:
+                self.expiry = [(session.expires, token) for token, session in self.sessions.items()]
+                heapq.heapify(self.expiry)
+            if session.expires <= self.clock():
+                self.evicted += 1
+                return False
+            self.ended += 1
+            return True
+
+    def discard(self, token : str):
+        """Removes a session. This must be done with the lock held
+
+        Args:
+            token (str): The token of the session, which must exist
+        """
+        user = self.sessions.pop(token).user
+        tokens = self.tokens[user]
+        tokens.discard(token)
+        if not tokens:
+            del self.tokens[user]
+
+    def sweep(self, now : float | None = None) -> int:
+        """Evicts every session that expired. This must be done with the lock held
+
+        Args:
+            now (float | None, optional): The current time on the clock. Defaults to None, to read it.
+
+        Returns:
+            int: The number of sessions evicted
+        """
+        now = self.clock() if now is None else now
+        evicted = 0
+        while self.expiry and self.expiry[0][0] <= now:
+            _, token = heapq.heappop(self.expiry)
+            session = self.sessions.get(token)
+            if session is None:
+                # The session was ended (or evicted when it was validated)
+                continue
+            if session.expires > now:
+                heapq.heappush(self.expiry, (session.expires, token))
+                continue
+            self.discard(token)
+            evicted += 1
+        self.evicted += evicted
+        return evicted
+
+    def stats(self) -> Dict[str, int | float]:
+        """Gets statistics about the sessions
+
+        Returns:
+            Dict[str, int | float]: The number of active sessions (including expired ones that were not
+            swept yet), active users and pending heap entries, how many sessions were ever created, ended
+            by logging out and evicted because they expired, and the ttl
+        """
+        with self.lock:
+            return {'active' : len(self.sessions), 'users' : len(self.tokens), 'heap' : len(self.expiry),
+                    'created' : self.created, 'ended' : self.ended, 'evicted' : self.evicted, 'ttl' : self.ttl}
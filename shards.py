@@ -0,0 +1,294 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from ..common.files import write_atomically
+from ..common.json import JSONEncoder
+from .restaurant import RestaurantDatabase
+from .storage import SnapshotStorage, Storage
+
+from typing import Callable, Dict, Iterable, Iterator, KeysView, List, Tuple
+
+INDEX_FILE = "index.json"
+
+class ShardedStore(SnapshotStorage):
+    """A ShardedStore keeps each restaurant in its own file (shard) within a directory,
+    alongside an index that lists the names of the restaurants in order. A shard has the
+    same format as a single restaurant within the database file, and its file name is
+    derived from the name of its restaurant. It is a snapshot storage
+    """
+    
+    name = "sharded"
+
+    def __init__(self, directory : str):
+        """Opens (or creates) a ShardedStore in a directory
+
+        Args:
+            directory (str): The directory that holds the shards
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, restaurant : str) -> str:
+        """Gets the shard file of a restaurant
+
+        Args:
+            restaurant (str): The name of the restaurant
+
+        Returns:
+            str: The path of its shard
+        """
+        return os.path.join(self.directory, hashlib.sha1(restaurant.encode('utf-8')).hexdigest() + ".json")
+
+    def read_index(self) -> List[str] | None:
+        """Reads the names of the restaurants in this
+
+        Returns:
+            List[str] | None: The names, in order, or None if there is no index yet
+        """
+        index_file = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(index_file):
+            return None
+        with open(index_file, 'r') as file:
+            return json.load(file)
+
+    def write_index(self, restaurants : List[str]) -> int:
+        """Replaces the index of this
+
+        Args:
+            restaurants (List[str]): The names of the restaurants, in order
+
+        Returns:
+            int: The number of bytes written
+        """
+        return write_atomically(os.path.join(self.directory, INDEX_FILE), [json.dumps(restaurants).encode('utf-8')])
+
+    def load(self, restaurant : str) -> RestaurantDatabase:
+        """Loads the database of a restaurant from its shard
+
+        Args:
+            restaurant (str): The name of the restaurant
+
+        Returns:
+            RestaurantDatabase: Its database
+        """
+        with open(self.path(restaurant), 'r') as file:
+            return RestaurantDatabase.from_dict(json.load(file))
+
+    def write(self, restaurant : str, encoded : bytes) -> int:
+        """Replaces the shard of a restaurant
+
+        Args:
+            restaurant (str): The name of the restaurant
+            encoded (bytes): The JSON encoding of its database
+
+        Returns:
+            int: The number of bytes written
+        """
+        return write_atomically(self.path(restaurant), [encoded])
+
+    def delete(self, restaurant : str):
+        """Deletes the shard of a restaurant, if it has one. Only do this once the
+        restaurant is no longer in the index
+
+        Args:
+            restaurant (str): The name of the restaurant
+        """
+        if os.path.exists(self.path(restaurant)):
+            os.remove(self.path(restaurant))
+
+    def import_database(self, database_file : str) -> List[str]:
+        """Splits a database file into shards, and indexes them
+
+        Args:
+            database_file (str): The database file. The format must be:
+                {Restaurant Name : RestaurantDatabase Dictionary Format}
+
+        Returns:
+            List[str]: The names of the restaurants that were imported, in order
+        """
+        with open(database_file, 'r') as file:
+            data = json.load(file)
+        return self.import_restaurants(data.items())
+
+    def import_restaurants(self, restaurants : Iterable[Tuple[str, Dict]]) -> List[str]:
+        """Replaces every restaurant in this, writing each shard as it is given. The index
+        is replaced once every shard is written, and then the shards it no longer lists
+        are deleted
+
+        Args:
+            restaurants (Iterable[Tuple[str, Dict]]): The name of each restaurant, with its
+            database in RestaurantDatabase dictionary format, in order
+
+        Returns:
+            List[str]: The names of the restaurants that were imported, in order
+        """
+        previous = self.read_index() or []
+        names = []
+        for restaurant, data in restaurants:
+            self.write(restaurant, json.dumps(data, cls=JSONEncoder).encode('utf-8'))
+            names.append(restaurant)
+        self.write_index(names)
+        for restaurant in set(previous).difference(names):
+            self.delete(restaurant)
+        return names
+
+class LazyRestaurantMap:
+    """A LazyRestaurantMap is a mapping from the name of each restaurant to its database,
+    that only keeps a bounded number of databases in memory. A database is loaded from its
+    storage when it is first looked up, and the least recently used database is evicted once
+    too many are resident (on_evict is given the chance to write it back first).
+
+    Every name is always known, so checking if a restaurant exists or listing restaurants
+    never loads a database
+    """
+    
+    def __init__(self, store : Storage, restaurants : List[str], capacity : int, lock : threading.RLock,
+                 on_evict : Callable[[str, RestaurantDatabase], None]):
+        """Creates a LazyRestaurantMap with nothing resident
+
+        Args:
+            store (Storage): The storage to load databases from
+            restaurants (List[str]): The names of every restaurant, in order
+            capacity (int): The most databases to keep in memory
+            lock (threading.RLock): The lock that guards loading and evicting databases. It
+            should be the same lock that guards changes to them, so that a database is never
+            evicted halfway through a change
+            on_evict (Callable[[str, RestaurantDatabase], None]): Called with each database
+            before it is evicted
+        """
+        self.store = store
+        self.names : Dict[str, None] = dict.fromkeys(restaurants)
+        self.resident : OrderedDict[str, RestaurantDatabase] = OrderedDict()
+        # Bumped each time a restaurant is evicted, replaced or removed, so that a load which
+        # raced with one of those (and may have read an older version) isn't kept
+        self.generations : Dict[str, int] = dict()
+        self.capacity = max(capacity, 1)
+        self.lock = lock
+        self.on_evict = on_evict
+        
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_time = 0.0
+
+    def __contains__(self, restaurant : str) -> bool:
+        return restaurant in self.names
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def keys(self) -> KeysView[str]:
+        return self.names.keys()
+
+    def __getitem__(self, restaurant : str) -> RestaurantDatabase:
+        restaurant_data = self.get(restaurant)
+        if restaurant_data is None:
+            raise KeyError(restaurant)
+        return restaurant_data
+
+    def __setitem__(self, restaurant : str, restaurant_data : RestaurantDatabase):
+        with self.lock:
+            self.names[restaurant] = None
+            self.generations[restaurant] = self.generations.get(restaurant, 0) + 1
+            self.resident[restaurant] = restaurant_data
+            self.resident.move_to_end(restaurant)
+            self.evict()
+
+    def __delitem__(self, restaurant : str):
+        with self.lock:
+            del self.names[restaurant]
+            self.generations[restaurant] = self.generations.get(restaurant, 0) + 1
+            self.resident.pop(restaurant, None)
+
+    def get(self, restaurant : str, default : RestaurantDatabase | None = None) -> RestaurantDatabase | None:
+        """Gets the database of a restaurant, loading it if it isn't resident. Loading happens
+        outside of the lock, so that one slow load doesn't hold up every other lookup and change
+
+        Args:
+            restaurant (str): The name of the restaurant
+            default (RestaurantDatabase | None, optional): What to return if the restaurant
+                                                           doesn't exist. Defaults to None.
+
+        Returns:
+            RestaurantDatabase | None: The database of the restaurant, or default
+        """
+        while True:
+            with self.lock:
+                restaurant_data = self.resident.get(restaurant)
+                if restaurant_data is not None:
+                    self.resident.move_to_end(restaurant)
+                    self.hits += 1
+                    return restaurant_data
+                if restaurant not in self.names:
+                    return default
+                self.misses += 1
+                generation = self.generations.get(restaurant, 0)
+            
+            start = time.perf_counter()
+            try:
+                restaurant_data = self.store.load(restaurant)
+            except (KeyError, FileNotFoundError):
+                # It was removed while it loaded
+                with self.lock:
+                    if restaurant not in self.names:
+                        return default
+                raise
+            elapsed = time.perf_counter() - start
+            
+            with self.lock:
+                self.load_time += elapsed
+                # Another thread may have loaded it first, and may have changed it since
+                resident = self.resident.get(restaurant)
+                if resident is not None:
+                    self.resident.move_to_end(restaurant)
+                    return resident
+                if restaurant not in self.names:
+                    return default
+                if self.generations.get(restaurant, 0) != generation:
+                    # It was written back or replaced while it loaded, so what was loaded may be older
+                    continue
+                self.resident[restaurant] = restaurant_data
+                self.evict()
+                return restaurant_data
+
+    def evict(self):
+        """Evicts the least recently used databases until there are at most capacity
+        """
+        while len(self.resident) > self.capacity:
+            restaurant, restaurant_data = self.resident.popitem(last=False)
+            try:
+                self.on_evict(restaurant, restaurant_data)
+            except BaseException:
+                # Keep it resident if it couldn't be written back
+                self.resident[restaurant] = restaurant_data
+                self.resident.move_to_end(restaurant, last=False)
+                raise
+            self.generations[restaurant] = self.generations.get(restaurant, 0) + 1
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int | float]:
+        """Gets statistics about residency
+
+        Returns:
+            Dict[str, int | float]: The statistics, with times in seconds
+        """
+        lookups = self.hits + self.misses
+        return {
+            'restaurants' : len(self.names),
+            'resident' : len(self.resident),
+            'capacity' : self.capacity,
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'hit_rate' : self.hits / lookups if lookups else 0.0,
+            'evictions' : self.evictions,
+            'load_time' : self.load_time,
+            'average_load_time' : self.load_time / self.misses if self.misses else 0.0,
+        }
@@ -0,0 +1,258 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import traceback
+
+from ..common.files import write_atomically
+from ..common.json import JSONEncoder
+from .manager import DatabaseManager
+from .restaurant import RestaurantDatabase
+
+from typing import Any, Dict, Iterator, List, Tuple
+
+# A snapshot file is MAGIC, the length of the header, the JSON header, and then the
+# fragments. The header holds the generation, the epoch of the writer's DatabaseManager,
+# the catalog stamp (which changes iff the list of restaurants changed), and
+# [name, stamp, offset, length] for each restaurant, in order. A fragment is a restaurant's
+# JSON in RestaurantDatabase dictionary format, at offset from the end of the header.
+# A restaurant's stamp changes iff its fragment did
+MAGIC = b"RSNAPv1\n"
+HEADER_LENGTH = struct.Struct("<Q")
+
+def snapshot_path(directory : str, generation : int) -> str:
+    """Gets the file of a generation of the snapshot
+
+    Args:
+        directory (str): The directory that holds the snapshots
+        generation (int): The generation
+
+    Returns:
+        str: The path of its file
+    """
+    return os.path.join(directory, f"snapshot-{generation}.bin")
+
+class SnapshotPublisher:
+    """A SnapshotPublisher periodically writes the restaurants of a DatabaseManager into
+    an immutable snapshot file, for other processes to read, and then announces its
+    generation through a shared counter. Only restaurants that changed since the last
+    generation are encoded again
+    """
+
+    def __init__(self, manager : DatabaseManager, directory : str, generation : Any, interval : float):
+        """Creates a SnapshotPublisher. Nothing is published until publish or start is called
+
+        Args:
+            manager (DatabaseManager): The manager to publish. Its restaurants must all be resident
+            directory (str): The directory to write snapshots into
+            generation (Any): A shared integer (e.g. a multiprocessing.Value) whose value is set
+            to each generation once it is published
+            interval (float): The shortest time, in seconds, between generations
+        """
+        self.manager = manager
+        self.directory = directory
+        self.generation = generation
+        self.interval = interval
+        os.makedirs(directory, exist_ok=True)
+
+        # The last published fragment of each restaurant, with the database and version it encodes
+        self.fragments : Dict[str, Tuple[RestaurantDatabase, int, int, bytes]] = dict()
+        self.names : List[str] = []
+        self.stamp = 0
+        self.catalog = 0
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread : threading.Thread | None = None
+
+        self.publications = 0
+        self.last_duration = 0.0
+        self.last_bytes = 0
+        self.last_encoded = 0
+
+    def notify(self):
+        """Called after the manager changes, to have the change published. This never blocks
+        """
+        self.wakeup.set()
+
+    def start(self):
+        """Starts publishing in the background
+        """
+        self.thread = threading.Thread(target=self.run, name="snapshot-publisher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops publishing in the background
+        """
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        """Publishes a generation after each change, at most once per interval, until stopped
+        """
+        while not self.stopped.is_set():
+            self.wakeup.wait()
+            if self.stopped.is_set():
+                return
+            self.wakeup.clear()
+            try:
+                self.publish()
+            except Exception:
+                traceback.print_exc()
+            self.stopped.wait(self.interval)
+
+    def publish(self) -> int:
+        """Writes and announces the next generation of the snapshot, and deletes the files of
+        generations before the previous one (readers that have them mapped can keep reading them)
+
+        Returns:
+            int: The generation that was published
+        """
+        start = time.perf_counter()
+        with self.manager.lock:
+            names = list(self.manager.restaurant_map)
+            stale = dict()
+            for restaurant in names:
+                restaurant_data = self.manager.restaurant_map[restaurant]
+                published = self.fragments.get(restaurant)
+                if not published or published[0] is not restaurant_data or published[1] != restaurant_data.version:
+                    stale[restaurant] = (restaurant_data, restaurant_data.version, restaurant_data.to_dict())
+
+        for restaurant in stale:
+            restaurant_data, version, data = stale[restaurant]
+            self.stamp += 1
+            self.fragments[restaurant] = (restaurant_data, version, self.stamp, json.dumps(data, cls=JSONEncoder).encode('utf-8'))
+        if names != self.names:
+            self.catalog += 1
+            self.fragments = {restaurant : self.fragments[restaurant] for restaurant in names}
+            self.names = names
+
+        generation = self.generation.value + 1
+        written = write_atomically(snapshot_path(self.directory, generation), self.encode(generation))
+        self.generation.value = generation
+        stale_file = snapshot_path(self.directory, generation - 2)
+        if os.path.exists(stale_file):
+            os.remove(stale_file)
+
+        self.publications += 1
+        self.last_duration = time.perf_counter() - start
+        self.last_bytes = written
+        self.last_encoded = len(stale)
+        return generation
+
+    def encode(self, generation : int) -> Iterator[bytes]:
+        """Encodes a generation of the snapshot from the published fragments
+
+        Args:
+            generation (int): The generation
+
+        Yields:
+            bytes: Consecutive chunks of the snapshot file
+        """
+        restaurants = []
+        offset = 0
+        for restaurant in self.names:
+            _, _, stamp, fragment = self.fragments[restaurant]
+            restaurants.append([restaurant, stamp, offset, len(fragment)])
+            offset += len(fragment)
+        header = json.dumps({'generation' : generation, 'epoch' : self.manager.epoch, 'catalog' : self.catalog,
+                             'restaurants' : restaurants}).encode('utf-8')
+        yield MAGIC + HEADER_LENGTH.pack(len(header)) + header
+        for restaurant in self.names:
+            yield self.fragments[restaurant][3]
+
+    def stats(self) -> Dict[str, int | float]:
+        """Gets statistics about publishing
+
+        Returns:
+            Dict[str, int | float]: The current generation, the number of generations published,
+            and the duration (seconds), bytes written and restaurants encoded of the last one
+        """
+        return {'generation' : self.generation.value, 'publications' : self.publications,
+                'last_duration' : self.last_duration, 'last_bytes' : self.last_bytes,
+                'last_encoded' : self.last_encoded, 'interval' : self.interval}
+
+class SharedSnapshot:
+    """A SharedSnapshot is one generation of a snapshot file, memory-mapped read-only, so
+    every process that reads it shares the same pages
+    """
+
+    def __init__(self, path : str):
+        """Maps a snapshot file
+
+        Args:
+            path (str): The snapshot file
+        """
+        with open(path, 'rb') as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a snapshot file")
+        length, = HEADER_LENGTH.unpack_from(self.map, len(MAGIC))
+        base = len(MAGIC) + HEADER_LENGTH.size
+        header = json.loads(self.map[base:base + length])
+        self.base = base + length
+        self.generation : int = header['generation']
+        self.epoch : str = header['epoch']
+        self.catalog : int = header['catalog']
+        self.names : List[str] = [restaurant for restaurant, _, _, _ in header['restaurants']]
+        self.index : Dict[str, Tuple[int, int, int]] = {restaurant : (stamp, offset, length) for restaurant, stamp, offset, length in header['restaurants']}
+
+    def fragment(self, restaurant : str) -> bytes:
+        """Reads the fragment of a restaurant
+
+        Args:
+            restaurant (str): The name of the restaurant, which must be in this
+
+        Returns:
+            bytes: Its JSON, in RestaurantDatabase dictionary format
+        """
+        _, offset, length = self.index[restaurant]
+        return self.map[self.base + offset:self.base + offset + length]
+
+class SnapshotReader:
+    """A SnapshotReader follows the generations published by a SnapshotPublisher in another
+    process, switching to each new generation as a whole the first time it is read after
+    being announced
+    """
+
+    def __init__(self, directory : str, generation : Any):
+        """Creates a SnapshotReader. The first generation must already be published
+
+        Args:
+            directory (str): The directory the snapshots are written into
+            generation (Any): The shared integer the publisher announces generations through
+        """
+        self.directory = directory
+        self.generation = generation
+        self.lock = threading.Lock()
+        self.snapshot = self.open()
+
+    def open(self) -> SharedSnapshot:
+        """Maps the latest generation. If it is deleted before it can be opened, a newer
+        generation has been published, so that one is opened instead
+
+        Returns:
+            SharedSnapshot: The latest generation
+        """
+        while True:
+            try:
+                return SharedSnapshot(snapshot_path(self.directory, self.generation.value))
+            except FileNotFoundError:
+                continue
+
+    def current(self) -> SharedSnapshot:
+        """Gets the latest generation
+
+        Returns:
+            SharedSnapshot: The latest generation, which stays readable for as long as it is referenced
+        """
+        snapshot = self.snapshot
+        if snapshot.generation != self.generation.value:
+            with self.lock:
+                if self.snapshot.generation != self.generation.value:
+                    self.snapshot = self.open()
+                snapshot = self.snapshot
+        return snapshot
@@ -0,0 +1,116 @@
+import threading
+import time
+import traceback
+
+from typing import Dict
+
+class Snapshotter:
+    """A Snapshotter saves databases on a background thread, either every interval
+    or as soon as enough changes have piled up, so that request handlers never have
+    to wait on a save.
+
+    A target is anything with a save() method that returns (bytes written, dirty count),
+    a pending_changes() method, and an on_change attribute (e.g. DatabaseManager, Users)
+    """
+    
+    def __init__(self, *targets, interval : float = 60.0, dirty_threshold : int = 100):
+        """Creates a Snapshotter for the given targets. It does not start running
+        until start is called
+
+        Args:
+            targets (varargs): The targets to save
+            interval (float, optional): The longest time, in seconds, that a change
+                                        waits before being saved. Defaults to 60.0.
+            dirty_threshold (int, optional): The number of changes (in any single target)
+                                             that triggers a save before interval has
+                                             passed. Defaults to 100.
+        """
+        self.targets = list(targets)
+        self.interval = interval
+        self.dirty_threshold = dirty_threshold
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread : threading.Thread | None = None
+        
+        # Statistics, for sizing interval and dirty_threshold
+        self.snapshots = 0
+        self.failures = 0
+        self.last_duration = 0.0
+        self.last_bytes = 0
+        self.last_dirty = 0
+        self.total_duration = 0.0
+        self.total_bytes = 0
+        
+        for target in self.targets:
+            target.on_change = self.notify
+
+    def notify(self, pending : int):
+        """Called by a target after it changes. This never blocks
+
+        Args:
+            pending (int): The number of changes the target has not saved yet
+        """
+        if pending >= self.dirty_threshold:
+            self.wakeup.set()
+
+    def start(self):
+        """Starts saving in the background
+        """
+        self.thread = threading.Thread(target=self.run, name="snapshotter", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops saving in the background, waiting for any save in progress to finish
+        """
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        """The body of the background thread
+        """
+        while not self.stopped.is_set():
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            if not self.stopped.is_set():
+                self.snapshot()
+
+    def snapshot(self):
+        """Saves every target that has unsaved changes
+        """
+        for target in self.targets:
+            if not target.pending_changes():
+                continue
+            start = time.perf_counter()
+            try:
+                written, dirty = target.save()
+            except Exception:
+                self.failures += 1
+                traceback.print_exc()
+                continue
+            self.last_duration = time.perf_counter() - start
+            self.last_bytes = written
+            self.last_dirty = dirty
+            self.total_duration += self.last_duration
+            self.total_bytes += written
+            self.snapshots += 1
+
+    def stats(self) -> Dict[str, int | float]:
+        """Gets statistics about the snapshots taken so far
+
+        Returns:
+            Dict[str, int | float]: The statistics, with durations in seconds
+        """
+        return {
+            'snapshots' : self.snapshots,
+            'failures' : self.failures,
+            'last_duration' : self.last_duration,
+            'last_bytes' : self.last_bytes,
+            'last_dirty' : self.last_dirty,
+            'total_duration' : self.total_duration,
+            'total_bytes' : self.total_bytes,
+            'pending' : sum(target.pending_changes() for target in self.targets),
+            'interval' : self.interval,
+            'dirty_threshold' : self.dirty_threshold,
+        }
@@ -0,0 +1,224 @@
+import heapq
+import math
+
+from ..common.constants import DEFAULT_CELL_DEGREES
+from ..common.locks import RWLock
+
+from typing import Dict, Iterator, List, Set, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+
+def haversine(latitude : float, longitude : float, other_latitude : float, other_longitude : float) -> float:
+    """Computes the great-circle distance between two points
+
+    Args:
+        latitude (float): The latitude of the first point, in degrees
+        longitude (float): The longitude of the first point, in degrees
+        other_latitude (float): The latitude of the second point, in degrees
+        other_longitude (float): The longitude of the second point, in degrees
+
+    Returns:
+        float: The distance, in kilometers
+    """
+    phi, other_phi = math.radians(latitude), math.radians(other_latitude)
+    a = (math.sin((other_phi - phi) / 2) ** 2 +
+         math.cos(phi) * math.cos(other_phi) * math.sin(math.radians(other_longitude - longitude) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+class GridIndex:
+    """A GridIndex is a spatial index of named points, which are bucketed into cells of a grid
+    of latitudes and longitudes (cell_degrees on each side). Only cells that hold points are kept.
+
+    Nearest-first searches visit rings of cells around the query, widening one ring at a time,
+    and only give out a point once no unvisited cell could hold a closer one. A search that
+    would visit more cells than there are occupied ones checks the occupied cells directly
+    instead, so sparse data spread over the world never costs more than a scan.
+
+    It is safe to use from multiple threads
+    """
+
+    def __init__(self, cell_degrees : float = DEFAULT_CELL_DEGREES):
+        """Creates an empty GridIndex
+
+        Args:
+            cell_degrees (float, optional): The size of a cell, in degrees. Defaults to DEFAULT_CELL_DEGREES.
+        """
+        self.cell_degrees = cell_degrees
+        self.rows = math.ceil(180 / cell_degrees)
+        self.columns = math.ceil(360 / cell_degrees)
+        self.points : Dict[str, Tuple[float, float]] = dict()
+        self.cells : Dict[Tuple[int, int], Set[str]] = dict()
+        self.lock = RWLock()
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def __contains__(self, name : str) -> bool:
+        return name in self.points
+
+    def cell(self, latitude : float, longitude : float) -> Tuple[int, int]:
+        """Finds the cell of a point
+
+        Args:
+            latitude (float): The latitude, in degrees
+            longitude (float): The longitude, in degrees
+
+        Returns:
+            Tuple[int, int]: Its row and column
+        """
+        row = min(int((latitude + 90) / self.cell_degrees), self.rows - 1)
+        column = int((longitude + 180) / self.cell_degrees) % self.columns
+        return row, column
+
+    def add(self, name : str, latitude : float, longitude : float):
+        """Adds a point, or moves it if it is in this already
+
+        Args:
+            name (str): The name of the point
+            latitude (float): The latitude, in degrees
+            longitude (float): The longitude, in degrees
+        """
+        with self.lock.writing():
+            self.discard(name)
+            self.points[name] = (latitude, longitude)
+            self.cells.setdefault(self.cell(latitude, longitude), set()).add(name)
+
+    def remove(self, name : str) -> bool:
+        """Removes a point
+
+        Args:
+            name (str): The name of the point
+
+        Returns:
+            bool: True iff the point was removed, False if it wasn't in this
+        """
+        with self.lock.writing():
+            return self.discard(name)
+
+    def discard(self, name : str) -> bool:
+        """Removes a point. The lock must be held as the writer
+
+        Args:
+            name (str): The name of the point
+
+        Returns:
+            bool: True iff the point was removed
+        """
+        point = self.points.pop(name, None)
+        if point is None:
+            return False
+        cell = self.cell(*point)
+        self.cells[cell].discard(name)
+        if not self.cells[cell]:
+            del self.cells[cell]
+        return True
+
+    def ring(self, center : Tuple[int, int], radius : int) -> Iterator[Tuple[int, int]]:
+        """Gets the cells that are exactly radius cells away from a cell (in rows or columns)
+
+        Args:
+            center (Tuple[int, int]): The cell
+            radius (int): The distance, in cells
+
+        Yields:
+            Tuple[int, int]: Each cell of the ring that is on the grid. Columns wrap around
+            the antimeridian, so a ring wider than the grid can yield a cell twice
+        """
+        row, column = center
+        if not radius:
+            yield center
+            return
+        for r in range(row - radius, row + radius + 1):
+            if not 0 <= r < self.rows:
+                continue
+            if abs(r - row) == radius:
+                columns = range(column - radius, column + radius + 1)
+            else:
+                columns = (column - radius, column + radius)
+            for c in columns:
+                yield r, c % self.columns
+
+    def covered_distance(self, latitude : float, radius : int) -> float:
+        """Computes how far from a point the rings up to radius around its cell are guaranteed
+        to reach, so that any point outside of them is further away than this
+
+        Args:
+            latitude (float): The latitude of the point, in degrees
+            radius (int): The widest ring visited
+
+        Returns:
+            float: The distance, in kilometers
+        """
+        degrees = radius * self.cell_degrees
+        # A point outside the rows of the rings is this far in latitude alone
+        by_latitude = EARTH_RADIUS_KM * math.radians(degrees)
+        if 2 * radius + 1 >= self.columns:
+            return by_latitude
+        # A point within those rows, but outside their columns, is at least this far in longitude,
+        # as measured at the highest latitude the rows reach
+        highest = min(90.0, abs(latitude) + degrees + self.cell_degrees)
+        by_longitude = 2 * EARTH_RADIUS_KM * math.asin(math.cos(math.radians(highest)) * math.sin(math.radians(min(degrees, 180.0) / 2)))
+        return min(by_latitude, by_longitude)
+
+    def gather(self, latitude : float, longitude : float, names : Set[str], found : Set[str], candidates : List[Tuple[float, str]]):
+        """Adds the points of a cell to the candidates of a search, by distance. The lock must be held
+
+        Args:
+            latitude (float): The latitude of the location searched from, in degrees
+            longitude (float): The longitude of the location searched from, in degrees
+            names (Set[str]): The points of the cell
+            found (Set[str]): The points already added, which this adds to
+            candidates (List[Tuple[float, str]]): A heap of the points added, by distance
+        """
+        for name in names:
+            if name not in found:
+                found.add(name)
+                heapq.heappush(candidates, (haversine(latitude, longitude, *self.points[name]), name))
+
+    def nearest(self, latitude : float, longitude : float, max_distance : float | None = None) -> Iterator[Tuple[float, str]]:
+        """Gets the points closest to a location, closest first. Points are found lazily,
+        so taking only the first k of them only visits the cells needed to find those k
+
+        Args:
+            latitude (float): The latitude of the location, in degrees
+            longitude (float): The longitude of the location, in degrees
+            max_distance (float | None, optional): The furthest a point may be, in kilometers.
+                                                   Defaults to None (no limit).
+
+        Yields:
+            Tuple[float, str]: The distance (in kilometers) and name of each point
+        """
+        center = self.cell(latitude, longitude)
+        candidates : List[Tuple[float, str]] = []
+        visited : Set[Tuple[int, int]] = set()
+        # A point that moves while this runs could otherwise be found in two cells
+        found : Set[str] = set()
+        radius = 0
+        while True:
+            # Points are gathered under the lock, but given out without it, so that the caller
+            # can do anything (including change this) between them
+            with self.lock.reading():
+                if len(visited) + 8 * radius >= len(self.cells):
+                    # Widening the rings would visit more cells than there are, so scan what's left
+                    for cell, names in self.cells.items():
+                        if cell not in visited:
+                            self.gather(latitude, longitude, names, found, candidates)
+                    covered = math.inf
+                else:
+                    for cell in self.ring(center, radius):
+                        if cell in visited:
+                            continue
+                        visited.add(cell)
+                        self.gather(latitude, longitude, self.cells.get(cell, ()), found, candidates)
+                    covered = self.covered_distance(latitude, radius)
+            if max_distance is not None and covered >= max_distance:
+                # Everything close enough has been gathered
+                covered = math.inf
+            while candidates and candidates[0][0] <= covered:
+                distance, name = heapq.heappop(candidates)
+                if max_distance is not None and distance > max_distance:
+                    return
+                yield distance, name
+            if covered == math.inf:
+                return
+            radius += 1
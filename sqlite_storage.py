@@ -0,0 +1,327 @@
+import json
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from ..common.constants import DEFAULT_SQLITE_CONNECTIONS
+from .restaurant import RestaurantDatabase, RestaurantInfo
+from .reviews import Reviews, Review
+from .storage import WriteThroughStorage
+
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS restaurants (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    summary TEXT NOT NULL,
+    hours TEXT NOT NULL,
+    address TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    latitude REAL,
+    longitude REAL
+);
+CREATE TABLE IF NOT EXISTS reviews (
+    restaurant_id INTEGER NOT NULL REFERENCES restaurants(id) ON DELETE CASCADE,
+    user TEXT NOT NULL,
+    review TEXT NOT NULL,
+    PRIMARY KEY (restaurant_id, user)
+);
+CREATE INDEX IF NOT EXISTS reviews_by_user ON reviews(user);
+CREATE TABLE IF NOT EXISTS ratings (
+    restaurant_id INTEGER NOT NULL REFERENCES restaurants(id) ON DELETE CASCADE,
+    user TEXT NOT NULL,
+    category TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    PRIMARY KEY (restaurant_id, user, category)
+);
+CREATE INDEX IF NOT EXISTS ratings_by_category ON ratings(category, restaurant_id);
+CREATE TABLE IF NOT EXISTS users (
+    name TEXT PRIMARY KEY,
+    password TEXT NOT NULL
+);
+"""
+
+# Statements are kept as constants so that every connection's statement cache
+# prepares each of them once
+SELECT_IMPORTED = "SELECT value FROM meta WHERE key = ?"
+MARK_IMPORTED = "INSERT OR REPLACE INTO meta (key, value) VALUES (?, '1')"
+SELECT_NAMES = "SELECT name FROM restaurants ORDER BY id"
+SELECT_RESTAURANT = "SELECT id, summary, hours, address, phone, latitude, longitude FROM restaurants WHERE name = ?"
+SELECT_REVIEWS = "SELECT user, review FROM reviews WHERE restaurant_id = ? ORDER BY rowid"
+SELECT_RATINGS = "SELECT user, category, rating FROM ratings WHERE restaurant_id = ?"
+INSERT_RESTAURANT = ("INSERT INTO restaurants (name, summary, hours, address, phone, latitude, longitude) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?)")
+INSERT_REVIEW = "INSERT INTO reviews (restaurant_id, user, review) VALUES (?, ?, ?)"
+INSERT_RATING_BY_ID = "INSERT INTO ratings (restaurant_id, user, category, rating) VALUES (?, ?, ?, ?)"
+DELETE_RESTAURANT = "DELETE FROM restaurants WHERE name = ?"
+DELETE_RESTAURANTS = "DELETE FROM restaurants"
+# Replacing a review keeps its row, so reviews stay in the order they were first made
+UPSERT_REVIEW = ("INSERT INTO reviews (restaurant_id, user, review) "
+                 "SELECT id, ?, ? FROM restaurants WHERE name = ? "
+                 "ON CONFLICT (restaurant_id, user) DO UPDATE SET review = excluded.review")
+DELETE_RATINGS = "DELETE FROM ratings WHERE restaurant_id = (SELECT id FROM restaurants WHERE name = ?) AND user = ?"
+INSERT_RATING = ("INSERT INTO ratings (restaurant_id, user, category, rating) "
+                 "SELECT id, ?, ?, ? FROM restaurants WHERE name = ?")
+SELECT_USERS = "SELECT name, password FROM users"
+INSERT_USER = "INSERT INTO users (name, password) VALUES (?, ?)"
+UPDATE_PASSWORD = "UPDATE users SET password = ? WHERE name = ?"
+# Columns added to restaurants after its first version, which older databases are migrated to have
+SELECT_RESTAURANT_COLUMNS = "SELECT name FROM pragma_table_info('restaurants')"
+ADDED_RESTAURANT_COLUMNS = (("latitude", "REAL"), ("longitude", "REAL"))
+
+class SQLiteStorage(WriteThroughStorage):
+    """A SQLiteStorage keeps restaurants, their reviews and users in a SQLite database.
+    Reviews and ratings are indexed by restaurant, by user and by category. It is a
+    write-through storage: every change is its own transaction, so it is durable as soon
+    as record returns.
+
+    Connections are pooled: each use checks one out and returns it, so there are never more
+    open than the pool holds, however many threads use this. The database is in WAL mode, so
+    readers never block the writer (or each other)
+    """
+
+    name = "sqlite"
+
+    def __init__(self, database_file : str, connections : int = DEFAULT_SQLITE_CONNECTIONS):
+        """Opens (or creates) a SQLiteStorage
+
+        Args:
+            database_file (str): The SQLite database file
+            connections (int, optional): The most connections to have open at once.
+                                         Defaults to DEFAULT_SQLITE_CONNECTIONS.
+        """
+        self.database_file = database_file
+        self.max_connections = max(1, connections)
+        # The connections not checked out, most recently returned last
+        self.idle : queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self.opened = 0
+        self.opening = threading.Lock()
+        with self.connection() as connection:
+            connection.execute("PRAGMA journal_mode = WAL")
+            with connection:
+                connection.executescript(SCHEMA)
+                columns = {name for name, in connection.execute(SELECT_RESTAURANT_COLUMNS)}
+                for column, kind in ADDED_RESTAURANT_COLUMNS:
+                    if column not in columns:
+                        connection.execute(f"ALTER TABLE restaurants ADD COLUMN {column} {kind}")
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Checks out a connection from the pool for the duration of a with block. An idle one
+        is reused, a new one is opened if the pool isn't full yet, and otherwise this waits for
+        one to be returned
+
+        Yields:
+            sqlite3.Connection: The connection, used by nothing else until the block ends
+        """
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            with self.opening:
+                opening = self.opened < self.max_connections
+                if opening:
+                    self.opened += 1
+            if opening:
+                try:
+                    # Connections move between threads, one at a time, as they are checked out
+                    connection = sqlite3.connect(self.database_file, check_same_thread=False)
+                    connection.execute("PRAGMA foreign_keys = ON")
+                except BaseException:
+                    with self.opening:
+                        self.opened -= 1
+                    raise
+            else:
+                connection = self.idle.get()
+        try:
+            yield connection
+        finally:
+            # A connection goes back without any transaction a failed use left open
+            if connection.in_transaction:
+                connection.rollback()
+            self.idle.put(connection)
+
+    def imported(self, key : str) -> bool:
+        """Evaluates if something was imported into this yet
+
+        Args:
+            key (str): What was imported ('restaurants' or 'users')
+
+        Returns:
+            bool: True iff it was imported
+        """
+        with self.connection() as connection:
+            return connection.execute(SELECT_IMPORTED, (key,)).fetchone() is not None
+
+    def read_index(self) -> List[str] | None:
+        """Reads the names of the restaurants in this
+
+        Returns:
+            List[str] | None: The names, in the order they were added, or None if
+            nothing was imported into this yet
+        """
+        if not self.imported('restaurants'):
+            return None
+        with self.connection() as connection:
+            return [name for name, in connection.execute(SELECT_NAMES)]
+
+    def import_database(self, database_file : str) -> List[str]:
+        """Fills this with the restaurants of a database file, in a single transaction
+
+        Args:
+            database_file (str): The database file. The format must be:
+                {Restaurant Name : RestaurantDatabase Dictionary Format}
+
+        Returns:
+            List[str]: The names of the restaurants that were imported, in order
+        """
+        with open(database_file, 'r') as file:
+            data = json.load(file)
+        return self.import_restaurants(data.items())
+
+    def import_restaurants(self, restaurants : Iterable[Tuple[str, Dict]]) -> List[str]:
+        """Replaces every restaurant in this (along with their reviews), in a single transaction
+
+        Args:
+            restaurants (Iterable[Tuple[str, Dict]]): The name of each restaurant, with its
+            database in RestaurantDatabase dictionary format, in order
+
+        Returns:
+            List[str]: The names of the restaurants that were imported, in order
+        """
+        names = []
+        with self.connection() as connection:
+            with connection:
+                connection.execute(DELETE_RESTAURANTS)
+                for restaurant, data in restaurants:
+                    self.insert_restaurant(connection, restaurant, data)
+                    names.append(restaurant)
+                connection.execute(MARK_IMPORTED, ('restaurants',))
+        return names
+
+    def insert_restaurant(self, connection : sqlite3.Connection, restaurant : str, data : Dict):
+        """Inserts a restaurant and all of its reviews. This must be done within a transaction
+
+        Args:
+            connection (sqlite3.Connection): The connection to insert with
+            restaurant (str): The name of the restaurant
+            data (Dict): Its database, in RestaurantDatabase dictionary format (its reviews
+            may be Review objects)
+        """
+        info = data['restaurant_info']
+        restaurant_id = connection.execute(INSERT_RESTAURANT, (restaurant, info['summary'], info['hours'], info['address'],
+                                                               info['phone'], info.get('latitude'), info.get('longitude'))).lastrowid
+        # Reviews are parsed so that their ratings are stored exactly as Review keeps them
+        reviews = data['reviews']['reviews']
+        reviews = {name : review if isinstance(review, Review) else Review.from_dict(review) for name, review in reviews.items()}
+        connection.executemany(INSERT_REVIEW, ((restaurant_id, name, reviews[name].review) for name in reviews))
+        connection.executemany(INSERT_RATING_BY_ID, ((restaurant_id, name, category.name, rating)
+                                                     for name in reviews for category, rating in reviews[name].ratings.items()))
+
+    def load(self, restaurant : str) -> RestaurantDatabase:
+        """Loads the database of a restaurant from its rows
+
+        Args:
+            restaurant (str): The name of the restaurant
+
+        Returns:
+            RestaurantDatabase: Its database
+        """
+        with self.connection() as connection:
+            # Restaurants load while others change them, so the queries share a read transaction
+            # to see the same version of it
+            connection.execute("BEGIN")
+            try:
+                row = connection.execute(SELECT_RESTAURANT, (restaurant,)).fetchone()
+                if row is None:
+                    raise KeyError(restaurant)
+                restaurant_id, summary, hours, address, phone, latitude, longitude = row
+                reviews = {name : {'user' : name, 'ratings' : dict(), 'review' : review}
+                           for name, review in connection.execute(SELECT_REVIEWS, (restaurant_id,))}
+                for name, category, rating in connection.execute(SELECT_RATINGS, (restaurant_id,)):
+                    reviews[name]['ratings'][category] = rating
+            finally:
+                connection.rollback()
+        return RestaurantDatabase(RestaurantInfo(summary, hours, address, phone, latitude, longitude), Reviews(reviews))
+
+    def record(self, record : Dict):
+        """Durably applies a change made by a DatabaseManager or Users, in its own transaction
+
+        Args:
+            record (Dict): The change, as it would be journaled
+        """
+        with self.connection() as connection:
+            with connection:
+                self.apply_record(connection, record)
+
+    def record_many(self, records : List[Dict]):
+        """Durably applies many changes at once, in a single transaction
+
+        Args:
+            records (List[Dict]): The changes, in order, as they would be journaled
+        """
+        with self.connection() as connection:
+            with connection:
+                for record in records:
+                    self.apply_record(connection, record)
+
+    def apply_record(self, connection : sqlite3.Connection, record : Dict):
+        """Applies a change. This must be done within a transaction
+
+        Args:
+            connection (sqlite3.Connection): The connection to apply it with
+            record (Dict): The change, as it would be journaled
+        """
+        if record['op'] == 'add_review':
+            review = record['review']
+            review = review if isinstance(review, Review) else Review.from_dict(review)
+            restaurant = record['restaurant']
+            ratings = review.ratings
+            connection.execute(UPSERT_REVIEW, (review.user, review.review, restaurant))
+            connection.execute(DELETE_RATINGS, (restaurant, review.user))
+            connection.executemany(INSERT_RATING, ((review.user, category.name, ratings[category], restaurant)
+                                                   for category in ratings))
+        elif record['op'] == 'add_restaurant':
+            data = record['data']
+            self.insert_restaurant(connection, record['restaurant'],
+                                   data.to_dict() if isinstance(data, RestaurantDatabase) else data)
+        elif record['op'] == 'remove_restaurant':
+            connection.execute(DELETE_RESTAURANT, (record['restaurant'],))
+        elif record['op'] == 'add_user':
+            connection.execute(INSERT_USER, (record['name'], record['password']))
+        elif record['op'] == 'set_password':
+            connection.execute(UPDATE_PASSWORD, (record['password'], record['name']))
+
+    def read_users(self) -> Dict[str, str] | None:
+        """Reads every user in this
+
+        Returns:
+            Dict[str, str] | None: {Username : password}, or None if no users were imported yet
+        """
+        if not self.imported('users'):
+            return None
+        with self.connection() as connection:
+            return dict(connection.execute(SELECT_USERS))
+
+    def import_users(self, users_file : str) -> Dict[str, str]:
+        """Fills this with the users of a users file, in a single transaction
+
+        Args:
+            users_file (str): The users file. The format must be:
+                {Username : password}
+
+        Returns:
+            Dict[str, str]: The users that were imported
+        """
+        with open(users_file, 'r') as file:
+            data = json.load(file)
+        with self.connection() as connection:
+            with connection:
+                connection.executemany(INSERT_USER, data.items())
+                connection.execute(MARK_IMPORTED, ('users',))
+        return data
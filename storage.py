@@ -0,0 +1,157 @@
+from abc import ABC, abstractmethod
+
+from .restaurant import RestaurantDatabase
+
+from typing import Dict, Iterable, List, Tuple
+
+class Storage(ABC):
+    """A Storage is where a DatabaseManager keeps its restaurants (and optionally, where
+    Users keeps its users) instead of a single JSON file. Restaurants are loaded from it
+    one at a time, when they are first used.
+
+    There are two kinds of Storage, SnapshotStorage and WriteThroughStorage, and every
+    storage is one of them. A storage that doesn't implement every abstract method of its
+    kind can't be created
+    """
+    
+    # The name of this kind of storage, for statistics
+    name = "storage"
+    # Whether record makes changes durable by itself
+    write_through = False
+
+    @abstractmethod
+    def read_index(self) -> List[str] | None:
+        """Reads the names of the restaurants in this
+
+        Returns:
+            List[str] | None: The names, in order, or None if nothing was imported into this yet
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def import_database(self, database_file : str) -> List[str]:
+        """Fills this with the restaurants of a database file
+
+        Args:
+            database_file (str): The database file. The format must be:
+                {Restaurant Name : RestaurantDatabase Dictionary Format}
+
+        Returns:
+            List[str]: The names of the restaurants that were imported, in order
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def import_restaurants(self, restaurants : Iterable[Tuple[str, Dict]]) -> List[str]:
+        """Replaces every restaurant in this. Restaurants are taken one at a time, so they
+        never all have to be in memory at once
+
+        Args:
+            restaurants (Iterable[Tuple[str, Dict]]): The name of each restaurant, with its
+            database in RestaurantDatabase dictionary format, in order
+
+        Returns:
+            List[str]: The names of the restaurants that were imported, in order
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def load(self, restaurant : str) -> RestaurantDatabase:
+        """Loads the database of a restaurant
+
+        Args:
+            restaurant (str): The name of the restaurant
+
+        Returns:
+            RestaurantDatabase: Its database
+        """
+        raise NotImplementedError
+
+class SnapshotStorage(Storage):
+    """A SnapshotStorage is written to by saves, with the changes in between kept in the journal
+    """
+
+    write_through = False
+
+    @abstractmethod
+    def write(self, restaurant : str, encoded : bytes) -> int:
+        """Replaces the stored database of a restaurant
+
+        Args:
+            restaurant (str): The name of the restaurant
+            encoded (bytes): The JSON encoding of its database
+
+        Returns:
+            int: The number of bytes written
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_index(self, restaurants : List[str]) -> int:
+        """Replaces the list of restaurants in this
+
+        Args:
+            restaurants (List[str]): The names of the restaurants, in order
+
+        Returns:
+            int: The number of bytes written
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, restaurant : str):
+        """Deletes the stored database of a restaurant, once it is no longer in the
+        index
+
+        Args:
+            restaurant (str): The name of the restaurant
+        """
+        raise NotImplementedError
+
+class WriteThroughStorage(Storage):
+    """A WriteThroughStorage makes every change durable as it is recorded, so there is no
+    journal and nothing to save. It keeps users too
+    """
+
+    write_through = True
+
+    @abstractmethod
+    def record(self, record : Dict):
+        """Durably applies a change
+
+        Args:
+            record (Dict): A change, in the same form it would be journaled in
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def record_many(self, records : List[Dict]):
+        """Durably applies many changes at once, all or none of them
+
+        Args:
+            records (List[Dict]): The changes, in order, in the same form they would be journaled in
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def read_users(self) -> Dict[str, str] | None:
+        """Reads every user in this
+
+        Returns:
+            Dict[str, str] | None: {Username : password}, or None if no users were
+            imported into this yet
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def import_users(self, users_file : str) -> Dict[str, str]:
+        """Fills this with the users of a users file
+
+        Args:
+            users_file (str): The users file. The format must be:
+                {Username : password}
+
+        Returns:
+            Dict[str, str]: The users that were imported
+        """
+        raise NotImplementedError
@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from ..common.constants import DEFAULT_SEED, UNRATED
+from ..common.review_categories import CATEGORIES
+from . import columnar
+from .generator import DatasetGenerator, USER_NAME, PASSWORD
+from .manager import DatabaseManager
+from .reviews import Review
+from .users import Users, User
+
+from typing import Callable, Dict, List, Tuple
+
+# Switching threads this often (in seconds, rather than the default 5 milliseconds) makes races
+# between them far more likely to show up
+DEFAULT_SWITCH_INTERVAL = 0.00001
+WRITER_REVIEWERS = 50
+
+class StressTest:
+    """A StressTest runs writers, readers, snapshots and logins against one DatabaseManager and
+    Users from many threads at once, the way a threaded server would. Any exception in any thread
+    is a failure. Afterward, it checks that every restaurant's aggregates agree with its reviews,
+    that every review written is there, and that the saved files and journals load back to the
+    same restaurants and users
+    """
+
+    def __init__(self, directory : str, writers : int, readers : int, reviews : int, seed : int):
+        """Creates a StressTest on the dataset in a directory
+
+        Args:
+            directory (str): The directory of the database.json and users.json to test with,
+                             where the journals are written too
+            writers (int): The number of threads that add reviews
+            readers (int): The number of threads that read restaurants
+            reviews (int): The number of reviews each writer adds
+            seed (int): The seed of the reviews written and the restaurants read
+        """
+        self.directory = directory
+        self.writer_count = writers
+        self.reader_count = readers
+        self.review_count = reviews
+        self.seed = seed
+        self.manager = self.load_manager()
+        self.users = self.load_users()
+        self.names = list(self.manager.restaurant_map)
+        # The last review each writer wrote for each restaurant and reviewer
+        self.written : List[Dict[Tuple[str, str], Review]] = [dict() for _ in range(writers)]
+        self.added_users : List[str] = []
+        self.errors : List[str] = []
+        self.stopping = threading.Event()
+        self.counts = {'reviews' : 0, 'reads' : 0, 'saves' : 0, 'logins' : 0}
+        self.counts_lock = threading.Lock()
+
+    def load_manager(self) -> DatabaseManager:
+        """Loads the restaurants from the directory, along with their journal
+
+        Returns:
+            DatabaseManager: The restaurants
+        """
+        return DatabaseManager(os.path.join(self.directory, "database.json"), os.path.join(self.directory, "database.journal"))
+
+    def load_users(self) -> Users:
+        """Loads the users from the directory, along with their journal
+
+        Returns:
+            Users: The users
+        """
+        return Users(os.path.join(self.directory, "users.json"), os.path.join(self.directory, "users.journal"))
+
+    def count(self, kind : str, amount : int = 1):
+        """Counts operations that finished, to report how much was run
+
+        Args:
+            kind (str): The kind of operation
+            amount (int, optional): How many finished. Defaults to 1.
+        """
+        with self.counts_lock:
+            self.counts[kind] += amount
+
+    def guard(self, function : Callable, *args) -> Callable[[], None]:
+        """Wraps the body of a thread so that any exception it raises is recorded as a failure,
+        and stops the rest of the threads
+
+        Args:
+            function (Callable): The body of the thread
+            args (varargs): Its arguments
+
+        Returns:
+            Callable[[], None]: The wrapped body
+        """
+        def run():
+            try:
+                function(*args)
+            except BaseException:
+                self.errors.append(f"{threading.current_thread().name}: {traceback.format_exc()}")
+                self.stopping.set()
+        return run
+
+    def write(self, writer : int):
+        """Adds reviews, one at a time and in batches, each by one of this writer's own reviewers,
+        so that the last review of each restaurant and reviewer is known
+
+        Args:
+            writer (int): The number of the writer
+        """
+        rng = random.Random(f"{self.seed}:writer:{writer}")
+        written = self.written[writer]
+        i = 0
+        while i < self.review_count and not self.stopping.is_set():
+            batch = []
+            for _ in range(1 if rng.random() < 0.8 else rng.randint(2, 10)):
+                user = f"Stress Writer {writer} {rng.randrange(WRITER_REVIEWERS)}"
+                ratings = {category.name : rng.randint(0, 5) for category in rng.sample(CATEGORIES, rng.randint(1, 4))}
+                batch.append((rng.choice(self.names), Review(user, ratings, f"stress review {writer} {i}")))
+                i += 1
+            if len(batch) == 1:
+                restaurant, review = batch[0]
+                if self.manager.add_review(restaurant, review) is None:
+                    raise AssertionError(f"add_review did not find {restaurant}")
+            elif not all(self.manager.add_reviews(batch)):
+                raise AssertionError("add_reviews did not add every review")
+            for restaurant, review in batch:
+                written[restaurant, review.user] = review
+            self.count('reviews', len(batch))
+
+    def read(self, reader : int):
+        """Reads restaurants every way the server does, and checks that what is read is consistent
+
+        Args:
+            reader (int): The number of the reader
+        """
+        rng = random.Random(f"{self.seed}:reader:{reader}")
+        while not self.stopping.is_set():
+            name = rng.choice(self.names)
+            restaurant_data = self.manager.get_restaurant(name)
+            category = rng.choice(CATEGORIES)
+            webpage = json.loads(restaurant_data.to_webpage_json(category))
+            if not all(category.name in review['ratings'] for review in webpage['reviews']):
+                raise AssertionError(f"the {category.name} webpage of {name} has reviews without a {category.name} rating")
+            if not all(review.contains_tag(category) for review in restaurant_data.filter_reviews(category)):
+                raise AssertionError(f"filtering {name} by {category.name} found reviews without a {category.name} rating")
+            restaurant_data.get_ratings_summary()
+            self.manager.get_restaurant_list(name[:rng.randint(1, 6)])
+            self.manager.get_ranked_restaurant_list(name[:rng.randint(3, 8)])
+            self.manager.get_top_restaurants(category, 10)
+            self.manager.search_reviews("stress review", name)
+            if columnar.numpy is not None:
+                self.manager.get_ratings_statistics(name)
+            self.count('reads')
+
+    def snapshot(self):
+        """Saves the restaurants and users over and over, as the snapshotter does, until the
+        writers are done
+        """
+        while not self.stopping.is_set():
+            self.manager.save()
+            self.users.save()
+            self.count('saves')
+
+    def log_in(self):
+        """Registers users, and logs in, validates and logs out existing ones, until the writers are done
+        """
+        rng = random.Random(f"{self.seed}:users")
+        i = 0
+        while not self.stopping.is_set():
+            name = f"Stress User {i}"
+            if not self.users.add_user(User(name, f"stress password {i}")):
+                raise AssertionError(f"add_user did not add {name}")
+            self.added_users.append(name)
+            existing = rng.randrange(3)
+            token = self.users.login(User(USER_NAME.format(existing), PASSWORD.format(existing)))
+            if token is None or self.users.validate_user(token) is None or not self.users.logout(token):
+                raise AssertionError(f"could not log {USER_NAME.format(existing)} in and out")
+            self.count('logins')
+            i += 1
+
+    def run(self) -> float:
+        """Runs every thread until the writers are done
+
+        Returns:
+            float: How long it took, in seconds
+        """
+        writers = [threading.Thread(target=self.guard(self.write, i), name=f"writer-{i}") for i in range(self.writer_count)]
+        others = [threading.Thread(target=self.guard(self.read, i), name=f"reader-{i}") for i in range(self.reader_count)]
+        others.append(threading.Thread(target=self.guard(self.snapshot), name="snapshot"))
+        others.append(threading.Thread(target=self.guard(self.log_in), name="users"))
+        start = time.perf_counter()
+        for thread in writers + others:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        self.stopping.set()
+        for thread in others:
+            thread.join()
+        return time.perf_counter() - start
+
+    def check(self) -> List[str]:
+        """Checks the restaurants and users after a run, in memory and as loaded back from disk
+
+        Returns:
+            List[str]: Every problem found
+        """
+        problems = []
+        for name in self.names:
+            reviews = self.manager.get_restaurant(name).reviews
+            for i, category in enumerate(CATEGORIES):
+                scores = [review.scores[i] for review in reviews.reviews.values() if review.scores[i] != UNRATED]
+                if reviews.ratings_sum[category] != sum(scores) or reviews.ratings_count[category] != len(scores):
+                    problems.append(f"{name}: the {category.name} sum or count doesn't match its reviews")
+                if reviews.tagged[category] != {user for user, review in reviews.reviews.items() if review.scores[i] != UNRATED}:
+                    problems.append(f"{name}: the reviewers who rated {category.name} don't match its reviews")
+            if list(reviews.order) != list(reviews.reviews):
+                problems.append(f"{name}: the order of its reviewers doesn't match its reviews")
+        for written in self.written:
+            for (name, user), review in written.items():
+                stored = self.manager.get_restaurant(name).reviews.reviews.get(user)
+                if stored is None or stored.review != review.review or stored.ratings != review.ratings:
+                    problems.append(f"{name}: the last review by {user} is missing or wrong")
+
+        # Everything that was written must load back the same, from the last save and the journals
+        self.manager.journal.close()
+        self.users.journal.close()
+        manager = self.load_manager()
+        for name in self.names:
+            if manager.get_restaurant(name).to_webpage_json() != self.manager.get_restaurant(name).to_webpage_json():
+                problems.append(f"{name}: it loaded back differently from disk")
+        manager.journal.close()
+        users = self.load_users()
+        missing = [name for name in self.added_users if not users.contains_name(name)]
+        if missing:
+            problems.append(f"{len(missing)} registered user(s) didn't load back from disk, such as {missing[0]}")
+        users.journal.close()
+        return problems
+
+def parse_args(argv : List[str] | None = None) -> argparse.Namespace:
+    """Parses out arguments on the command line for the stress test
+
+    Parameters (Command-Line):
+        --restaurants (int): The number of restaurants to generate
+        --reviews (int): The number of reviews each writer adds
+        --writers (int): The number of threads that add reviews
+        --readers (int): The number of threads that read restaurants
+        --seed (int): The seed
+        --switch-interval (float): How often to switch threads, in seconds
+
+    Args:
+        argv (List[str] | None, optional): The arguments to parse. Defaults to None,
+                                           for the command-line arguments.
+
+    Returns:
+        argparse.Namespace: The restaurants (int), reviews (int), writers (int), readers (int),
+        seed (int) and switch_interval (float) to run with
+    """
+    parser = argparse.ArgumentParser(description="Adds, saves and reads reviews and users from many threads at once, and checks the results")
+    parser.add_argument("--restaurants", type=int, default=50, help="Number of restaurants to generate")
+    parser.add_argument("--reviews", type=int, default=2000, help="Reviews each writer adds")
+    parser.add_argument("--writers", type=int, default=4, help="Threads that add reviews")
+    parser.add_argument("--readers", type=int, default=4, help="Threads that read restaurants")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed")
+    parser.add_argument("--switch-interval", type=float, default=DEFAULT_SWITCH_INTERVAL, help="Seconds between thread switches")
+    return parser.parse_args(argv)
+
+def main(argv : List[str] | None = None) -> int:
+    """Runs the stress test on a generated dataset in a temporary directory
+
+    Args:
+        argv (List[str] | None, optional): The arguments. Defaults to None, for the command-line arguments.
+
+    Returns:
+        int: 1 if any thread raised an exception or any check failed, otherwise 0
+    """
+    args = parse_args(argv)
+    directory = tempfile.mkdtemp(prefix="stress-")
+    interval = sys.getswitchinterval()
+    try:
+        DatasetGenerator(args.restaurants, args.restaurants * 20, users=10, seed=args.seed).write(
+            os.path.join(directory, "database.json"), os.path.join(directory, "users.json"))
+        test = StressTest(directory, args.writers, args.readers, args.reviews, args.seed)
+        sys.setswitchinterval(args.switch_interval)
+        try:
+            elapsed = test.run()
+        finally:
+            sys.setswitchinterval(interval)
+        print(f"{elapsed:.1f}s: {test.counts}", file=sys.stderr)
+        problems = test.errors + test.check()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    print(f"{len(problems)} problem(s)", file=sys.stderr)
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,316 @@
+import bisect
+import collections
+import gc
+import itertools
+import math
+import re
+
+from array import array
+
+from ..common.constants import BM25_K1, BM25_B, DEFAULT_SNIPPET_LENGTH
+
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+# A token is a run of letters, digits and underscores, compared in lowercase
+TOKEN = re.compile(r"\w+")
+PHRASE = re.compile(r'"([^"]*)"')
+# Term frequencies are stored in 16 bits
+MAX_FREQUENCY = 0xFFFF
+
+def tokenize(text : str) -> List[str]:
+    """Splits text into the tokens that are indexed
+
+    Args:
+        text (str): The text
+
+    Returns:
+        List[str]: Its tokens, in lowercase and in order
+    """
+    return TOKEN.findall(text.lower())
+
+def contains_phrase(tokens : List[str], phrase : Tuple[str, ...]) -> bool:
+    """Evaluates if a phrase appears in a list of tokens
+
+    Args:
+        tokens (List[str]): The tokens
+        phrase (Tuple[str, ...]): The tokens of the phrase
+
+    Returns:
+        bool: True iff the tokens of the phrase appear in tokens consecutively and in order
+    """
+    length = len(phrase)
+    first = phrase[0]
+    phrase = list(phrase)
+    return any(tokens[i:i + length] == phrase for i, token in enumerate(tokens) if token == first)
+
+class TextQuery:
+    """A TextQuery is a parsed full-text search. Reviews match it iff they contain every term,
+    and every phrase (the terms in double quotes) with its terms consecutive and in order
+    """
+
+    def __init__(self, terms : Tuple[str, ...], phrases : Tuple[Tuple[str, ...], ...]):
+        """Creates a TextQuery
+
+        Args:
+            terms (Tuple[str, ...]): Every distinct term, including those of phrases
+            phrases (Tuple[Tuple[str, ...], ...]): The terms of each phrase of more than one term
+        """
+        self.terms = terms
+        self.phrases = phrases
+
+    @staticmethod
+    def parse(query : str):
+        """Parses a search, such as: "narrow door" braille
+
+        Args:
+            query (str): The search. Parts in double quotes are phrases, and everything else is
+                         separate terms. An unmatched double quote is ignored
+
+        Returns:
+            TextQuery: The parsed search, which has no terms if query has no tokens
+        """
+        phrases = tuple(tuple(tokenize(phrase)) for phrase in PHRASE.findall(query))
+        terms = tokenize(PHRASE.sub(" ", query))
+        for phrase in phrases:
+            terms.extend(phrase)
+        return TextQuery(tuple(dict.fromkeys(terms)), tuple(phrase for phrase in phrases if len(phrase) > 1))
+
+class TextIndex:
+    """A TextIndex is an inverted index of the text of the reviews of one restaurant. Reviews are
+    identified by the position of their reviewer (see Reviews.order), which never changes. Each
+    term has a posting list of the positions of the reviews that contain it, in increasing order,
+    and a parallel array of how many times each contains it. The length of each review, in tokens,
+    is kept for BM25.
+
+    Postings are arrays rather than sets, so an index costs about 6 bytes per distinct term of each
+    review. There are no positions of terms within reviews: phrases are checked against the text
+    of the reviews that contain all of their terms
+    """
+
+    def __init__(self):
+        """Creates an empty TextIndex
+        """
+        self.postings : Dict[str, Tuple[array, array]] = dict()
+        # The reviewer and length of the review at each position
+        self.users : List[str | None] = []
+        self.lengths = array('I')
+        self.count = 0
+        self.total_length = 0
+
+    @staticmethod
+    def build(reviews : Iterable[Tuple[int, str, str]]):
+        """Creates a TextIndex of many reviews at once, which is about twice as fast as adding them one at a time
+
+        Args:
+            reviews (Iterable[Tuple[int, str, str]]): The position, reviewer and text of each review,
+                                                      in increasing order of position
+
+        Returns:
+            TextIndex: The index of reviews
+        """
+        index = TextIndex()
+        positions : Dict[str, List[int]] = dict()
+        frequencies : Dict[str, List[int]] = dict()
+        users = index.users
+        lengths = []
+        findall = TOKEN.findall
+        # The lists built can't make reference cycles, so collecting garbage while they grow
+        # would only take time
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            for position, user, text in reviews:
+                tokens = findall(text.lower())
+                if position > len(users):
+                    users.extend([None] * (position - len(users)))
+                    lengths.extend([0] * (position - len(lengths)))
+                users.append(user)
+                lengths.append(len(tokens))
+                for term in set(tokens):
+                    term_positions = positions.get(term)
+                    if term_positions is None:
+                        term_positions = positions[term] = []
+                        frequencies[term] = []
+                    term_positions.append(position)
+                    frequencies[term].append(min(tokens.count(term), MAX_FREQUENCY))
+        finally:
+            if collecting:
+                gc.enable()
+        index.postings = {term : (array('I', positions[term]), array('H', frequencies[term])) for term in positions}
+        index.lengths = array('I', lengths)
+        index.count = len(users) - users.count(None)
+        index.total_length = sum(lengths)
+        return index
+
+    def add(self, position : int, user : str, text : str):
+        """Adds a review. Any review at the same position must have been removed first
+
+        Args:
+            position (int): The position of its reviewer
+            user (str): Its reviewer
+            text (str): Its text
+        """
+        tokens = tokenize(text)
+        for term, frequency in collections.Counter(tokens).items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = (array('I'), array('H'))
+            positions, frequencies = postings
+            # New reviews have the highest position, so this nearly always appends
+            if not positions or positions[-1] < position:
+                positions.append(position)
+                frequencies.append(min(frequency, MAX_FREQUENCY))
+            else:
+                i = bisect.bisect_left(positions, position)
+                positions.insert(i, position)
+                frequencies.insert(i, min(frequency, MAX_FREQUENCY))
+        if position >= len(self.users):
+            self.users.extend([None] * (position + 1 - len(self.users)))
+            self.lengths.extend([0] * (position + 1 - len(self.lengths)))
+        self.users[position] = user
+        self.lengths[position] = len(tokens)
+        self.count += 1
+        self.total_length += len(tokens)
+
+    def remove(self, position : int, text : str):
+        """Removes a review, such as one that is being replaced
+
+        Args:
+            position (int): Its position
+            text (str): Its text, as it was added
+        """
+        tokens = tokenize(text)
+        for term in set(tokens):
+            positions, frequencies = self.postings[term]
+            i = bisect.bisect_left(positions, position)
+            del positions[i]
+            del frequencies[i]
+            if not positions:
+                del self.postings[term]
+        self.users[position] = None
+        self.lengths[position] = 0
+        self.count -= 1
+        self.total_length -= len(tokens)
+
+    def statistics(self, terms : Sequence[str]) -> Tuple[int, int, List[int]]:
+        """Gets what BM25 needs to know about the reviews in this to weigh terms
+
+        Args:
+            terms (Sequence[str]): The terms
+
+        Returns:
+            Tuple[int, int, List[int]]: The number of reviews, their total length (in tokens),
+            and the number of them that contain each term
+        """
+        frequencies = []
+        for term in terms:
+            postings = self.postings.get(term)
+            frequencies.append(len(postings[0]) if postings else 0)
+        return self.count, self.total_length, frequencies
+
+    def candidates(self, terms : Sequence[str]) -> Sequence[int]:
+        """Finds the reviews that contain every term. The posting lists are intersected from the
+        shortest up, so this costs about as much as the longer lists do to scan in C
+
+        Args:
+            terms (Sequence[str]): The terms
+
+        Returns:
+            Sequence[int]: The positions of the reviews, in increasing order
+        """
+        lists = []
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is None:
+                return ()
+            lists.append(postings[0])
+        if not lists:
+            return ()
+        if len(lists) == 1:
+            return lists[0]
+        lists.sort(key=len)
+        return sorted(set(lists[0]).intersection(*lists[1:]))
+
+    def frequencies(self, term : str, positions : Sequence[int], wanted : Set[int] | None = None) -> Sequence[int]:
+        """Gets how many times each of some reviews contains a term, all at once. The posting list
+        of the term is filtered in C, rather than each review being looked up
+
+        Args:
+            term (str): The term, which every review must contain
+            positions (Sequence[int]): The positions of the reviews, in increasing order
+            wanted (Set[int] | None, optional): The same positions, as a set. Defaults to None, to make it.
+
+        Returns:
+            Sequence[int]: The number of times each review contains term, in the order of positions
+        """
+        term_positions, frequencies = self.postings[term]
+        if len(term_positions) == len(positions):
+            return frequencies
+        if wanted is None:
+            wanted = set(positions)
+        return list(itertools.compress(frequencies, map(wanted.__contains__, term_positions)))
+
+def inverse_document_frequency(documents : int, frequency : int) -> float:
+    """Computes how much a term counts towards BM25 scores, which is more the fewer reviews contain it
+
+    Args:
+        documents (int): The number of reviews searched
+        frequency (int): The number of them that contain the term
+
+    Returns:
+        float: The weight of the term, which is never negative
+    """
+    return math.log(1 + (documents - frequency + 0.5) / (frequency + 0.5))
+
+def bm25(frequencies : List[Sequence[int]], lengths : Sequence[int], weights : Sequence[float], average_length : float,
+         k1 : float = BM25_K1, b : float = BM25_B) -> List[float]:
+    """Scores reviews for a search with Okapi BM25, a term at a time
+
+    Args:
+        frequencies (List[Sequence[int]]): For each term, how many times each review contains it
+        lengths (Sequence[int]): The length of each review, in tokens
+        weights (Sequence[float]): The inverse document frequency of each term
+        average_length (float): The mean length of the reviews searched
+        k1 (float, optional): How quickly repeating a term stops adding to a score. Defaults to BM25_K1.
+        b (float, optional): How much longer reviews are penalized. Defaults to BM25_B.
+
+    Returns:
+        List[float]: The score of each review, where higher is a better match
+    """
+    scale = k1 * b / average_length if average_length else 0.0
+    norms = [k1 - k1 * b + scale * length for length in lengths] if scale else [k1] * len(lengths)
+    scores = [0.0] * len(lengths)
+    for weight, term_frequencies in zip(weights, frequencies):
+        boost = weight * (k1 + 1)
+        scores = [score + boost * frequency / (frequency + norm)
+                  for score, frequency, norm in zip(scores, term_frequencies, norms)]
+    return scores
+
+def snippet(text : str, terms : Sequence[str], length : int = DEFAULT_SNIPPET_LENGTH) -> Tuple[str, List[Tuple[int, int]]]:
+    """Cuts the part of a review around the first term it contains, to show with a search result
+
+    Args:
+        text (str): The text of the review
+        terms (Sequence[str]): The terms searched for
+        length (int, optional): The most characters to cut, besides the ellipses. Defaults to DEFAULT_SNIPPET_LENGTH.
+
+    Returns:
+        Tuple[str, List[Tuple[int, int]]]: The snippet, with an ellipsis on each side that was cut,
+        and the start and end of each term in it
+    """
+    wanted = set(terms)
+    matches = [match.span() for match in TOKEN.finditer(text) if match.group().lower() in wanted]
+    if len(text) <= length:
+        return text, matches
+    first = matches[0][0] if matches else 0
+    # Start a quarter of the way back, at the start of a word
+    start = max(0, min(first - length // 4, len(text) - length))
+    while 0 < start < first and not text[start - 1].isspace():
+        start += 1
+    end = min(len(text), start + length)
+    while start + length // 2 < end < len(text) and not text[end].isspace():
+        end -= 1
+    prefix = "..." if start else ""
+    shift = len(prefix) - start
+    highlights = [(begin + shift, finish + shift) for begin, finish in matches if start <= begin and finish <= end]
+    return prefix + text[start:end] + ("..." if end < len(text) else ""), highlights
@@ -0,0 +1,142 @@
+from typing import Dict, List, Set
+
+GRAM_LENGTH = 3
+START_OF_NAME = '\x02'
+
+class TrigramIndex:
+    """A TrigramIndex is an inverted index from every 1, 2 and 3 character substring
+    (gram) of a set of names to the names containing it. Grams are taken from the
+    lowercase name, prefixed with START_OF_NAME so that prefix queries have their own grams.
+
+    A query of up to 3 characters is answered by a single posting list. Longer queries
+    intersect the posting lists of their trigrams, and only the names in the intersection
+    are checked against the query.
+    """
+    
+    def __init__(self, *names : str):
+        """Creates a TrigramIndex that contains names
+
+        Args:
+            names (varargs, str): The names to start with
+        """
+        self.ids : Dict[str, int] = dict()
+        self.names : Dict[int, str] = dict()
+        self.lowered : Dict[int, str] = dict()
+        # Postings are dicts used as ordered sets, so that they stay in the order names were added
+        self.postings : Dict[str, Dict[int, None]] = dict()
+        self.next_id = 0
+        for name in names:
+            self.add(name)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, name : str) -> bool:
+        return name in self.ids
+
+    @staticmethod
+    def grams(text : str) -> Set[str]:
+        """Gets every gram of text that is stored in the index
+
+        Args:
+            text (str): The (lowercase, prefixed) text
+
+        Returns:
+            Set[str]: Every substring of text that is 1 to GRAM_LENGTH characters long
+        """
+        return {text[i:i + n] for n in range(1, GRAM_LENGTH + 1) for i in range(len(text) - n + 1)}
+
+    def add(self, name : str) -> bool:
+        """Adds a name to this
+
+        Args:
+            name (str): The name to add
+
+        Returns:
+            bool: True iff the name was added, False if it was already in this
+        """
+        if name in self.ids:
+            return False
+        id = self.next_id
+        self.next_id += 1
+        self.ids[name] = id
+        self.names[id] = name
+        self.lowered[id] = name.lower()
+        for gram in self.grams(START_OF_NAME + self.lowered[id]):
+            self.postings.setdefault(gram, dict())[id] = None
+        return True
+
+    def remove(self, name : str) -> bool:
+        """Removes a name from this
+
+        Args:
+            name (str): The name to remove
+
+        Returns:
+            bool: True iff the name was removed, False if it wasn't in this
+        """
+        id = self.ids.pop(name, None)
+        if id is None:
+            return False
+        del self.names[id]
+        for gram in self.grams(START_OF_NAME + self.lowered.pop(id)):
+            posting = self.postings[gram]
+            del posting[id]
+            if not posting:
+                del self.postings[gram]
+        return True
+
+    def search(self, query : str, prefix : bool = False, ignore_case : bool = False,
+               limit : int | None = None, offset : int = 0) -> List[str]:
+        """Finds the names that contain (or start with) query, in the order they were added
+
+        Args:
+            query (str): The text to look for. An empty query matches every name
+            prefix (bool, optional): Whether names must start with query. Defaults to False.
+            ignore_case (bool, optional): Whether to match regardless of case. Defaults to False.
+            limit (int | None, optional): The most names to return. Defaults to None (no limit).
+            offset (int, optional): The number of matching names to skip. Defaults to 0.
+
+        Returns:
+            List[str]: The matching names
+        """
+        if limit is not None and limit <= 0:
+            return []
+        lowered_query = query.lower()
+        text = START_OF_NAME + lowered_query if prefix else lowered_query
+        
+        # Gather the posting lists, smallest first
+        if len(text) <= GRAM_LENGTH:
+            grams = [text] if text else []
+        else:
+            grams = {text[i:i + GRAM_LENGTH] for i in range(len(text) - GRAM_LENGTH + 1)}
+        postings = []
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if not posting:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = postings[0] if postings else self.names
+        others = postings[1:]
+        
+        # A single short gram is an exact answer for case-insensitive queries
+        exact = ignore_case and len(text) <= GRAM_LENGTH
+        
+        results = []
+        end = offset + limit if limit is not None else None
+        matched = 0
+        for id in candidates:
+            if others and not all(id in posting for posting in others):
+                continue
+            if not exact:
+                name = self.lowered[id] if ignore_case else self.names[id]
+                target = lowered_query if ignore_case else query
+                if not (name.startswith(target) if prefix else target in name):
+                    continue
+            if matched >= offset:
+                results.append(self.names[id])
+            matched += 1
+            if end is not None and matched >= end:
+                break
+        return results
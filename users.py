@@ -1,8 +1,19 @@
+import hmac
 import json
-import random
-from ..common.constants import DEFAULT_USERS, TOKEN_LOWER_BOUND, TOKEN_HIGHER_BOUND
+import secrets
+import threading
+import time
+from ..common.cache import LRUCache
+from ..common.constants import DEFAULT_USERS, DEFAULT_USERS_JOURNAL, DEFAULT_SESSION_TTL, DEFAULT_VERIFY_CACHE_SIZE, DEFAULT_VERIFY_CACHE_TTL
+from ..common.files import write_atomically
+from ..common.locks import RWLock
+from ..common.metrics import timed
+from .journal import Journal
+from .passwords import PasswordHasher, PoolSaturated, is_hashed, verify_password
+from .sessions import Sessions
+from .storage import Storage
 
-from typing import Set, Dict
+from typing import Callable, Dict, Tuple
 
 class User:
     """User is a user in this system, with a name and password
@@ -39,135 +50,352 @@ class User:
         return self.name.__hash__() + self.password.__hash__()
 
 class Users:
-    """Users represents a collection of User objects, with
-    interfacing for login and registration of new users
+    """Users represents a collection of users, with
+    interfacing for login and registration of new users.
+
+    It is safe to use from multiple threads: lookups hold its
+    lock as a reader, and registrations as the writer.
+
+    Only salted hashes of passwords are kept. Legacy plaintext
+    passwords are replaced by their hash the first time their
+    user logs in. Hashing is done on a bounded worker pool, and
+    recent successful logins are cached for a short while so
+    that bursts of logins don't all have to be hashed
     """
-    def __init__(self, users_file : str = DEFAULT_USERS):
-        """Initializes a Users from a database of existing ones
+    @timed("users.load")
+    def __init__(self, users_file : str = DEFAULT_USERS, journal_file : str = DEFAULT_USERS_JOURNAL,
+                 store : Storage | None = None, session_ttl : float = DEFAULT_SESSION_TTL,
+                 hasher : PasswordHasher | None = None):
+        """Initializes a Users from a database of existing ones, and then
+        replays every registration journaled since it was last saved. With
+        a store that keeps users, they are kept there instead, and there is
+        no journal
 
         Args:
             users_file (str, optional): The database to poll the users from.
                                         Defaults to DEFAULT_USERS. The format
                                         must be:
                 {Username : password}
+            journal_file (str, optional): The journal that registrations are
+                                          recorded in. Defaults to DEFAULT_USERS_JOURNAL.
+            store (Storage | None, optional): A write-through storage to keep users in.
+                                              If no users were imported into it yet, it is
+                                              filled from users_file. Ignored if the storage
+                                              doesn't keep users. Defaults to None.
+            session_ttl (float, optional): How long, in seconds, a login lasts without
+                                           being used. Defaults to DEFAULT_SESSION_TTL.
+            hasher (PasswordHasher | None, optional): The pool to hash passwords on.
+                                                      Defaults to None, for a default pool.
         """
-        with open(users_file, "+r") as file:
-            data = json.load(file)
-            self.users : Set[User] = set()
-            self.names : Set[str] = set()
-            for name in data:
-                self.users.add(User(name, data[name]))
-                self.names.add(name)
-            self.active_users : Dict[User, int] = dict()
-            self.active_tokens : Dict[int, User] = dict()
+        self.store = store if store and store.write_through else None
+        data = self.store.read_users() if self.store else None
+        if self.store and data is None:
+            data = self.store.import_users(users_file)
+        if data is None:
+            with open(users_file, "+r") as file:
+                data = json.load(file)
+        # The stored form of each user's password (see passwords.hash_password)
+        self.users : Dict[str, str] = dict(data)
+        self.sessions = Sessions(session_ttl)
+        self.hasher = hasher or PasswordHasher()
+        # Recent successful logins, keyed by an HMAC of the credentials under a key that only
+        # this process knows, so the cache never holds a password (or an offline-crackable hash)
+        self.verified = LRUCache(DEFAULT_VERIFY_CACHE_SIZE)
+        self.verified_key = secrets.token_bytes(32)
+        self.verified_ttl = DEFAULT_VERIFY_CACHE_TTL
+        self.verified_hits = 0
+        self.verified_misses = 0
+        self.users_file = users_file
+        self.lock = RWLock()
+        self.counting = threading.Lock()
+        self.saving = threading.Lock()
+        self.dirty = 0
+        self.on_change : Callable[[int], None] | None = None
+        
+        # Replay every registration (and password upgrade) that happened after the snapshot was taken
+        self.journal = None if self.store else Journal(journal_file)
+        for record in self.journal.replay() if self.journal else ():
+            if record['op'] in ('add_user', 'set_password'):
+                self.users[record['name']] = record['password']
+                self.dirty += 1
 
-    def save(self, users_file : str = DEFAULT_USERS):
-        """Saves the users into a database
+    @timed("users.save")
+    def save(self, users_file : str | None = None) -> Tuple[int, int]:
+        """Saves the users into a database, replacing it atomically, and discards
+        the part of the journal that is now part of the saved file. With a store,
+        everything is saved already, so this does nothing
 
         Args:
-            users_file (str, optional): The database to save the users into.
-                                        Defaults to DEFAULT_USERS.
+            users_file (str | None, optional): The database to save the users into.
+                                               Defaults to the file this was loaded from.
+
+        Returns:
+            Tuple[int, int]: The number of bytes written, and the number of
+            registrations that were saved
         """
-        with open(users_file, "w+") as file:
-            data = dict()
-            for user in self.users:
-                data[user.name] = user.password
-            json.dump(data, file)
+        if self.journal is None:
+            return 0, 0
+        users_file = users_file or self.users_file
+        with self.saving:
+            with self.lock.writing():
+                dirty = self.dirty
+                self.dirty = 0
+                data = dict(self.users)
+                position = self.journal.position()
+            
+            try:
+                written = write_atomically(users_file, [json.dumps(data).encode('utf-8')])
+            except BaseException:
+                with self.lock.writing():
+                    self.dirty += dirty
+                raise
+            
+            self.journal.checkpoint(position)
+            return written, dirty
+
+    def pending_changes(self) -> int:
+        """Gets the number of registrations (and password upgrades) since the last save
+
+        Returns:
+            int: The number of unsaved changes
+        """
+        return self.dirty
         
     def contains_user(self, user : User) -> bool:
-        """Evaluates if a user is in this
+        """Evaluates if a user is in this, with the right password
 
         Args:
             user (User): The user to evaluate
 
+        Raises:
+            PoolSaturated: If the password has to be hashed, and the hashing pool is saturated
+
         Returns:
             bool: True iff user is in this
         """
-        return user in self.users
+        stored = self.get_password(user.name)
+        return stored is not None and self.verify(user, stored)
     
-    def contains_name(self, name : User) -> bool:
+    def contains_name(self, name : str) -> bool:
         """Evaluates if a particular username is contained
         in this
 
         Args:
-            name (User): The username to evaluate
+            name (str): The username to evaluate
 
         Returns:
             true: True iff the username is in this
         """
-        return name in self.names
+        with self.lock.reading():
+            return name in self.users
+
+    def get_password(self, name : str) -> str | None:
+        """Gets the stored form of a user's password
+
+        Args:
+            name (str): The username
+
+        Returns:
+            str | None: The stored password, or None if there is no such user
+        """
+        with self.lock.reading():
+            return self.users.get(name)
     
+    def log(self, record : Dict) -> int | None:
+        """Makes a change durable before it is applied, by journaling it or by recording
+        it in the store. This must be done with the lock held
+
+        Args:
+            record (Dict): The change
+
+        Returns:
+            int | None: The journal sequence number to commit once the lock is released,
+            or None if the change is durable already
+        """
+        if self.journal is None:
+            self.store.record(record)
+            return None
+        self.dirty += 1
+        return self.journal.write(record)
+
+    def sync(self, sequence : int | None):
+        """Waits for a logged change to be durable, without the lock held, and
+        then reports the change
+
+        Args:
+            sequence (int | None): What log returned
+        """
+        if sequence is not None:
+            self.journal.commit(sequence)
+        if self.on_change:
+            self.on_change(self.dirty)
+
+    @timed("users.add_user")
     def add_user(self, user : User) -> bool:
-        """Adds a user to this
+        """Adds a user to this, hashing their password on the hashing pool
 
         Args:
             user (User): The user to add
 
+        Raises:
+            PoolSaturated: If the hashing pool is saturated
+
         Returns:
             bool: True iff the user has been added.
             False when another user with the same
             name exists
         """
-        if user in self.users:
+        if self.contains_name(user.name):
+            return False
+        stored = self.hasher.hash(user.password)
+        with self.lock.writing():
+            if user.name in self.users:
+                return False
+            sequence = self.log({'op' : 'add_user', 'name' : user.name, 'password' : stored})
+            self.users[user.name] = stored
+        self.sync(sequence)
+        # Registering logs the user in right away, which shouldn't have to hash again
+        self.verified.put(self.cache_key(user), (stored, time.monotonic() + self.verified_ttl))
+        return True
+
+    def cache_key(self, user : User) -> bytes:
+        """Gets the key of a user's credentials in the login cache
+
+        Args:
+            user (User): The user, with their password
+
+        Returns:
+            bytes: The HMAC of their name and password
+        """
+        credentials = f"{len(user.name)}:{user.name}{user.password}".encode('utf-8')
+        return hmac.new(self.verified_key, credentials, 'sha256').digest()
+
+    def verify(self, user : User, stored : str) -> bool:
+        """Checks the password of a user against its stored form. Successful checks are
+        cached for a short while, as long as the stored form doesn't change
+
+        Args:
+            user (User): The user, with the password to check
+            stored (str): The stored form of their real password
+
+        Raises:
+            PoolSaturated: If the password has to be hashed, and the hashing pool is saturated
+
+        Returns:
+            bool: True iff the password is correct
+        """
+        if not is_hashed(stored):
+            return verify_password(user.password, stored)
+        key = self.cache_key(user)
+        now = time.monotonic()
+        cached = self.verified.get(key)
+        if cached and cached[0] == stored and cached[1] > now:
+            with self.counting:
+                self.verified_hits += 1
+            return True
+        with self.counting:
+            self.verified_misses += 1
+        if not self.hasher.verify(user.password, stored):
             return False
-        self.users.add(user)
-        self.names.add(user.name)
+        self.verified.put(key, (stored, now + self.verified_ttl))
         return True
 
-    def login(self, user : User) -> int | None:
+    def upgrade(self, user : User, stored : str):
+        """Replaces a legacy plaintext password with its hash. If the hashing pool is
+        saturated, this is left for the next login
+
+        Args:
+            user (User): The user, with their (verified) password
+            stored (str): The plaintext password that is stored for them
+        """
+        try:
+            hashed = self.hasher.hash(user.password)
+        except PoolSaturated:
+            return
+        with self.lock.writing():
+            if self.users.get(user.name) != stored:
+                return
+            sequence = self.log({'op' : 'set_password', 'name' : user.name, 'password' : hashed})
+            self.users[user.name] = hashed
+        self.sync(sequence)
+
+    @timed("users.login")
+    def login(self, user : User) -> str | None:
         """Logs a user into this
 
         Args:
             user (User): The user to log into
 
         Returns:
-            int | None: The token given to access
+            str | None: The token given to access
             this profile, None if the user is invalid.
+
+        Raises:
+            PoolSaturated: If the password has to be hashed,
+            and the hashing pool is saturated
         
-        The user is now active if a token was returned
+        The user is now active if a token was returned,
+        until the token goes unused for the session ttl.
+        The session holds the stored form of the password,
+        never the password itself
         """
-        if user in self.users:
-            # Generate non-duplicate token
-            generated_token = random.randint(TOKEN_LOWER_BOUND, TOKEN_HIGHER_BOUND)
-            while generated_token in self.active_tokens:
-                generated_token = random.randint(TOKEN_LOWER_BOUND, TOKEN_HIGHER_BOUND)
-            
-            # Register token into this
-            if not user in self.active_users:
-                self.active_users[user] = {generated_token}
-            else:
-                self.active_users[user].add(generated_token)
-            self.active_tokens[generated_token] = user
-            return generated_token
-        return None
+        stored = self.get_password(user.name)
+        if stored is None or not self.verify(user, stored):
+            return None
+        if not is_hashed(stored):
+            self.upgrade(user, stored)
+        return self.sessions.create(User(user.name, self.get_password(user.name)))
+
+    def session_stats(self) -> Dict[str, int | float]:
+        """Gets statistics about login sessions
+
+        Returns:
+            Dict[str, int | float]: See Sessions.stats
+        """
+        return self.sessions.stats()
+
+    def auth_stats(self) -> Dict[str, Dict[str, int | float]]:
+        """Gets statistics about password hashing and the login cache
+
+        Returns:
+            Dict[str, Dict[str, int | float]]: The statistics of the hashing pool (see
+            PasswordHasher.stats), and the size, capacity, hits, misses, hit_rate and
+            ttl of the cache of successful logins
+        """
+        with self.counting:
+            hits, misses = self.verified_hits, self.verified_misses
+        lookups = hits + misses
+        return {'hashing' : self.hasher.stats(),
+                'login_cache' : {'size' : len(self.verified), 'capacity' : self.verified.capacity,
+                                 'hits' : hits, 'misses' : misses,
+                                 'hit_rate' : hits / lookups if lookups else 0.0,
+                                 'ttl' : self.verified_ttl}}
     
-    def logout(self, token : int) -> bool:
+    @timed("users.logout")
+    def logout(self, token : str) -> bool:
         """Logs a user out
 
         Args:
-            token (int): The token corresponding to the user to logout
+            token (str): The token corresponding to the user to logout
 
         Returns:
             bool: True iff the logout succeeded
         """
-        if token in self.active_tokens:
-            user = self.active_tokens[token]
-            self.active_tokens.pop(token)
-            self.active_users.get(user).remove(token)
-            if not self.active_users[user]:
-                del self.active_users[user]
-            return True
-        return False
+        return isinstance(token, str) and self.sessions.end(token)
     
-    def validate_user(self, token : int) -> User | None:
-        """Validates a token and returns user information
+    @timed("users.validate_user")
+    def validate_user(self, token : str) -> User | None:
+        """Validates a token and returns user information,
+        renewing the token
 
         Args:
-            token (int): The token to evaluate
+            token (str): The token to evaluate
 
         Returns:
             User | None: The user corresponding with the access
             token, or None if token doesn't correspond to any
             active user.
         """
-        return self.active_tokens.get(token, None)
\ No newline at end of file
+        if not isinstance(token, str):
+            return None
+        return self.sessions.validate(token)